@@ -1,13 +1,16 @@
 from flask import Flask
 from flask_cors import CORS
 
+from .ai.warmup import warmup as ai_warmup
 from .api_bp import api_bp
 
-def create_app() -> Flask:
-    """Application factory."""
+def create_app(warmup: bool = True) -> Flask:
+    """Application factory; with `warmup`, configured pipelines start loading in the background."""
     app = Flask(__name__)
     # Allow frontend dev server to call the API during development.
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     app.register_blueprint(api_bp, url_prefix="/api")
+    if warmup:
+        ai_warmup.start()
 
     return app
\ No newline at end of file
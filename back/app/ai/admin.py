@@ -0,0 +1,21 @@
+"""Access check of the admin endpoints (profiling, cache pre-population)."""
+
+import hmac
+
+from flask import jsonify, request
+
+from .. import config
+
+
+def _authorized() -> bool:
+    supplied = request.headers.get("Authorization", "")
+    return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {config.ADMIN_TOKEN}".encode("utf-8"))
+
+
+def admin_error():
+    """Error response when the caller may not use the admin endpoints, else None."""
+    if not config.ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoints are disabled"}), 404
+    if not _authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    return None
@@ -0,0 +1,225 @@
+"""Admission control for generation traffic.
+
+Generations share one device, so running more of them at once only trades throughput for OOMs. The
+controller admits at most `max_active` generations, keeps at most `max_queued` waiting, and caps how many
+requests a single client may have queued or running. Requests that cannot be admitted are rejected up front
+with a `Retry-After` estimate instead of piling up.
+
+Waiting requests are ordered by lane (`preview` before `standard` before `batch`), then by arrival. A request
+gains one lane of priority for every `aging_s` seconds it waits, so batch jobs are delayed but never starved.
+The `background` lane, used by the cache pre-population job, comes last and does not age: it only gets a slot
+when no live request is waiting, and is left out of the wait estimates of live requests.
+"""
+
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from flask import g, has_app_context, jsonify, request
+
+from .. import config
+from .cancellation import CancellationToken
+from .profiling import stage
+
+LANES = ("preview", "standard", "batch", "background")
+BACKGROUND = "background"
+LIVE_LANES = LANES[:-1]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    client_id: str
+    lane: str
+    seq: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    admitted_at: Optional[float] = None
+
+    @property
+    def wait_time(self) -> float:
+        return (self.admitted_at or time.monotonic()) - self.enqueued_at
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_active: int = config.QUEUE_MAX_ACTIVE,
+        max_queued: int = config.QUEUE_DEPTH,
+        per_client: int = config.QUEUE_CLIENT_CONCURRENCY,
+        timeout_s: float = config.QUEUE_TIMEOUT_S,
+        aging_s: float = config.QUEUE_AGING_S,
+    ):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.per_client = per_client
+        self.timeout_s = timeout_s
+        self.aging_s = aging_s
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queue: List[Ticket] = []
+        self._active = 0
+        self._per_client: Dict[str, int] = {}
+        # Exponential moving averages, seeded with a typical 30-step 512x512 generation.
+        self._service_s = {lane: 10.0 for lane in LANES}
+        self._wait_s = {lane: 0.0 for lane in LANES}
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+
+    # ---- Estimates ----
+    def _mean_service_s(self) -> float:
+        return sum(self._service_s[lane] for lane in LIVE_LANES) / len(LIVE_LANES)
+
+    def estimated_wait(self, extra: int = 0) -> float:
+        """Seconds a live request arriving now would wait before being admitted."""
+        with self._cond:
+            queued = sum(ticket.lane != BACKGROUND for ticket in self._queue)
+            backlog = queued + extra + max(0, self._active - self.max_active + 1)
+            return backlog * self._mean_service_s() / self.max_active
+
+    def _retry_after(self) -> int:
+        backlog = len(self._queue) + self._active
+        return max(1, math.ceil(backlog * self._mean_service_s() / self.max_active))
+
+    # ---- Queue ----
+    def _rank(self, ticket: Ticket, now: float):
+        aged = (now - ticket.enqueued_at) / self.aging_s if self.aging_s > 0 and ticket.lane != BACKGROUND else 0.0
+        return (LANES.index(ticket.lane) - aged, ticket.seq)
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        if not self._queue or self._active >= self.max_active:
+            return None
+        now = time.monotonic()
+        return min(self._queue, key=lambda ticket: self._rank(ticket, now))
+
+    def _reject(self, lane: str, reason: str):
+        self._rejected[lane] += 1
+        raise AdmissionRejected(reason, self._retry_after())
+
+    def _enqueue(self, client_id: str, lane: str) -> Ticket:
+        with self._cond:
+            if self._per_client.get(client_id, 0) >= self.per_client:
+                self._reject(lane, "too many concurrent requests for this client")
+            if len(self._queue) >= self.max_queued:
+                self._reject(lane, "generation queue is full")
+            ticket = Ticket(client_id=client_id, lane=lane, seq=next(self._seq))
+            self._queue.append(ticket)
+            self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+            return ticket
+
+    def _wait_turn(self, ticket: Ticket, token: Optional[CancellationToken]):
+        deadline = ticket.enqueued_at + self.timeout_s
+        with self._cond:
+            while self._next_ticket() is not ticket:
+                if token is not None:
+                    token.raise_if_cancelled()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(ticket.lane, "timed out waiting in the generation queue")
+                # Wake up periodically: aging can change the order without anyone notifying.
+                self._cond.wait(timeout=min(remaining, 1.0))
+            self._queue.remove(ticket)
+            self._active += 1
+            ticket.admitted_at = time.monotonic()
+            self._admitted[ticket.lane] += 1
+            self._wait_s[ticket.lane] = 0.8 * self._wait_s[ticket.lane] + 0.2 * ticket.wait_time
+            # The head of the queue changed; another free slot may now belong to someone else.
+            self._cond.notify_all()
+
+    def _leave(self, ticket: Ticket):
+        """Drop `ticket` from the queue or the active set. Callers hold `_cond`."""
+        if ticket.admitted_at is None:
+            self._queue.remove(ticket)
+        else:
+            self._active -= 1
+            service_s = time.monotonic() - ticket.admitted_at
+            self._service_s[ticket.lane] = 0.8 * self._service_s[ticket.lane] + 0.2 * service_s
+        self._per_client[ticket.client_id] -= 1
+        if not self._per_client[ticket.client_id]:
+            del self._per_client[ticket.client_id]
+        self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, client_id: str, lane: str, token: Optional[CancellationToken] = None):
+        """Wait for a generation slot. Raises `AdmissionRejected` when the request cannot be admitted, and
+        `GenerationCancelled` when `token` is cancelled while waiting.
+
+        Within a request, the admitted ticket is also recorded on `flask.g` so the route can report its queue wait.
+        """
+        ticket = self._enqueue(client_id, lane)
+        if has_app_context():
+            g.queue_ticket = ticket
+        try:
+            with stage("queue"):
+                self._wait_turn(ticket, token)
+            yield ticket
+        finally:
+            with self._cond:
+                self._leave(ticket)
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "max_active": self.max_active,
+                "queued": len(self._queue),
+                "max_queued": self.max_queued,
+                "queued_by_lane": {lane: sum(t.lane == lane for t in self._queue) for lane in LANES},
+                "avg_wait_s": {lane: round(v, 3) for lane, v in self._wait_s.items()},
+                "avg_service_s": {lane: round(v, 3) for lane, v in self._service_s.items()},
+                "admitted": dict(self._admitted),
+                "rejected": dict(self._rejected),
+            }
+
+
+admission = AdmissionController()
+
+
+# ---- Request helpers ----
+def client_id() -> str:
+    """Admission client of the current request: its remote address, or the client a trusted proxy names."""
+    if request.remote_addr in config.TRUSTED_PROXIES and request.headers.get("X-Client-Id"):
+        return request.headers["X-Client-Id"]
+    return request.remote_addr or "anonymous"
+
+
+def lane_for(payload: dict, steps: int, width: int, height: int) -> str:
+    """Pick the lane from the request cost; an explicit `priority` may lower the lane (within the live lanes) but
+    never raise it."""
+    cost = steps * (width * height) / (512 * 512)
+    if cost <= config.QUEUE_PREVIEW_MAX_COST:
+        lane = "preview"
+    elif cost >= config.QUEUE_BATCH_MIN_COST:
+        lane = "batch"
+    else:
+        lane = "standard"
+    requested = payload.get("priority")
+    if requested in LIVE_LANES and LANES.index(requested) > LANES.index(lane):
+        lane = requested
+    return lane
+
+
+def rejected_response(error: AdmissionRejected):
+    response = jsonify({"error": error.reason, "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def add_queue_headers(response):
+    """Report the lane and queue wait of the request's generation, if it ran one."""
+    ticket = g.get("queue_ticket")
+    if ticket is not None:
+        response.headers["X-Queue-Lane"] = ticket.lane
+        response.headers["X-Queue-Wait-Ms"] = str(int(ticket.wait_time * 1000))
+    return response
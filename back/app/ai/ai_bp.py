@@ -3,10 +3,23 @@
 from flask import Blueprint
 
 from .baseModel import route_baseModel
+from .images import route_image
+from .prepopulate import route_prepopulate
+from .profiling import profiled, route_profile, route_profile_artefact
+from .status import route_node, route_queue
 from .trainedModel import route_trainedModel
+from .variations import route_upscale, route_variation
 
 ai_bp = Blueprint("ai", __name__)
 
-ai_bp.add_url_rule("/baseModel", view_func=route_baseModel, methods=["POST"])
-ai_bp.add_url_rule("/trainedModel", view_func=route_trainedModel, methods=["POST"])
+ai_bp.add_url_rule("/baseModel", view_func=profiled(route_baseModel), methods=["POST"])
+ai_bp.add_url_rule("/trainedModel", view_func=profiled(route_trainedModel), methods=["POST"])
+ai_bp.add_url_rule("/variation", view_func=profiled(route_variation), methods=["POST"])
+ai_bp.add_url_rule("/upscale", view_func=profiled(route_upscale), methods=["POST"])
+ai_bp.add_url_rule("/queue", view_func=route_queue, methods=["GET"])
+ai_bp.add_url_rule("/node", view_func=route_node, methods=["GET"])
+ai_bp.add_url_rule("/images/<digest>.png", endpoint="image", view_func=route_image, methods=["GET"])
 
+ai_bp.add_url_rule("/admin/profile", view_func=route_profile, methods=["GET", "POST", "DELETE"])
+ai_bp.add_url_rule("/admin/profile/<path:name>", view_func=route_profile_artefact, methods=["GET"])
+ai_bp.add_url_rule("/admin/prepopulate", view_func=route_prepopulate, methods=["POST"])
@@ -1,12 +1,15 @@
-from flask import jsonify, request, send_file
-from diffusers import StableDiffusionPipeline
-import torch
-import io
-from typing import Dict
-from PIL import Image
+from flask import jsonify, request
+
+from .admission import add_queue_headers, admission, lane_for
+from .cancellation import request_token
+from .degradation import add_effective_headers, degrade, exact_params
+from .generation import generate_image, serve_generation
+from .images import image_response
+from .latent_cache import CachedLatents
+from .prompt_index import prompt_index, prompt_scope
+from .result_cache import base_cache_key, example_cache
+from .variants import add_deepcache_headers, cache_interval, cache_key_suffix, tome_key_suffix, tome_ratio
 
-# ---- LAZY CACHE ----
-example_cache: Dict[str, Image.Image] = {}
 
 def route_baseModel():
     
@@ -22,45 +25,62 @@ def route_baseModel():
 
     if not prompt:
         return jsonify({"error": "Prompt required"}), 400
+    try:
+        merge_ratio = tome_ratio(payload)
+        feature_interval = cache_interval(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # ---- Effective parameters under load ----
+    exact = exact_params(steps, width, height)
+    params = degrade(payload, steps, width, height, admission.estimated_wait())
+    variant_suffix = tome_key_suffix(merge_ratio) + cache_key_suffix(feature_interval)
+
+    def make_cache_key(p):
+        return base_cache_key(prompt, p.steps, cfg_scale, seed, p.width, p.height, p.key_suffix + variant_suffix)
+
+    # An exact render already in the cache beats a degraded one.
+    if params.level and make_cache_key(exact) in example_cache:
+        params = exact
+    cache_key = make_cache_key(params)
+
+    lane = lane_for(payload, params.steps, params.render_width, params.render_height)
+    scope = prompt_scope("base", width, height)
+    token = request_token(params.steps)
+
+    measured = {}
+
+    def render(entry, callback):
+        from .device import make_generator
+
+        with entry.scheduler(params.scheduler), entry.token_merging(
+            merge_ratio, params.render_width, params.render_height
+        ), entry.feature_cache(feature_interval) as run:
+            image = entry(
+                prompt=prompt,
+                num_inference_steps=params.steps,
+                guidance_scale=cfg_scale,
+                width=params.render_width,
+                height=params.render_height,
+                generator=make_generator(seed),
+                callback_on_step_end=callback,
+            ).images[0]
+        measured["run"] = run
+        return params.upscale(image)
+
+    # Kept for /variation and /upscale; the latents of a degraded render do not match the returned image.
+    latents = None if params.level else CachedLatents(None, "base", prompt, "", cfg_scale)
+
+    def generate(flight_token):
+        return generate_image("base", cache_key, render, lane, flight_token, "Base image", latents)
+
+    preview = (prompt, scope) if payload.get("preview") else None
+    digest, response = serve_generation(cache_key, generate, token, "Base image", preview)
+    if response is not None:
+        return response
 
-    generator = None
-    if seed != -1:
-        generator = torch.Generator(device="cuda").manual_seed(seed)
-
-    cache_key = f"base::{prompt}::{steps}::{cfg_scale}::{seed}::{width}::{height}"
-
-    if cache_key in example_cache:
-        print("Base image served from cache")
-        image = example_cache[cache_key]
-    else:
-                
-        model_id = "runwayml/stable-diffusion-v1-5"
-
-        pipe = StableDiffusionPipeline.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16,
-            device_map="cuda"
-        )
-        pipe.enable_attention_slicing()
-
-        print("Base model loaded")
-        
-        print("Base image generated (cache miss)")
-        image = pipe(
-            prompt=prompt,
-            num_inference_steps=steps,
-            guidance_scale=cfg_scale,
-            width=width,
-            height=height,
-            generator=generator,
-        ).images[0]
-        example_cache[cache_key] = image
-
-    img_io = io.BytesIO()
-    image.save(img_io, "PNG")
-    img_io.seek(0)
-
-    torch.cuda.empty_cache()
-
-    return send_file(img_io, mimetype="image/png")
+    prompt_index.add(prompt, scope, digest)
+    response = add_queue_headers(image_response(digest))
+    response = add_effective_headers(response, params)
+    return add_deepcache_headers(response, measured.get("run"))
 
@@ -0,0 +1,158 @@
+"""Cancellation of generations whose result nobody will read.
+
+Each generation request carries a `CancellationToken`. It is cancelled when the client disconnects or the
+request deadline passes. The token is checked while the request waits for a generation slot and from the
+pipeline's per-step callback: cancelling raises `GenerationCancelled` out of the denoising loop, which skips
+the remaining steps and the VAE decode and releases the request's tensors immediately.
+
+Requests coalesced onto one generation share a `TokenGroup`, which only cancels once every member has.
+"""
+
+import math
+import socket
+import threading
+import time
+from concurrent.futures import CancelledError
+from typing import Dict, List, Optional
+
+from flask import abort, jsonify, make_response, request
+
+from .. import config
+
+
+class GenerationCancelled(CancelledError):
+    def __init__(self, reason: str, steps_saved: int = 0):
+        super().__init__(reason)
+        self.reason = reason
+        self.steps_saved = steps_saved
+
+
+def client_disconnected(environ: dict) -> bool:
+    """Whether the client of a WSGI request has closed its connection (werkzeug and gunicorn servers)."""
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    flags = getattr(socket, "MSG_DONTWAIT", None)
+    if sock is None or flags is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | flags) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+class CancellationToken:
+    def __init__(self, deadline: Optional[float] = None, environ: Optional[dict] = None, steps: int = 0):
+        self.deadline = deadline
+        self.steps = steps
+        self._environ = environ
+        self._reason: Optional[str] = None
+
+    def cancel(self, reason: str = "cancelled"):
+        self._reason = self._reason or reason
+
+    @property
+    def cancelled(self) -> Optional[str]:
+        """Reason the token is cancelled, or None while it is live."""
+        if self._reason is None:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self._reason = "deadline exceeded"
+            elif self._environ is not None and client_disconnected(self._environ):
+                self._reason = "client disconnected"
+        return self._reason
+
+    def raise_if_cancelled(self, steps_saved: Optional[int] = None):
+        """Raise `GenerationCancelled` if cancelled. `steps_saved` defaults to all of the request's steps."""
+        reason = self.cancelled
+        if reason is not None:
+            steps_saved = self.steps if steps_saved is None else steps_saved
+            stats.record(reason, steps_saved)
+            raise GenerationCancelled(reason, steps_saved)
+
+    def step_callback(self):
+        """`callback_on_step_end` for diffusers pipelines that aborts the denoising loop once cancelled."""
+
+        def callback(pipe, step_index, timestep, callback_kwargs):
+            self.raise_if_cancelled(steps_saved=self.steps - step_index - 1)
+            return callback_kwargs
+
+        return callback
+
+
+class TokenGroup(CancellationToken):
+    """Token of a coalesced generation: cancelled once all of its members are."""
+
+    def __init__(self, tokens: List[CancellationToken]):
+        super().__init__(steps=tokens[0].steps if tokens else 0)
+        self._lock = threading.Lock()
+        self._tokens = list(tokens)
+
+    def add(self, token: CancellationToken):
+        with self._lock:
+            self._tokens.append(token)
+
+    def discard(self, token: CancellationToken):
+        with self._lock:
+            if token in self._tokens:
+                self._tokens.remove(token)
+
+    @property
+    def cancelled(self) -> Optional[str]:
+        if self._reason is None:
+            with self._lock:
+                reasons = [token.cancelled for token in self._tokens]
+            if reasons and all(reasons):
+                self._reason = reasons[0]
+        return self._reason
+
+
+def request_token(steps: int) -> CancellationToken:
+    """Token for the current request, which runs `steps` denoising steps.
+
+    The deadline is relative to the request's arrival, from the `deadline_ms` payload field, the
+    `X-Request-Deadline-Ms` header, or `AI_REQUEST_DEADLINE_S`. A deadline that is not a positive number of
+    milliseconds aborts the request with 400.
+    """
+    payload = request.get_json(silent=True) or {}
+    deadline_ms = payload.get("deadline_ms")
+    if deadline_ms is None:
+        deadline_ms = request.headers.get("X-Request-Deadline-Ms")
+    if deadline_ms is None or deadline_ms == "":
+        budget_s = config.REQUEST_DEADLINE_S
+    else:
+        try:
+            budget_s = float(deadline_ms) / 1000
+        except (TypeError, ValueError):
+            budget_s = math.nan
+        if isinstance(deadline_ms, bool) or not math.isfinite(budget_s) or budget_s <= 0:
+            error = jsonify({"error": "deadline_ms must be a positive number of milliseconds"})
+            abort(make_response(error, 400))
+    deadline = time.monotonic() + budget_s if budget_s > 0 else None
+    return CancellationToken(deadline=deadline, environ=request.environ, steps=steps)
+
+
+def cancelled_response(error: GenerationCancelled):
+    response = jsonify({"error": error.reason, "steps_saved": error.steps_saved})
+    # 499 (client closed request) mirrors nginx; nobody reads it, but it keeps access logs honest.
+    response.status_code = 504 if error.reason == "deadline exceeded" else 499
+    return response
+
+
+class CancellationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled: Dict[str, int] = {}
+        self.steps_saved = 0
+
+    def record(self, reason: str, steps_saved: int):
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            self.steps_saved += steps_saved
+        print(f"Generation cancelled ({reason}), {steps_saved} denoising steps saved")
+
+    def as_dict(self) -> Dict[str, object]:
+        with self._lock:
+            return {"cancelled": dict(self.cancelled), "steps_saved": self.steps_saved}
+
+
+stats = CancellationStats()
@@ -0,0 +1,143 @@
+"""Step-level UNet feature caching (DeepCache).
+
+High-level UNet features change little between consecutive denoising steps. With an interval of N, every N-th
+UNet call runs the whole network and keeps the output of the second-to-last up block. The calls in between
+only run the shallow branch (`conv_in`, the first down block and the last up block), reusing the cached deep
+features in place of everything underneath. This follows "DeepCache: Accelerating Diffusion Models for Free"
+(Ma et al., 2023) with the shallowest branch and a uniform schedule.
+
+An interval of 1 (or 0) disables caching. The speedup of each call is measured against the time of its full
+steps and returned in `DeepCacheRun.speedup`.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import torch
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+from diffusers.utils import USE_PEFT_BACKEND, scale_lora_layers, unscale_lora_layers
+
+from .variants import DeepCacheRun
+
+
+class DeepCache:
+    def __init__(self, unet):
+        self.unet = unet
+        self.run: Optional[DeepCacheRun] = None
+        self._features: Optional[torch.Tensor] = None
+        self._wrapped_forward = None
+
+    @property
+    def interval(self) -> int:
+        return self.run.interval if self.run is not None else 0
+
+    @contextmanager
+    def active(self, interval: int):
+        """Cache deep features for `interval` UNet calls at a time while the block runs; yields the run stats."""
+        self.run = DeepCacheRun(interval=interval)
+        keep_features = self.unet.up_blocks[-2].register_forward_hook(self._keep_features)
+        # An instance attribute shadows `forward` for `unet(...)` calls only while the block runs. A wrapper
+        # already installed that way (accelerate hooks) keeps running the full steps.
+        self._wrapped_forward = self.unet.__dict__.get("forward")
+        self.unet.forward = self._forward
+        try:
+            yield self.run
+        finally:
+            if self._wrapped_forward is not None:
+                self.unet.forward = self._wrapped_forward
+            else:
+                del self.unet.forward
+            keep_features.remove()
+            self._features = None
+            self.run = None
+
+    def _keep_features(self, module, args, output):
+        self._features = output
+
+    def _synchronize(self):
+        if self.unet.device.type == "cuda":
+            torch.cuda.synchronize(self.unet.device)
+
+    def _forward(self, sample, timestep, encoder_hidden_states, *args, **kwargs):
+        run = self.run
+        full = self._features is None or (run.full_calls + run.cached_calls) % run.interval == 0
+        self._synchronize()
+        start = time.perf_counter()
+        if full:
+            forward = self._wrapped_forward or type(self.unet).forward.__get__(self.unet)
+            output = forward(sample, timestep, encoder_hidden_states, *args, **kwargs)
+        else:
+            output = self._shallow_forward(sample, timestep, encoder_hidden_states, **kwargs)
+        self._synchronize()
+        elapsed = time.perf_counter() - start
+        if full:
+            run.full_calls += 1
+            run.full_time_s += elapsed
+        else:
+            run.cached_calls += 1
+            run.cached_time_s += elapsed
+        return output
+
+    def _shallow_forward(
+        self,
+        sample,
+        timestep,
+        encoder_hidden_states,
+        timestep_cond=None,
+        attention_mask=None,
+        cross_attention_kwargs=None,
+        return_dict: bool = True,
+        **kwargs,
+    ):
+        """The UNet forward pass restricted to the shallow branch, on top of the cached deep features."""
+        unet = self.unet
+        lora_scale = 1.0
+        if cross_attention_kwargs is not None:
+            cross_attention_kwargs = cross_attention_kwargs.copy()
+            lora_scale = cross_attention_kwargs.pop("scale", 1.0)
+        if USE_PEFT_BACKEND:
+            scale_lora_layers(unet, lora_scale)
+
+        emb = unet.time_embedding(unet.get_time_embed(sample=sample, timestep=timestep), timestep_cond)
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+
+        hidden_states = unet.conv_in(sample)
+        res_samples = (hidden_states,)
+        down_block = unet.down_blocks[0]
+        if getattr(down_block, "has_cross_attention", False):
+            hidden_states, block_res_samples = down_block(
+                hidden_states=hidden_states,
+                temb=emb,
+                encoder_hidden_states=encoder_hidden_states,
+                attention_mask=attention_mask,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            hidden_states, block_res_samples = down_block(hidden_states=hidden_states, temb=emb)
+        res_samples += block_res_samples
+
+        up_block = unet.up_blocks[-1]
+        skip_samples = res_samples[: len(up_block.resnets)]
+        if getattr(up_block, "has_cross_attention", False):
+            hidden_states = up_block(
+                hidden_states=self._features,
+                temb=emb,
+                res_hidden_states_tuple=skip_samples,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+                attention_mask=attention_mask,
+            )
+        else:
+            hidden_states = up_block(hidden_states=self._features, temb=emb, res_hidden_states_tuple=skip_samples)
+
+        if unet.conv_norm_out is not None:
+            hidden_states = unet.conv_act(unet.conv_norm_out(hidden_states))
+        hidden_states = unet.conv_out(hidden_states)
+
+        if USE_PEFT_BACKEND:
+            unscale_lora_layers(unet, lora_scale)
+        if not return_dict:
+            return (hidden_states,)
+        return UNet2DConditionOutput(sample=hidden_states)
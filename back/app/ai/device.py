@@ -0,0 +1,140 @@
+"""Device, dtype and CPU runtime selection for inference."""
+
+import glob
+import os
+from functools import lru_cache
+from typing import List, Optional
+
+import torch
+from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+from .. import config
+
+DTYPES = {
+    "float16": torch.float16,
+    "fp16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "bf16": torch.bfloat16,
+    "float32": torch.float32,
+    "fp32": torch.float32,
+}
+
+
+@lru_cache(maxsize=None)
+def inference_device() -> torch.device:
+    if config.DEVICE != "auto":
+        return torch.device(config.DEVICE)
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+@lru_cache(maxsize=None)
+def inference_dtype() -> torch.dtype:
+    if config.DTYPE != "auto":
+        return DTYPES[config.DTYPE]
+    # Half precision on accelerators; CPU kernels are fastest (and int8-quantisable) in float32.
+    return torch.float32 if inference_device().type == "cpu" else torch.float16
+
+
+def make_generator(seed: int) -> Optional[torch.Generator]:
+    """Seeded generator for the inference device, or None for a random seed (-1).
+
+    The same seed reproduces the same image on a given device type. MPS has no device-side generator, so its
+    noise is drawn on the CPU like diffusers does.
+    """
+    if seed == -1:
+        return None
+    device = inference_device()
+    generator_device = "cpu" if device.type == "mps" else device
+    return torch.Generator(device=generator_device).manual_seed(seed)
+
+
+# ---- CPU runtime ----
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Parse a kernel cpulist such as `0-3,8-11`."""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _numa_nodes() -> List[List[int]]:
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cpus = _parse_cpulist(f.read())
+        if cpus:
+            nodes.append(cpus)
+    return nodes
+
+
+def _worker_cpus(worker_index: int, num_workers: int) -> List[int]:
+    """CPUs for one worker: workers are spread over NUMA nodes, then share their node's cores evenly."""
+    available = sorted(os.sched_getaffinity(0))
+    nodes = [[cpu for cpu in node if cpu in available] for node in _numa_nodes()]
+    nodes = [node for node in nodes if node] or [available]
+
+    node = nodes[worker_index % len(nodes)]
+    workers_on_node = len(range(worker_index % len(nodes), num_workers, len(nodes)))
+    slot = worker_index // len(nodes)
+    share = max(1, len(node) // max(1, workers_on_node))
+    return node[slot * share:(slot + 1) * share] or node
+
+
+_runtime_configured = False
+
+
+def configure_cpu_runtime():
+    """Pin this worker's CPU affinity and size the intra-op / inter-op thread pools. Runs once per process.
+
+    Pinning keeps a worker on one NUMA node, so its first-touch allocations (the model weights) stay local.
+    """
+    global _runtime_configured
+    if _runtime_configured:
+        return
+    _runtime_configured = True
+
+    if config.CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+        if config.CPU_AFFINITY == "auto":
+            cpus = _worker_cpus(config.WORKER_INDEX, config.WORKERS)
+        else:
+            cpus = _parse_cpulist(config.CPU_AFFINITY)
+        os.sched_setaffinity(0, cpus)
+        print(f"Worker {config.WORKER_INDEX} pinned to CPUs {cpus}")
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    torch.set_num_threads(config.CPU_THREADS or cores)
+    try:
+        torch.set_num_interop_threads(config.CPU_INTEROP_THREADS or 1)
+    except RuntimeError:
+        # Only settable before the first inter-op parallel work in the process.
+        print("Inter-op thread count already fixed for this process")
+
+
+def quantize_for_cpu(pipe):
+    """Dynamic int8 quantisation of the UNet and text-encoder linear layers.
+
+    LoRA adapter matrices are left in float so adapters keep working at runtime.
+    """
+    if inference_dtype() != torch.float32:
+        print("Skipping int8 quantisation: dynamic quantisation needs float32 weights")
+        return pipe
+
+    for model in (pipe.unet, pipe.text_encoder):
+        qconfig_spec = {
+            name: default_dynamic_qconfig
+            for name, module in model.named_modules()
+            if type(module) is torch.nn.Linear and "lora_" not in name
+        }
+        quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+    print("UNet and text encoder quantised to int8")
+    return pipe
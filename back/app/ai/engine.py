@@ -0,0 +1,136 @@
+"""Compiled inference engine for Stable Diffusion pipelines.
+
+The engine prepares a pipeline once (SDPA attention, channels_last) and wraps the UNet and the VAE decode in
+`torch.compile`. Compiled graphs are tracked per shape key `(height, width, unet batch, dtype)`: only keys that
+were pre-warmed (or compiled on demand, when enabled) run through the compiled modules, every other shape runs
+eagerly so that a request never pays an unexpected recompilation.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from typing import Dict, Iterable, Set, Tuple
+
+import torch
+from diffusers.models.attention_processor import AttnProcessor2_0
+
+from .. import config
+
+ShapeKey = Tuple[int, int, int, str]
+
+
+class InferenceEngine:
+    """Runs a pipeline through compiled UNet / VAE decode graphs when the request shape allows it."""
+
+    def __init__(
+        self,
+        pipe,
+        compile_mode: str = config.ENGINE_COMPILE_MODE,
+        max_graphs: int = config.ENGINE_MAX_GRAPHS,
+        compile_on_demand: bool = config.ENGINE_COMPILE_ON_DEMAND,
+    ):
+        self.pipe = pipe
+        self.max_graphs = max_graphs
+        self.compile_on_demand = compile_on_demand
+
+        # Fused scaled-dot-product attention everywhere; slicing trades speed for memory and is not wanted here.
+        pipe.disable_attention_slicing()
+        pipe.unet.set_attn_processor(AttnProcessor2_0())
+        pipe.vae.set_attn_processor(AttnProcessor2_0())
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+
+        self._eager_unet = pipe.unet
+        self._compiled_unet = torch.compile(pipe.unet, mode=compile_mode, dynamic=False)
+        self._compiled_decode = torch.compile(pipe.vae.decode, mode=compile_mode, dynamic=False)
+
+        # Dynamo keeps one cache entry per shape on the compiled code; make room for every key we allow.
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * max_graphs)
+
+        self._graphs: "OrderedDict[ShapeKey, int]" = OrderedDict()  # key -> number of compiled runs
+        self._failed: Set[ShapeKey] = set()
+
+    # ---- Shape keys ----
+    def shape_key(self, height: int, width: int, num_images: int, guidance_scale: float) -> ShapeKey:
+        # Classifier-free guidance doubles the batch seen by the UNet.
+        unet_batch = num_images * (2 if guidance_scale > 1.0 else 1)
+        return (height, width, unet_batch, str(self._eager_unet.dtype))
+
+    def _use_compiled(self, key: ShapeKey) -> bool:
+        if key in self._failed:
+            return False
+        if key in self._graphs:
+            self._graphs.move_to_end(key)
+            return True
+        return self.compile_on_demand and len(self._graphs) < self.max_graphs
+
+    # ---- Module swapping ----
+    def _swap_in(self):
+        self.pipe.unet = self._compiled_unet
+        self.pipe.vae.decode = self._compiled_decode
+
+    def _swap_out(self):
+        self.pipe.unet = self._eager_unet
+        self.pipe.vae.__dict__.pop("decode", None)
+
+    # ---- Running ----
+    def __call__(self, **kwargs):
+        height = kwargs.get("height") or 512
+        width = kwargs.get("width") or 512
+        prompt = kwargs.get("prompt")
+        num_images = (len(prompt) if isinstance(prompt, list) else 1) * kwargs.get("num_images_per_prompt", 1)
+        key = self.shape_key(height, width, num_images, kwargs.get("guidance_scale", 7.5))
+
+        if not self._use_compiled(key):
+            return self.pipe(**kwargs)
+
+        generator = kwargs.get("generator")
+        generators = [gen for gen in (generator if isinstance(generator, list) else [generator]) if gen is not None]
+        generator_states = [gen.get_state() for gen in generators]
+        self._swap_in()
+        try:
+            output = self.pipe(**kwargs)
+        except CancelledError:
+            # Cancelled from the step callback: not a compilation problem, nothing to fall back to.
+            raise
+        except Exception as e:
+            print(f"Compiled run failed for shape {key}, falling back to eager: {e}")
+            self._failed.add(key)
+            self._graphs.pop(key, None)
+            # The eager run starts over: same noise, and step callbacks without the failed run's state.
+            for gen, state in zip(generators, generator_states):
+                gen.set_state(state)
+            reset = getattr(kwargs.get("callback_on_step_end"), "reset", None)
+            if reset is not None:
+                reset()
+            self._swap_out()
+            return self.pipe(**kwargs)
+        finally:
+            self._swap_out()
+
+        self._graphs[key] = self._graphs.get(key, 0) + 1
+        return output
+
+    def warmup(self, shapes: Iterable[Tuple[int, int, int]] = config.ENGINE_WARM_SHAPES, steps: int = 2):
+        """Compile the given `(height, width, images per prompt)` shapes ahead of the first request."""
+        for height, width, num_images in shapes:
+            key = self.shape_key(height, width, num_images, 7.5)
+            if key in self._graphs or len(self._graphs) >= self.max_graphs:
+                continue
+            # Reserve the key so the compiled path is taken for the warm-up run itself.
+            self._graphs[key] = 0
+            self(
+                prompt="",
+                num_inference_steps=steps,
+                height=height,
+                width=width,
+                num_images_per_prompt=num_images,
+                guidance_scale=7.5,
+            )
+            status = "failed, eager fallback" if key in self._failed else "ready"
+            print(f"Engine warm-up {height}x{width}x{num_images}: {status}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "compiled_shapes": [list(key) for key in self._graphs],
+            "failed_shapes": [list(key) for key in self._failed],
+        }
@@ -0,0 +1,115 @@
+"""Generation flow shared by the AI routes and the cache pre-population job.
+
+A route builds its cache key and a `render(entry, callback)` function calling the pipeline with its own
+arguments; the rest is the same for every route. `serve_generation` answers from the result cache, with a
+preview, or through the single-flight group; the flight's leader runs `generate_image`, which waits for
+admission, renders with the pipeline held on the device and stores the image and its final latents.
+"""
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .admission import AdmissionRejected, admission, client_id, rejected_response
+from .cancellation import CancellationToken, GenerationCancelled, cancelled_response
+from .latent_cache import CachedLatents, LatentCapture, latent_cache
+from .prompt_index import preview_response, prompt_index, queue_exact
+from .result_cache import example_cache
+from .singleflight import inflight
+
+# render(entry, callback) -> one PIL image per cache key; `callback` goes to `callback_on_step_end`.
+Render = Callable[[object, Callable], list]
+
+
+def generate_images(
+    model: str,
+    cache_keys: Sequence[str],
+    render: Render,
+    lane: str,
+    client: str,
+    token: CancellationToken,
+    label: str,
+    latents: Optional[Sequence[Optional[CachedLatents]]] = None,
+) -> List[str]:
+    """Render the images of `cache_keys` in one pipeline call and store them; returns their digests.
+
+    Waits for a slot in `lane` of the admission queue, then runs `render` with the pipeline of `model` held on
+    the device. `latents` gives, per key, the settings under which the image's final latents are kept for
+    /variation and /upscale (None: not kept).
+    """
+    # The ML stack is imported on the first generation (or by the background warm-up), not with the routes.
+    from .pipelines import get_pipeline, prefetch_pipeline
+
+    # An offloaded pipeline comes back to the device while the request waits for admission.
+    prefetch_pipeline(model)
+    with admission.admit(client, lane, token):
+        entry = get_pipeline(model)
+        capture = LatentCapture(token.step_callback())
+        print(f"{label} generated (cache miss)")
+        with entry.in_use():
+            images = render(entry, capture)
+
+    digests = []
+    for index, (key, image) in enumerate(zip(cache_keys, images)):
+        digest = example_cache.put(key, image)
+        settings = latents[index] if latents is not None else None
+        if settings is not None:
+            latent_cache.put(digest, settings.derive(latents=capture.final(index)))
+        digests.append(digest)
+    return digests
+
+
+def generate_image(
+    model: str,
+    cache_key: str,
+    render: Callable,
+    lane: str,
+    token: CancellationToken,
+    label: str,
+    latents: Optional[CachedLatents] = None,
+) -> str:
+    """`generate_images` for the single image of a request; `render` returns that image. Run as a flight's leader."""
+    # A flight for this key may have completed between the cache check and joining the flight.
+    digest = example_cache.digest(cache_key)
+    if digest is not None:
+        return digest
+
+    def render_one(entry, callback):
+        return [render(entry, callback)]
+
+    return generate_images(model, [cache_key], render_one, lane, client_id(), token, label, [latents])[0]
+
+
+def serve_generation(
+    cache_key: str,
+    generate: Callable[[CancellationToken], str],
+    token: CancellationToken,
+    label: str,
+    preview: Optional[Tuple[str, str]] = None,
+):
+    """Digest of the image of `cache_key`, from the cache or from `generate(flight_token)`.
+
+    Identical concurrent requests wait for the first one instead of generating again. `preview` is the
+    `(prompt, scope)` of a request that accepts a near-duplicate image at once. Returns `(digest, None)`, or
+    `(None, response)` for a preview, a rejection or a cancellation.
+    """
+    digest = example_cache.digest(cache_key)
+    if digest is not None:
+        print(f"{label} served from cache")
+        return digest, None
+    # A preview is answered at once with the image of the closest indexed prompt; the exact image is generated
+    # in the background and served to the same request sent again.
+    if preview is not None:
+        match = prompt_index.lookup(*preview)
+        if match is not None:
+            print(f"{label} preview served ({match.kind}, similarity {match.similarity:.3f})")
+            queue_exact(cache_key, generate, token.steps)
+            return None, preview_response(match)
+    try:
+        digest, shared = inflight.do(cache_key, generate, token)
+    except AdmissionRejected as e:
+        print(f"{label} request rejected: {e.reason}")
+        return None, rejected_response(e)
+    except GenerationCancelled as e:
+        return None, cancelled_response(e)
+    if shared:
+        print(f"{label} shared with an in-flight request")
+    return digest, None
@@ -0,0 +1,52 @@
+"""Content-addressed image URLs.
+
+Every generated image is reachable at `GET /api/ai/images/<sha256>.png`, the digest of its PNG bytes. The URL
+never changes meaning, so responses carry the digest as a strong ETag and are cacheable for a year by browsers
+and CDNs; `If-None-Match` gets a `304` and `Range` requests are honoured.
+"""
+
+import io
+import re
+
+from flask import abort, request, send_file, url_for
+
+from .result_cache import example_cache
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def image_url(digest: str) -> str:
+    return url_for(".image", digest=digest)
+
+
+def _send(digest: str, conditional: bool):
+    path = example_cache.path(digest)
+    if path is not None:
+        response = send_file(path, mimetype="image/png", etag=digest, conditional=conditional)
+    else:
+        data = example_cache.read(digest)
+        if data is None:
+            abort(404)
+        response = send_file(io.BytesIO(data), mimetype="image/png", etag=digest, conditional=False)
+        response.headers["Content-Length"] = str(len(data))
+        if conditional:
+            response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    return response
+
+
+def route_image(digest: str):
+    if not _DIGEST.match(digest):
+        abort(404)
+    response = _send(digest, conditional=True)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def image_response(digest: str):
+    """Response to a generation request: the image itself, pointing at its cacheable URL."""
+    response = _send(digest, conditional=False)
+    response.headers["Location"] = image_url(digest)
+    response.headers["Content-Location"] = image_url(digest)
+    return response
@@ -0,0 +1,75 @@
+"""Final latents of recent generations, for cheap variations and hi-res refinement.
+
+Entries are keyed by the digest of the generated image (its `ETag`) and carry what is needed to denoise them
+again: the model, prompts, guidance and LoRA scale. They are small (4 x H/8 x W/8 values in the inference dtype:
+64 KiB for a 512x512 image in float32 on the CPU, 32 KiB in half precision on an accelerator), so a bounded
+in-memory LRU on the host holds them.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from .. import config
+
+
+@dataclass(frozen=True)
+class CachedLatents:
+    latents: object  # torch.Tensor of shape (1, 4, H/8, W/8) on the CPU; None when only the image is known
+    model: str
+    prompt: str
+    negative_prompt: str = ""
+    guidance_scale: float = 7.5
+    lora_scale: float = 1.0
+
+    def derive(self, **changes) -> "CachedLatents":
+        return replace(self, **changes)
+
+
+class LatentCapture:
+    """`callback_on_step_end` keeping the latents of the last step, around another callback."""
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.latents = None
+
+    def __call__(self, pipe, step_index, timestep, callback_kwargs):
+        if self.inner is not None:
+            callback_kwargs = self.inner(pipe, step_index, timestep, callback_kwargs)
+        self.latents = callback_kwargs["latents"]
+        return callback_kwargs
+
+    def reset(self):
+        """Forget the latents of an attempt that is run again (the engine's eager fallback)."""
+        self.latents = None
+
+    def final(self, index: int = 0):
+        """The final latents of image `index` of the batch, on the CPU."""
+        return self.latents[index : index + 1].detach().to("cpu") if self.latents is not None else None
+
+
+class LatentCache:
+    def __init__(self, max_items: int = config.LATENT_CACHE_ITEMS):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, CachedLatents]" = OrderedDict()
+
+    def get(self, digest: str) -> Optional[CachedLatents]:
+        with self._lock:
+            entry = self._items.get(digest)
+            if entry is not None:
+                self._items.move_to_end(digest)
+            return entry
+
+    def put(self, digest: str, entry: CachedLatents):
+        if entry.latents is None or not self.max_items:
+            return
+        with self._lock:
+            self._items[digest] = entry
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+latent_cache = LatentCache()
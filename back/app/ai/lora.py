@@ -0,0 +1,94 @@
+"""Fusing LoRA adapters into the base UNet weights.
+
+At runtime diffusers applies a LoRA through extra low-rank matmuls on every attention projection, on every
+denoising step. Fusing folds `scale * delta` into the base weights once, so the UNet runs at base-model cost
+until another adapter or scale is requested.
+
+A LoRA delta is linear in its scale, so one cached delta per adapter serves every scale: switching scales is a
+restore of the touched weights followed by a single `add_(delta, alpha=scale)` per layer. The original weights
+of the touched layers are snapshotted on first fuse, which makes unfusing an exact in-place copy instead of a
+reload from disk.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+from peft.tuners.tuners_utils import BaseTunerLayer
+
+from .. import config
+
+
+class FusedLora:
+    """Fuses one adapter at a given scale into a UNet, with an LRU of per-adapter weight deltas."""
+
+    def __init__(self, unet, max_adapters: int = config.LORA_FUSED_CACHE_SIZE):
+        self.unet = unet
+        self.max_adapters = max_adapters
+        self.fused: Optional[Tuple[str, float]] = None
+        self._layers: Dict[str, BaseTunerLayer] = {
+            name: module for name, module in unet.named_modules() if isinstance(module, BaseTunerLayer)
+        }
+        self._deltas: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._originals: Dict[str, torch.Tensor] = {}
+
+    def _can_fuse(self, adapter: str) -> bool:
+        for module in self._layers.values():
+            if adapter not in module.lora_A:
+                return False
+            # Quantised base layers have packed weights that cannot be patched in place.
+            if not isinstance(getattr(module.get_base_layer(), "weight", None), torch.nn.Parameter):
+                return False
+        return bool(self._layers)
+
+    @torch.no_grad()
+    def _delta(self, adapter: str) -> Dict[str, torch.Tensor]:
+        deltas = self._deltas.get(adapter)
+        if deltas is None:
+            deltas = {}
+            for name, module in self._layers.items():
+                weight = module.get_base_layer().weight
+                deltas[name] = module.get_delta_weight(adapter).to(dtype=weight.dtype)
+            self._deltas[adapter] = deltas
+            while len(self._deltas) > self.max_adapters:
+                evicted, _ = self._deltas.popitem(last=False)
+                print(f"Fused LoRA delta evicted: {evicted}")
+        else:
+            self._deltas.move_to_end(adapter)
+        return deltas
+
+    @torch.no_grad()
+    def fuse(self, adapter: str, scale: float) -> bool:
+        """Fuse `adapter` at `scale`. Returns False (and leaves the UNet unfused) when fusing is not possible."""
+        if self.fused == (adapter, scale):
+            return True
+        self.unfuse()
+        if not self._can_fuse(adapter):
+            return False
+
+        deltas = self._delta(adapter)
+        for name, module in self._layers.items():
+            weight = module.get_base_layer().weight
+            if name not in self._originals:
+                self._originals[name] = weight.detach().clone()
+            weight.add_(deltas[name], alpha=scale)
+
+        # The fused weights already carry the adapter; skip the runtime LoRA path.
+        self.unet.disable_lora()
+        self.fused = (adapter, scale)
+        return True
+
+    @torch.no_grad()
+    def unfuse(self):
+        if self.fused is None:
+            return
+        for name, module in self._layers.items():
+            module.get_base_layer().weight.copy_(self._originals[name])
+        self.unet.enable_lora()
+        self.fused = None
+
+    def clear(self):
+        """Unfuse and drop the cached deltas and weight snapshots, e.g. before the UNet leaves the device."""
+        self.unfuse()
+        self._deltas.clear()
+        self._originals.clear()
@@ -0,0 +1,227 @@
+"""Device memory budget for the loaded pipelines.
+
+Every pipeline's footprint (the weights and buffers of its modules) and last use are tracked. Before a pipeline
+is put on the device, the least recently used idle pipelines are moved to host memory until it fits in
+`AI_MEMORY_BUDGET_MB`. Past `AI_MEMORY_HOST_BUDGET_MB` of offloaded pipelines, the least recently used are
+unloaded altogether and reloaded from disk on their next request (a cheap reload with `AI_SHARED_WEIGHTS`,
+whose memory-mapped files stay in the page cache). On a CPU device there is no host tier: pipelines past the
+budget are unloaded directly. Pipelines idle for `AI_MEMORY_IDLE_S` are offloaded by a background sweeper.
+
+A busy pipeline (its lock held) is never moved. When a request arrives for an offloaded pipeline, `prefetch`
+starts bringing it back on a background thread while the request waits for admission. The CUDA caching
+allocator is only trimmed after an offload, on that background thread, never on the request path.
+
+A pipeline larger than the whole budget can never be resident. It runs with diffusers' model CPU offload
+(`AI_MEMORY_OVERSIZE=model`) or sequential offload (`sequential`) instead, moving one component or one layer at
+a time to the device.
+"""
+
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List
+
+import torch
+
+from .. import config
+from .device import inference_device
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from .pipelines import LoadedPipeline
+
+MIB = 2**20
+
+
+@dataclass
+class Residency:
+    entry: "LoadedPipeline"
+    footprint: int = 0
+    location: str = "device"  # device, host, unloaded, or streamed (CPU offload hooks)
+    last_used: float = field(default_factory=time.monotonic)
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "location": self.location,
+            "footprint_mb": round(self.footprint / MIB),
+            "idle_s": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class MemoryManager:
+    def __init__(
+        self,
+        budget_mb: int = config.MEMORY_BUDGET_MB,
+        host_budget_mb: int = config.MEMORY_HOST_BUDGET_MB,
+        idle_s: float = config.MEMORY_IDLE_S,
+    ):
+        self.budget = budget_mb * MIB
+        self.host_budget = host_budget_mb * MIB
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._residents: Dict[str, Residency] = {}
+        self._restorer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai-memory")
+        self._sweeper = None
+        self.counters = {"offloaded": 0, "unloaded": 0, "restored": 0, "reloaded": 0}
+
+    def _used(self, location: str) -> int:
+        return sum(r.footprint for r in self._residents.values() if r.location == location)
+
+    def _lru(self, location: str, exclude: str = None) -> List[Residency]:
+        with self._lock:
+            candidates = [r for r in self._residents.values() if r.location == location and r.entry.name != exclude]
+        return sorted(candidates, key=lambda r: r.last_used)
+
+    # ---- Placement (callers hold the entry's lock) ----
+    def place(self, entry: "LoadedPipeline"):
+        """Put a freshly loaded pipeline (still in host memory) on the device, making room for it first."""
+        footprint = entry.footprint()
+        with self._lock:
+            residency = self._residents.setdefault(entry.name, Residency(entry))
+            residency.footprint = footprint
+            residency.last_used = time.monotonic()
+        device = inference_device()
+        if self.budget and footprint > self.budget and device.type == "cuda":
+            print(
+                f"Pipeline {entry.name} ({footprint / MIB:.0f} MiB) exceeds the memory budget; "
+                f"running it with {config.MEMORY_OVERSIZE} CPU offload"
+            )
+            entry.stream(config.MEMORY_OVERSIZE)
+            residency.location = "streamed"
+            return
+        self._make_room(footprint, exclude=entry.name)
+        entry.pipe.to(device)
+        residency.location = "device"
+        self._start_sweeper()
+
+    def streamed(self, entry: "LoadedPipeline") -> bool:
+        residency = self._residents.get(entry.name)
+        return residency is not None and residency.location == "streamed"
+
+    def ensure_resident(self, entry: "LoadedPipeline"):
+        """Bring `entry` back to the device if it was offloaded or unloaded."""
+        residency = self._residents.get(entry.name)
+        if residency is None or residency.location in {"device", "streamed"}:
+            return
+        start = time.perf_counter()
+        with stage("restore"):
+            if residency.location == "unloaded":
+                entry.reload()
+                self.counters["reloaded"] += 1
+                action = "reloaded"
+            else:
+                self._make_room(residency.footprint, exclude=entry.name)
+                entry.pipe.to(inference_device())
+                residency.location = "device"
+                self.counters["restored"] += 1
+                action = "restored"
+        residency.last_used = time.monotonic()
+        print(f"Pipeline {entry.name} {action} in {time.perf_counter() - start:.1f}s")
+
+    def touch(self, entry: "LoadedPipeline"):
+        residency = self._residents.get(entry.name)
+        if residency is not None:
+            residency.last_used = time.monotonic()
+
+    # ---- Making room ----
+    def _make_room(self, needed: int, exclude: str):
+        if not self.budget:
+            return
+        while True:
+            with self._lock:
+                used = self._used("device")
+            if used + needed <= self.budget:
+                return
+            if not any(self._offload(victim) for victim in self._lru("device", exclude)):
+                print(
+                    f"Memory budget exceeded: {used / MIB:.0f} MiB held by busy pipelines, "
+                    f"{needed / MIB:.0f} MiB more needed"
+                )
+                return
+
+    def _offload(self, residency: Residency) -> bool:
+        """Move an idle pipeline off the device; False if it is busy."""
+        entry = residency.entry
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if residency.location != "device":
+                return False
+            if inference_device().type == "cpu":
+                self._unload_locked(residency)
+                return True
+            entry.offload()
+            residency.location = "host"
+            self.counters["offloaded"] += 1
+            print(f"Pipeline {entry.name} offloaded to host memory")
+        finally:
+            entry.lock.release()
+        # Hand the freed blocks back to the driver on the restorer thread: `_offload` also runs on the request path
+        # (making room for a restore), where the trim would stall the request and the blocks are about to be reused.
+        self._restorer.submit(torch.cuda.empty_cache)
+        self._enforce_host_budget()
+        return True
+
+    def _unload_locked(self, residency: Residency):
+        residency.entry.unload()
+        residency.location = "unloaded"
+        self.counters["unloaded"] += 1
+        gc.collect()
+        print(f"Pipeline {residency.entry.name} unloaded")
+
+    def _enforce_host_budget(self):
+        if not self.host_budget:
+            return
+        for residency in self._lru("host"):
+            with self._lock:
+                if self._used("host") <= self.host_budget:
+                    return
+            if residency.entry.lock.acquire(blocking=False):
+                try:
+                    if residency.location == "host":
+                        self._unload_locked(residency)
+                finally:
+                    residency.entry.lock.release()
+
+    # ---- Background work ----
+    def prefetch(self, name: str):
+        """Start bringing pipeline `name` back to the device in the background, if it is not there."""
+        residency = self._residents.get(name)
+        if residency is None or residency.location in {"device", "streamed"}:
+            return
+        self._restorer.submit(self._restore, residency.entry)
+
+    def _restore(self, entry: "LoadedPipeline"):
+        with entry.lock:
+            self.ensure_resident(entry)
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None or not self.idle_s:
+                return
+            self._sweeper = threading.Thread(target=self._sweep, name="ai-memory-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            time.sleep(max(self.idle_s / 4, 1.0))
+            now = time.monotonic()
+            for residency in self._lru("device"):
+                if now - residency.last_used > self.idle_s:
+                    self._offload(residency)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "budget_mb": self.budget // MIB,
+                "host_budget_mb": self.host_budget // MIB,
+                "device_mb": round(self._used("device") / MIB),
+                "host_mb": round(self._used("host") / MIB),
+                "pipelines": {name: r.as_dict() for name, r in self._residents.items()},
+                **self.counters,
+            }
+
+
+memory = MemoryManager()
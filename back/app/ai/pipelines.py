@@ -0,0 +1,250 @@
+"""Process-wide Stable Diffusion pipelines shared by the AI routes.
+
+Pipelines are loaded on first use and stay registered for the lifetime of the process; the memory manager
+(`memory.py`) may move idle ones off the device or unload them. Each one carries its own lock: diffusers
+pipelines are not safe to call concurrently, so routes generate inside `entry.in_use()`, which holds the lock
+with the pipeline back on the device.
+"""
+
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+import torch
+from diffusers import (
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    StableDiffusionImg2ImgPipeline,
+    StableDiffusionPipeline,
+)
+
+from .. import config
+from .deepcache import DeepCache
+from .device import configure_cpu_runtime, inference_device, inference_dtype, quantize_for_cpu
+from .engine import InferenceEngine
+from .lora import FusedLora
+from .memory import memory
+from .profiling import stage
+from .shared_weights import load_shared_components, map_lora_weights
+from .tome import TokenMerging, apply_token_merging
+from .variants import DeepCacheRun
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, "../../../"))
+
+LORA_DIR = os.path.join(PROJECT_ROOT, "model", "sd-indoor-segmentation-lora")
+LORA_WEIGHT_NAME = "pytorch_lora_weights.safetensors"
+LORA_ADAPTER = "trained"
+
+SCHEDULERS = {
+    "dpm++": DPMSolverMultistepScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler,
+}
+
+
+@dataclass
+class LoadedPipeline:
+    name: str
+    pipe: Optional[StableDiffusionPipeline] = None  # None while unloaded by the memory manager
+    engine: Optional[InferenceEngine] = None
+    lora: Optional[FusedLora] = None
+    tome: Optional[TokenMerging] = None
+    deepcache: Optional[DeepCache] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    _schedulers: Dict[str, object] = field(default_factory=dict)
+    _img2img: Optional[StableDiffusionImg2ImgPipeline] = None
+    _built: bool = False
+
+    @contextmanager
+    def in_use(self) -> Iterator["LoadedPipeline"]:
+        """Hold `lock` with the pipeline on the device, bringing it back first if it was offloaded or unloaded."""
+        with self.lock:
+            memory.ensure_resident(self)
+            try:
+                yield self
+            finally:
+                memory.touch(self)
+
+    def __call__(self, **kwargs):
+        """Run the pipeline, through the compiled engine when one is attached. Callers must hold `lock`."""
+        with stage("denoise"):
+            if self.engine is not None and not self._eager_only():
+                return self.engine(**kwargs)
+            return self.pipe(**kwargs)
+
+    def img2img(self, **kwargs):
+        """Run img2img on the pipeline's own components; `image` may be latents. Callers must hold `lock`."""
+        if self._img2img is None:
+            self._img2img = StableDiffusionImg2ImgPipeline(**self.pipe.components)
+        with stage("denoise"):
+            return self._img2img(**kwargs)
+
+    def _eager_only(self) -> bool:
+        """Whether the current call changes the UNet in a way the compiled graphs are not keyed on."""
+        merging = self.tome is not None and self.tome.ratio
+        caching = self.deepcache is not None and self.deepcache.interval > 1
+        return bool(merging or caching)
+
+    @contextmanager
+    def scheduler(self, name: Optional[str]):
+        """Temporarily swap the pipeline scheduler (None keeps the default). Callers must hold `lock`."""
+        if name is None:
+            yield
+            return
+        default = self.pipe.scheduler
+        if name not in self._schedulers:
+            self._schedulers[name] = SCHEDULERS[name].from_config(default.config)
+        self.pipe.scheduler = self._schedulers[name]
+        try:
+            yield
+        finally:
+            self.pipe.scheduler = default
+
+    @contextmanager
+    def token_merging(self, ratio: float, width: int, height: int):
+        """Merge `ratio` of the self-attention tokens while the block runs. Callers must hold `lock`."""
+        if not ratio or self.tome is None:
+            yield
+            return
+        with self.tome.active(ratio, width, height):
+            yield
+
+    @contextmanager
+    def feature_cache(self, interval: int) -> Iterator[Optional[DeepCacheRun]]:
+        """Reuse deep UNet features for `interval` steps at a time; yields the run stats, or None when off.
+
+        Callers must hold `lock`.
+        """
+        if interval <= 1 or self.deepcache is None:
+            yield None
+            return
+        with self.deepcache.active(interval) as run:
+            yield run
+
+    def lora_kwargs(self, adapter: str, scale: float) -> Dict[str, float]:
+        """Select `adapter` at `scale` and return the `cross_attention_kwargs` to pass to the pipeline.
+
+        When the adapter can be fused the scale is baked into the weights and no runtime kwargs are needed.
+        Callers must hold `lock`.
+        """
+        if self.lora is not None and self.lora.fuse(adapter, scale):
+            return {}
+        return {"scale": scale}
+
+    # ---- Memory management (callers must hold `lock`) ----
+    def footprint(self) -> int:
+        """Bytes of the weights and buffers of the pipeline's modules."""
+        modules = [m for m in self.pipe.components.values() if isinstance(m, torch.nn.Module)]
+        tensors = itertools.chain.from_iterable(itertools.chain(m.parameters(), m.buffers()) for m in modules)
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def offload(self):
+        """Move the pipeline to host memory."""
+        if self.lora is not None:
+            # Fused deltas and weight snapshots live on the device; they are rebuilt on the next fuse.
+            self.lora.clear()
+        self.pipe.to("cpu")
+
+    def stream(self, mode: str):
+        """Keep the weights in host memory and move them to the device per component (or per layer) when used."""
+        if mode == "sequential":
+            self.pipe.enable_sequential_cpu_offload(device=inference_device())
+        else:
+            self.pipe.enable_model_cpu_offload(device=inference_device())
+
+    def unload(self):
+        """Drop the pipeline and everything built on it; `reload` loads it again."""
+        self.pipe = self.engine = self.lora = self.tome = self.deepcache = self._img2img = None
+        self._schedulers.clear()
+
+    def reload(self):
+        _build(self)
+
+
+def _from_pretrained() -> StableDiffusionPipeline:
+    components = {}
+    if config.SHARED_WEIGHTS:
+        components = load_shared_components(config.MODEL_ID, inference_dtype())
+    # Still in host memory: the memory manager puts it on the device.
+    return StableDiffusionPipeline.from_pretrained(config.MODEL_ID, torch_dtype=inference_dtype(), **components)
+
+
+def _load_base() -> StableDiffusionPipeline:
+    pipe = _from_pretrained()
+    if config.ENGINE_MODE != "compiled":
+        pipe.enable_attention_slicing()
+    print("Base model loaded")
+    return pipe
+
+
+def _load_lora() -> StableDiffusionPipeline:
+    pipe = _from_pretrained()
+    if config.SHARED_WEIGHTS:
+        lora_weights = map_lora_weights(os.path.join(LORA_DIR, LORA_WEIGHT_NAME), inference_dtype())
+        pipe.load_lora_weights(lora_weights, adapter_name=LORA_ADAPTER)
+    else:
+        pipe.load_lora_weights(LORA_DIR, weight_name=LORA_WEIGHT_NAME, adapter_name=LORA_ADAPTER)
+    print("LoRA model loaded")
+    return pipe
+
+
+_LOADERS = {
+    "base": _load_base,
+    "lora": _load_lora,
+}
+
+# ---- PIPELINE REGISTRY ----
+_pipelines: Dict[str, LoadedPipeline] = {}
+# Guards `_pipelines` only: each pipeline is built under its own `lock`, so loading one never blocks the others.
+_registry_lock = threading.Lock()
+
+
+def _build(entry: LoadedPipeline):
+    """Load `entry`'s pipeline and attach its engine, fused LoRA, token merging and feature caching.
+
+    Callers must hold `entry.lock`.
+    """
+    if inference_device().type == "cpu":
+        configure_cpu_runtime()
+    entry.pipe = _LOADERS[entry.name]()
+    if inference_device().type == "cpu" and config.CPU_QUANTIZE:
+        quantize_for_cpu(entry.pipe)
+    memory.place(entry)
+    if entry.name == "lora" and config.LORA_FUSE:
+        entry.lora = FusedLora(entry.pipe.unet)
+    if config.ENGINE_MODE == "compiled" and not memory.streamed(entry):
+        entry.engine = InferenceEngine(entry.pipe)
+    # After the engine, which resets the attention processors.
+    entry.tome = apply_token_merging(entry.pipe.unet)
+    entry.deepcache = DeepCache(entry.pipe.unet)
+    if entry.engine is not None:
+        entry.engine.warmup()
+
+
+def get_pipeline(name: str) -> LoadedPipeline:
+    """Return the pipeline registered under `name`, loading it on first use. Run it inside `in_use()`."""
+    with _registry_lock:
+        entry = _pipelines.get(name)
+        if entry is None:
+            entry = _pipelines[name] = LoadedPipeline(name=name)
+    if not entry._built:
+        # Concurrent first requests for `name` wait here for one build; after a failed build the next one retries.
+        with entry.lock:
+            if not entry._built:
+                with stage("load"):
+                    _build(entry)
+                entry._built = True
+    return entry
+
+
+def prefetch_pipeline(name: str):
+    """Start bringing an offloaded or unloaded pipeline back in the background, ahead of its request."""
+    memory.prefetch(name)
+
+
+def loaded_pipelines() -> List[str]:
+    """Names of the pipelines currently loaded (without waiting for one being loaded)."""
+    return sorted(name for name, entry in list(_pipelines.items()) if entry.pipe is not None)
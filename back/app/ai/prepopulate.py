@@ -0,0 +1,178 @@
+"""Pre-population of the result cache from manifest rows (`prepopulate_cache.py`).
+
+A row is the JSON payload a client would POST, plus a `model` field (`base` or `lora`). Rows are keyed like the
+routes' exact renders, token merging and feature caching included, and rows sharing everything but the prompts
+and the seed are rendered in one pipeline call. Batches go through `generation.generate_images` in the
+`background` admission lane, behind every live request, and keep their final latents for /variation and
+/upscale.
+
+`POST /api/ai/admin/prepopulate` renders one batch on a live node; the job can also render in its own process.
+"""
+
+import random
+from typing import List
+
+from flask import jsonify, request
+
+from .. import config
+from .admin import admin_error
+from .admission import BACKGROUND, AdmissionRejected, rejected_response
+from .cancellation import CancellationToken, GenerationCancelled, cancelled_response
+from .generation import generate_images
+from .latent_cache import CachedLatents
+from .prompt_index import prompt_index, prompt_scope
+from .result_cache import base_cache_key, example_cache, lora_cache_key
+from .variants import cache_interval, cache_key_suffix, tome_key_suffix, tome_ratio
+
+MODELS = ("base", "lora")
+# Same defaults as the routes.
+DEFAULTS = {
+    "negative_prompt": "",
+    "num_inference_steps": 30,
+    "guidance_scale": 7.5,
+    "seed": -1,
+    "width": 512,
+    "height": 512,
+    "lora_scale": 1.0,
+}
+# Fields that are numbers in a request body (CSV manifests hold them as text).
+NUMERIC_FIELDS = (
+    "num_inference_steps",
+    "guidance_scale",
+    "seed",
+    "width",
+    "height",
+    "lora_scale",
+    "tome_ratio",
+    "cache_interval",
+)
+# Admission client of pre-population batches.
+CLIENT_ID = "prepopulate"
+
+
+def complete_row(row: dict) -> dict:
+    """`row` with the routes' defaults filled in. Raises ValueError for a row that is not a valid request."""
+    if not isinstance(row, dict) or not row.get("prompt"):
+        raise ValueError("every row needs a prompt")
+    row = {**DEFAULTS, "model": "base", **row}
+    if row["model"] not in MODELS:
+        raise ValueError(f"Unknown model {row['model']!r} for prompt {row['prompt']!r}")
+    # Keyed and grouped by the parsed variants: reject what the routes reject.
+    tome_ratio(row)
+    cache_interval(row)
+    return row
+
+
+def cache_key(row: dict) -> str:
+    suffix = tome_key_suffix(tome_ratio(row)) + cache_key_suffix(cache_interval(row))
+    if row["model"] == "lora":
+        return lora_cache_key(
+            row["prompt"],
+            row["negative_prompt"],
+            row["num_inference_steps"],
+            row["guidance_scale"],
+            row["seed"],
+            row["width"],
+            row["height"],
+            row["lora_scale"],
+            suffix,
+        )
+    return base_cache_key(
+        row["prompt"],
+        row["num_inference_steps"],
+        row["guidance_scale"],
+        row["seed"],
+        row["width"],
+        row["height"],
+        suffix,
+    )
+
+
+def batch_group(row: dict) -> tuple:
+    """Everything the rows of one batched pipeline call must share."""
+    return (
+        row["model"],
+        row["num_inference_steps"],
+        row["guidance_scale"],
+        row["width"],
+        row["height"],
+        row["lora_scale"] if row["model"] == "lora" else None,
+        tome_ratio(row),
+        cache_interval(row),
+    )
+
+
+def generate_batch(rows: List[dict], token: CancellationToken) -> List[str]:
+    """Render `rows` (one `batch_group`) in one pipeline call into the result cache; returns their digests."""
+    model, steps, cfg_scale, width, height, lora_scale, merge_ratio, interval = batch_group(rows[0])
+
+    def render(entry, callback):
+        from .device import make_generator
+        from .pipelines import LORA_ADAPTER
+
+        kwargs = dict(
+            prompt=[row["prompt"] for row in rows],
+            num_inference_steps=steps,
+            guidance_scale=cfg_scale,
+            width=width,
+            height=height,
+            # Batched calls need one generator per image; seed -1 gets fresh noise like the routes.
+            generator=[make_generator(random.randrange(2**63) if row["seed"] == -1 else row["seed"]) for row in rows],
+            callback_on_step_end=callback,
+        )
+        with entry.token_merging(merge_ratio, width, height), entry.feature_cache(interval):
+            if model == "lora":
+                kwargs["negative_prompt"] = [row["negative_prompt"] for row in rows]
+                kwargs["cross_attention_kwargs"] = entry.lora_kwargs(LORA_ADAPTER, lora_scale)
+            return entry(**kwargs).images
+
+    latents = [
+        CachedLatents(
+            None,
+            model,
+            row["prompt"],
+            row["negative_prompt"] if model == "lora" else "",
+            cfg_scale,
+            lora_scale=lora_scale if model == "lora" else 1.0,
+        )
+        for row in rows
+    ]
+    keys = [cache_key(row) for row in rows]
+    label = f"Pre-populated {model} batch of {len(rows)}"
+    return generate_images(model, keys, render, BACKGROUND, CLIENT_ID, token, label, latents)
+
+
+def route_prepopulate():
+    """POST `{"rows": [...]}`: render one batch of manifest rows into this node's result cache.
+
+    The rows must share a `batch_group`; those already cached are skipped. The batch waits behind live requests,
+    so it may be rejected with 429 and a `Retry-After` when they keep the node busy.
+    """
+    error = admin_error()
+    if error is not None:
+        return error
+    payload = request.get_json(silent=True) or {}
+    try:
+        rows = [complete_row(row) for row in payload.get("rows") or []]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not rows:
+        return jsonify({"error": "rows required"}), 400
+    if len(rows) > config.PREPOPULATE_MAX_BATCH:
+        return jsonify({"error": f"at most {config.PREPOPULATE_MAX_BATCH} rows per batch"}), 400
+    if len({batch_group(row) for row in rows}) > 1:
+        return jsonify({"error": "rows must share model, steps, guidance, size, LoRA scale and variants"}), 400
+
+    pending = list({cache_key(row): row for row in rows if cache_key(row) not in example_cache}.values())
+    if pending:
+        # Not tied to a deadline: only the job's disconnect cancels the batch.
+        token = CancellationToken(environ=request.environ, steps=pending[0]["num_inference_steps"])
+        try:
+            digests = generate_batch(pending, token)
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        except GenerationCancelled as e:
+            return cancelled_response(e)
+        for row, digest in zip(pending, digests):
+            prompt_index.add(row["prompt"], prompt_scope(row["model"], row["width"], row["height"]), digest)
+    return jsonify({"generated": len(pending), "cached": len(rows) - len(pending)})
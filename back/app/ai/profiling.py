@@ -0,0 +1,248 @@
+"""On-demand profiling of live generation requests (flight recorder).
+
+`POST /api/ai/admin/profile` arms the recorder for the next `requests` generation requests and/or the next
+`seconds` seconds. Captured requests, one at a time, are recorded by:
+
+- `torch.profiler` (CPU, and CUDA when available), exported as a Chrome trace for Perfetto or
+  `chrome://tracing`, with an operator summary next to it;
+- a Python sampling profiler on the request's thread, written as folded stacks for `flamegraph.pl` or
+  speedscope.
+
+Spans and stacks are tagged with the request id (`X-Request-Id`, or a generated one) and the stage: `queue`
+(admission wait), `load` and `restore` (pipeline loading or moving back to the device), `denoise` (the pipeline
+call) and `encode` (PNG encoding and cache write). Artefacts are written to `AI_PROFILE_DIR` as
+`<time>-<request id>.{trace.json,folded,txt}`.
+
+While disarmed, a request costs one attribute check and each stage an empty context manager; torch is only
+imported once a capture starts.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import List, Optional
+
+from flask import g, jsonify, make_response, request, send_from_directory
+
+from .. import config
+from .admin import admin_error
+
+# Longest time the recorder may stay armed.
+MAX_ARM_S = 3600
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_local = threading.local()
+
+
+class Capture:
+    """Profilers attached to one request's thread."""
+
+    def __init__(self, request_id: str, sample_hz: int):
+        self.request_id = request_id
+        self.sample_hz = sample_hz
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.prefix: Optional[str] = None
+        self._stages: List[str] = []
+        self._samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._profiler = None
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        import torch
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profiler = torch.profiler.profile(activities=activities)
+        self._profiler.start()
+        self._sampler = threading.Thread(target=self._sample, name="ai-profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        interval = 1.0 / self.sample_hz
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                stage = self._stages[-1] if self._stages else "request"
+                self._samples[";".join([self.request_id, stage] + stack[::-1])] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        import torch
+
+        self._stages.append(name)
+        try:
+            with torch.profiler.record_function(f"{name} [{self.request_id}]"):
+                yield
+        finally:
+            self._stages.pop()
+
+    def finish(self, directory: str):
+        """Stop the profilers and write the artefacts; sets `prefix`."""
+        self._stop.set()
+        self._sampler.join()
+        self._profiler.stop()
+        os.makedirs(directory, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        self.prefix = os.path.join(directory, f"{timestamp}-{self.request_id}")
+        self._profiler.export_chrome_trace(f"{self.prefix}.trace.json")
+        with open(f"{self.prefix}.folded", "w") as f:
+            for stack, count in self._samples.items():
+                f.write(f"{stack} {count}\n")
+        with open(f"{self.prefix}.txt", "w") as f:
+            f.write(self._profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=40))
+
+
+class FlightRecorder:
+    def __init__(self, directory: str = config.PROFILE_DIR, sample_hz: int = config.PROFILE_SAMPLE_HZ):
+        self.directory = directory
+        self.sample_hz = sample_hz
+        self._lock = threading.Lock()
+        self._armed = False
+        self._remaining = 0  # captures left; 0 means until the deadline
+        self._deadline: Optional[float] = None
+        self._active: Optional[Capture] = None
+        self.artefacts: List[str] = []
+
+    def arm(self, requests: int = 1, seconds: float = 0.0):
+        with self._lock:
+            self._armed = True
+            self._remaining = requests
+            self._deadline = time.monotonic() + seconds if seconds else None
+        print(f"Flight recorder armed: requests={requests or 'any'}, seconds={seconds or 'unlimited'}")
+
+    def disarm(self):
+        with self._lock:
+            self._armed = False
+
+    def _claim(self, request_id: str) -> Optional[Capture]:
+        if not self._armed:
+            return None
+        with self._lock:
+            if not self._armed or self._active is not None:
+                return None
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                self._armed = False
+                return None
+            if self._remaining:
+                self._remaining -= 1
+                self._armed = self._remaining > 0
+            capture = self._active = Capture(request_id, self.sample_hz)
+        try:
+            capture.start()
+        except Exception as e:
+            print(f"Profiler capture failed to start: {e!r}")
+            with self._lock:
+                self._active = None
+            return None
+        return capture
+
+    def _release(self, capture: Capture):
+        try:
+            capture.finish(self.directory)
+            self.artefacts.append(os.path.basename(capture.prefix))
+            print(f"Profile of request {capture.request_id} written to {capture.prefix}.*")
+        except Exception as e:
+            print(f"Profiler capture of request {capture.request_id} failed: {e!r}")
+        finally:
+            with self._lock:
+                self._active = None
+
+    @contextmanager
+    def capture(self, request_id: str, label: str):
+        """Record the block when the recorder is armed; yields the capture, or None."""
+        capture = self._claim(request_id)
+        if capture is None:
+            yield None
+            return
+        _local.capture = capture
+        try:
+            with capture.stage(label):
+                yield capture
+        finally:
+            _local.capture = None
+            self._release(capture)
+
+    def stats(self) -> dict:
+        with self._lock:
+            remaining_s = self._deadline - time.monotonic() if self._deadline is not None else None
+            return {
+                "armed": self._armed and (remaining_s is None or remaining_s > 0),
+                "remaining_requests": self._remaining or None,
+                "remaining_s": round(max(remaining_s, 0.0), 1) if remaining_s is not None else None,
+                "capturing": self._active.request_id if self._active is not None else None,
+                "directory": self.directory,
+                "artefacts": list(self.artefacts),
+            }
+
+
+recorder = FlightRecorder()
+
+
+@contextmanager
+def stage(name: str):
+    """Tag the block as stage `name` of the request being captured on this thread (no-op otherwise)."""
+    capture = getattr(_local, "capture", None)
+    if capture is None:
+        yield
+        return
+    with capture.stage(name):
+        yield
+
+
+def profiled(view):
+    """Give the request an id (`X-Request-Id`) and record it when the flight recorder is armed."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get("X-Request-Id", "")
+        g.request_id = supplied if _REQUEST_ID.match(supplied) else uuid.uuid4().hex[:16]
+        with recorder.capture(g.request_id, request.path) as capture:
+            response = make_response(view(*args, **kwargs))
+        response.headers["X-Request-Id"] = g.request_id
+        if capture is not None and capture.prefix is not None:
+            response.headers["X-Profile"] = os.path.basename(capture.prefix)
+        return response
+
+    return wrapper
+
+
+# ---- Admin endpoints ----
+def route_profile():
+    """GET: recorder state; POST `{"requests": n, "seconds": t}`: arm it; DELETE: disarm it."""
+    error = admin_error()
+    if error is not None:
+        return error
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        try:
+            seconds = float(payload.get("seconds", 0))
+            requests = int(payload.get("requests", 0 if seconds else 1))
+        except (TypeError, ValueError):
+            return jsonify({"error": "`requests` and `seconds` must be numbers"}), 400
+        if requests < 0 or seconds < 0 or not (requests or seconds):
+            return jsonify({"error": "set a positive `requests` and/or `seconds`"}), 400
+        recorder.arm(requests, min(seconds, MAX_ARM_S))
+    elif request.method == "DELETE":
+        recorder.disarm()
+    return jsonify(recorder.stats())
+
+
+def route_profile_artefact(name: str):
+    error = admin_error()
+    if error is not None:
+        return error
+    return send_from_directory(recorder.directory, name)
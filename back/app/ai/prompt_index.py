@@ -0,0 +1,400 @@
+"""Near-duplicate prompt index for preview responses.
+
+Every generated image is indexed under its prompt, per scope (model and size). A request sent with
+`"preview": true` whose exact result is not cached yet is answered at once with the image of the closest indexed
+prompt, while its exact generation is queued in the background; repeating the request later returns the exact
+image. Prompts are matched in two stages:
+
+- by normalised key: case, Unicode forms, punctuation and whitespace folded (`normalize_prompt`);
+- with `AI_PROMPT_INDEX_EMBED`, by nearest neighbour of the CLIP text embedding (the pooled output of the served
+  model's text encoder, on the CPU), above `AI_PROMPT_INDEX_THRESHOLD` cosine similarity, which also catches
+  synonyms and reworded prompts.
+
+The embeddings are one NumPy matrix searched with a single matrix-vector product. The index holds at most
+`AI_PROMPT_INDEX_ITEMS` prompts, evicting the least recently used, and is saved to `AI_PROMPT_INDEX_DIR`. Inserts
+are embedded on a background thread; NumPy, torch and the text encoder are only imported once the index is used.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from flask import copy_current_request_context
+
+from .. import config
+from .admission import AdmissionRejected
+from .cancellation import CancellationToken, GenerationCancelled
+from .images import image_response
+from .result_cache import example_cache
+from .singleflight import inflight
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Inserts between two saves of the index.
+SAVE_EVERY = 32
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lookup key of `prompt`: Unicode compatibility forms, case, punctuation and whitespace folded."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def prompt_scope(model: str, width: int, height: int) -> str:
+    return f"{model}::{width}x{height}"
+
+
+@dataclass
+class IndexEntry:
+    prompt: str
+    key: str
+    scope: str
+    digest: str
+
+
+@dataclass(frozen=True)
+class PreviewMatch:
+    digest: str
+    prompt: str
+    similarity: float
+    kind: str  # "normalized" or "nearest"
+
+
+class TextEncoder:
+    """CLIP text encoder of the served model, kept on the CPU, loaded on first use.
+
+    `_lock` only serialises loading. Once loaded, `embed` runs without it: an inference-mode forward pass does not
+    mutate the model, so a request's lookup never waits behind background inserts.
+    """
+
+    def __init__(self, model_id: str = config.MODEL_ID):
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._model = None
+        self._failed = False
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        with self._lock:
+            if self._model is not None or self._failed:
+                return
+            try:
+                from transformers import CLIPTextModel, CLIPTokenizer
+
+                self._tokenizer = CLIPTokenizer.from_pretrained(self.model_id, subfolder="tokenizer")
+                self._model = CLIPTextModel.from_pretrained(self.model_id, subfolder="text_encoder").eval()
+                print("Prompt index text encoder loaded")
+            except Exception as e:
+                self._failed = True
+                print(f"Prompt index text encoder failed to load, matching normalised prompts only: {e!r}")
+
+    def embed(self, prompts: List[str]) -> Optional["np.ndarray"]:
+        """L2-normalised float32 embeddings of `prompts`, one row each (None when the encoder is unavailable)."""
+        if self._model is None:
+            self.load()
+        tokenizer, model = self._tokenizer, self._model
+        if model is None:
+            return None
+        import torch
+
+        with torch.inference_mode():
+            inputs = tokenizer(
+                prompts,
+                padding="max_length",
+                max_length=tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="pt",
+            )
+            pooled = model(input_ids=inputs.input_ids).pooler_output.float()
+            return torch.nn.functional.normalize(pooled, dim=-1).numpy()
+
+
+class PromptIndex:
+    def __init__(
+        self,
+        directory: str = config.PROMPT_INDEX_DIR,
+        max_items: int = config.PROMPT_INDEX_ITEMS,
+        threshold: float = config.PROMPT_INDEX_THRESHOLD,
+        embed: bool = config.PROMPT_INDEX_EMBED,
+    ):
+        self.directory = directory
+        self.max_items = max_items
+        self.threshold = threshold
+        self.encoder = TextEncoder() if embed else None
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Row i of the arrays belongs to `_entries[i]`; a None entry is a free row.
+        self._entries: List[Optional[IndexEntry]] = []
+        self._rows: Dict[Tuple[str, str], int] = {}
+        self._scopes: Dict[str, int] = {}
+        self._vectors: Optional["np.ndarray"] = None  # (capacity, dim) float32
+        self._scope_ids: Optional["np.ndarray"] = None  # (capacity,) int32, -1 for a free row
+        self._last_used: Optional["np.ndarray"] = None  # (capacity,) float64, wall-clock seconds
+        self._unsaved = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai-prompt-index")
+        self.counters = {"normalized_hits": 0, "nearest_hits": 0, "misses": 0, "inserted": 0, "evicted": 0}
+
+    # ---- Storage ----
+    def _reserve(self, size: int, dim: Optional[int] = None):
+        """Grow the arrays (doubling, up to `max_items` rows) to hold `size` rows, and vectors of `dim`."""
+        import numpy as np
+
+        capacity = len(self._last_used) if self._last_used is not None else 0
+        if size > capacity:
+            capacity = min(max(64, 2 * capacity, size), self.max_items)
+            last_used = np.zeros(capacity)
+            scope_ids = np.full(capacity, -1, dtype=np.int32)
+            count = len(self._entries)
+            if self._last_used is not None:
+                last_used[:count] = self._last_used[:count]
+                scope_ids[:count] = self._scope_ids[:count]
+            self._last_used, self._scope_ids = last_used, scope_ids
+            if self._vectors is not None:
+                vectors = np.zeros((capacity, self._vectors.shape[1]), dtype=np.float32)
+                vectors[:count] = self._vectors[:count]
+                self._vectors = vectors
+        if dim is not None and self._vectors is None:
+            self._vectors = np.zeros((len(self._last_used), dim), dtype=np.float32)
+
+    def _allocate_row(self) -> int:
+        """A row for a new entry: a new one while there is room, else a freed or the least recently used one."""
+        import numpy as np
+
+        count = len(self._entries)
+        if count < self.max_items:
+            self._reserve(count + 1)
+            self._entries.append(None)
+            return count
+        row = int(np.argmin(self._last_used[:count]))
+        evicted = self._entries[row]
+        if evicted is not None:
+            self._rows.pop((evicted.scope, evicted.key), None)
+            self.counters["evicted"] += 1
+        return row
+
+    def _drop(self, row: int):
+        entry = self._entries[row]
+        self._rows.pop((entry.scope, entry.key), None)
+        self._entries[row] = None
+        self._scope_ids[row] = -1
+        self._last_used[row] = 0.0  # reused first
+
+    def _scope_id(self, scope: str) -> int:
+        return self._scopes.setdefault(scope, len(self._scopes))
+
+    # ---- Persistence ----
+    def _paths(self) -> Tuple[str, str]:
+        return os.path.join(self.directory, "index.json"), os.path.join(self.directory, "vectors.npy")
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if self.directory:
+                self._load_locked()
+
+    def _load_locked(self):
+        import numpy as np
+
+        index_path, vectors_path = self._paths()
+        try:
+            with open(index_path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Prompt index not loaded: {e!r}")
+            return
+        entries = saved["entries"][-self.max_items :] if self.max_items else []
+        vectors = None
+        if self.encoder is not None and saved.get("encoder") == self.encoder.model_id and saved.get("vectors"):
+            try:
+                vectors = np.load(vectors_path)[-len(entries) :] if entries else None
+            except (OSError, ValueError) as e:
+                print(f"Prompt index embeddings not loaded: {e!r}")
+        self._reserve(len(entries), vectors.shape[1] if vectors is not None else None)
+        for row, item in enumerate(entries):
+            entry = IndexEntry(item["prompt"], item["key"], item["scope"], item["digest"])
+            self._entries.append(entry)
+            self._rows[(entry.scope, entry.key)] = row
+            self._scope_ids[row] = self._scope_id(entry.scope)
+            self._last_used[row] = item["last_used"]
+        if vectors is not None and len(vectors) == len(entries):
+            self._vectors[: len(entries)] = vectors.astype(np.float32)
+        print(f"Prompt index loaded: {len(entries)} prompts")
+
+    def save(self):
+        if not self.directory or not self._loaded:
+            return
+        import numpy as np
+
+        with self._lock:
+            rows = [row for row, entry in enumerate(self._entries) if entry is not None]
+            # Oldest first, so a smaller `max_items` keeps the most recent prompts on load.
+            rows.sort(key=lambda row: self._last_used[row])
+            entries = [{**asdict(self._entries[row]), "last_used": float(self._last_used[row])} for row in rows]
+            vectors = self._vectors[rows].astype(np.float16) if self._vectors is not None else None
+            self._unsaved = 0
+        os.makedirs(self.directory, exist_ok=True)
+        index_path, vectors_path = self._paths()
+        if vectors is not None:
+            with open(f"{vectors_path}.tmp-{os.getpid()}", "wb") as f:
+                np.save(f, vectors)
+            os.replace(f"{vectors_path}.tmp-{os.getpid()}", vectors_path)
+        saved = {
+            "encoder": self.encoder.model_id if self.encoder is not None else None,
+            "vectors": vectors is not None,
+            "entries": entries,
+        }
+        with open(f"{index_path}.tmp-{os.getpid()}", "w") as f:
+            json.dump(saved, f)
+        os.replace(f"{index_path}.tmp-{os.getpid()}", index_path)
+
+    # ---- Inserts ----
+    def add(self, prompt: str, scope: str, digest: str):
+        """Index `prompt` as rendered by image `digest`; the embedding is computed in the background."""
+        if not self.max_items or not prompt:
+            return
+        self._ensure_loaded()
+        key = normalize_prompt(prompt)
+        with self._lock:
+            row = self._rows.get((scope, key))
+            if row is not None and self._entries[row].digest == digest:
+                self._last_used[row] = time.time()
+                return
+        self._writer.submit(self._insert, prompt, key, scope, digest)
+
+    def _insert(self, prompt: str, key: str, scope: str, digest: str):
+        vectors = self.encoder.embed([prompt]) if self.encoder is not None else None
+        with self._lock:
+            row = self._rows.get((scope, key))
+            if row is None:
+                row = self._allocate_row()
+                self._rows[(scope, key)] = row
+            self._entries[row] = IndexEntry(prompt, key, scope, digest)
+            self._scope_ids[row] = self._scope_id(scope)
+            self._last_used[row] = time.time()
+            if vectors is not None:
+                self._reserve(len(self._entries), vectors.shape[1])
+                self._vectors[row] = vectors[0]
+            elif self._vectors is not None:
+                self._vectors[row] = 0.0
+            self.counters["inserted"] += 1
+            self._unsaved += 1
+            due = self._unsaved >= SAVE_EVERY
+        if due:
+            self.save()
+
+    # ---- Lookups ----
+    def lookup(self, prompt: str, scope: str) -> Optional[PreviewMatch]:
+        """The closest indexed prompt of `scope` whose image is still cached, or None."""
+        if not self.max_items or not prompt:
+            return None
+        self._ensure_loaded()
+        match = self._lookup_key(normalize_prompt(prompt), scope) or self._lookup_nearest(prompt, scope)
+        if match is None:
+            self.counters["misses"] += 1
+        else:
+            self.counters[f"{match.kind}_hits"] += 1
+        return match
+
+    def _match(self, row: int, similarity: float, kind: str) -> Optional[PreviewMatch]:
+        """Match for `row` (callers hold `_lock`); drops the entry when its image is gone."""
+        entry = self._entries[row]
+        if not example_cache.exists(entry.digest):
+            self._drop(row)
+            return None
+        self._last_used[row] = time.time()
+        return PreviewMatch(entry.digest, entry.prompt, similarity, kind)
+
+    def _lookup_key(self, key: str, scope: str) -> Optional[PreviewMatch]:
+        with self._lock:
+            row = self._rows.get((scope, key))
+            return self._match(row, 1.0, "normalized") if row is not None else None
+
+    def _lookup_nearest(self, prompt: str, scope: str) -> Optional[PreviewMatch]:
+        if self.encoder is None or self._vectors is None:
+            return None
+        if not self.encoder.ready:
+            # Never load the encoder on the request path.
+            self._writer.submit(self.encoder.load)
+            return None
+        query = self.encoder.embed([prompt])
+        if query is None:
+            return None
+        import numpy as np
+
+        with self._lock:
+            scope_id = self._scopes.get(scope)
+            count = len(self._entries)
+            if scope_id is None or not count:
+                return None
+            scores = self._vectors[:count] @ query[0]
+            scores[self._scope_ids[:count] != scope_id] = -1.0
+            row = int(np.argmax(scores))
+            if scores[row] < self.threshold:
+                return None
+            return self._match(row, float(scores[row]), "nearest")
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "prompts": sum(entry is not None for entry in self._entries),
+                "max_items": self.max_items,
+                "encoder_ready": self.encoder.ready if self.encoder is not None else None,
+                **self.counters,
+            }
+
+
+prompt_index = PromptIndex()
+atexit.register(prompt_index.save)
+
+
+# ---- Preview responses ----
+_background = ThreadPoolExecutor(max_workers=config.PREVIEW_WORKERS, thread_name_prefix="ai-preview")
+
+
+def queue_exact(cache_key: str, generate, steps: int):
+    """Run a preview-answered request's exact generation in the background, joining any flight for the same key.
+
+    Call from the request: `generate` keeps the request context. The generation is not tied to the client
+    connection, which is closed once the preview is sent.
+    """
+
+    @copy_current_request_context
+    def run():
+        try:
+            inflight.do(cache_key, generate, CancellationToken(steps=steps))
+        except AdmissionRejected as e:
+            print(f"Background generation rejected: {e.reason}")
+        except GenerationCancelled as e:
+            print(f"Background generation cancelled: {e.reason}")
+        except Exception as e:
+            print(f"Background generation failed: {e!r}")
+
+    _background.submit(run)
+
+
+def preview_response(match: PreviewMatch):
+    """The image of a near-duplicate prompt, marked as a preview and never stored by HTTP caches."""
+    response = image_response(match.digest)
+    response.headers["X-Preview"] = match.kind
+    response.headers["X-Preview-Similarity"] = f"{match.similarity:.3f}"
+    response.headers["Cache-Control"] = "no-store"
+    return response
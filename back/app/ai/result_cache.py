@@ -0,0 +1,173 @@
+"""Result cache for generated images.
+
+Images are stored once, as PNG, under the SHA-256 of their bytes (`objects/`), and each cache key points to the
+digest of its image (`keys/`). The digest doubles as the image's public GET URL and strong ETag (see
+`images.py`). The directory tier survives restarts and is shared by every process on the host: worker
+processes and the offline pre-population job (`prepopulate_cache.py`) all read and write the same entries. A
+bounded in-memory LRU sits in front of it, and holds the PNG bytes themselves when no directory is configured.
+"""
+
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from .. import config
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+# ---- Cache keys (shared by the routes and the pre-population job) ----
+# Version of the key format, prefixed to every key. Bump it whenever the builders below render a request
+# differently (v2: prompts folded by `canonical_prompt`). Keys of other versions are never read; on disk they
+# live under their own `keys/<version>/` directory (unversioned `keys/<xx>/` entries predate v2), so stale
+# entries can be deleted wholesale. The image objects themselves are shared by every version.
+KEY_VERSION = "v2"
+
+
+def canonical_prompt(prompt):
+    """`prompt` with its case and whitespace folded, as the CLIP tokenizer does: both forms render the same image."""
+    return " ".join(prompt.split()).lower() if isinstance(prompt, str) else prompt
+
+
+def base_cache_key(prompt, steps, cfg_scale, seed, width, height, suffix: str = "") -> str:
+    prompt = canonical_prompt(prompt)
+    return f"{KEY_VERSION}::base::{prompt}::{steps}::{cfg_scale}::{seed}::{width}::{height}{suffix}"
+
+
+def lora_cache_key(prompt, negative_prompt, steps, cfg_scale, seed, width, height, lora_scale, suffix: str = "") -> str:
+    prompt, negative_prompt = canonical_prompt(prompt), canonical_prompt(negative_prompt)
+    return (
+        f"{KEY_VERSION}::lora::{prompt}::{negative_prompt}::{steps}::{cfg_scale}::"
+        f"{seed}::{width}::{height}::{lora_scale}{suffix}"
+    )
+
+
+def refine_cache_key(kind, source, prompt, negative_prompt, steps, cfg_scale, seed, strength, scale, lora_scale) -> str:
+    """Key of a variation or hi-res refinement (`kind`) of the image with digest `source`."""
+    prompt, negative_prompt = canonical_prompt(prompt), canonical_prompt(negative_prompt)
+    return (
+        f"{KEY_VERSION}::{kind}::{source}::{prompt}::{negative_prompt}::{steps}::{cfg_scale}::"
+        f"{seed}::{strength}::{scale}::{lora_scale}"
+    )
+
+
+def encode_png(image: "Image.Image") -> Tuple[str, bytes]:
+    """PNG bytes of `image` and their SHA-256 hex digest."""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    data = buffer.getvalue()
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write-then-rename so concurrent readers never see a partial file.
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResultCache:
+    def __init__(self, directory: str = config.RESULT_CACHE_DIR, memory_items: int = config.RESULT_CACHE_MEMORY_ITEMS):
+        self.directory = directory
+        self.memory_items = memory_items
+        self._lock = threading.Lock()
+        # key -> (digest, PNG bytes, or None when the bytes live in the directory)
+        self._memory: "OrderedDict[str, Tuple[str, Optional[bytes]]]" = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # ---- Paths ----
+    def _key_path(self, key: str) -> str:
+        key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "keys", KEY_VERSION, key_hash[:2], key_hash)
+
+    def path(self, digest: str) -> Optional[str]:
+        """File holding the image with this digest, if it is stored on disk."""
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, "objects", digest[:2], f"{digest}.png")
+        return path if os.path.exists(path) else None
+
+    # ---- Lookups ----
+    def _remember(self, key: str, digest: str, data: Optional[bytes]):
+        with self._lock:
+            self._memory[key] = (digest, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def digest(self, key: str) -> Optional[str]:
+        """Digest of the image cached under `key`, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry[0]
+        if not self.directory:
+            return None
+        try:
+            with open(self._key_path(key)) as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        if self.path(digest) is None:
+            return None
+        self._remember(key, digest, None)
+        return digest
+
+    def read(self, digest: str) -> Optional[bytes]:
+        """PNG bytes of the image with this digest, or None."""
+        path = self.path(digest)
+        if path is not None:
+            with open(path, "rb") as f:
+                return f.read()
+        with self._lock:
+            for entry_digest, data in self._memory.values():
+                if entry_digest == digest and data is not None:
+                    return data
+        return None
+
+    def put(self, key: str, image: "Image.Image") -> str:
+        """Cache `image` under `key` and return its digest."""
+        with stage("encode"):
+            digest, data = encode_png(image)
+            if self.directory:
+                if self.path(digest) is None:
+                    _write_atomic(os.path.join(self.directory, "objects", digest[:2], f"{digest}.png"), data)
+                _write_atomic(self._key_path(key), digest.encode("ascii"))
+                self._remember(key, digest, None)
+            else:
+                self._remember(key, digest, data)
+        return digest
+
+    def exists(self, digest: str) -> bool:
+        """Whether the image with this digest is still stored."""
+        return self.path(digest) is not None or self.read(digest) is not None
+
+    # ---- Mapping interface ----
+    def __contains__(self, key: str) -> bool:
+        return self.digest(key) is not None
+
+    def __getitem__(self, key: str) -> "Image.Image":
+        digest = self.digest(key)
+        data = self.read(digest) if digest is not None else None
+        if data is None:
+            raise KeyError(key)
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as stored:
+            return stored.copy()
+
+    def __setitem__(self, key: str, image: "Image.Image"):
+        self.put(key, image)
+
+
+# Shared by both AI routes; their cache keys are already namespaced ("base::" / "lora::").
+example_cache = ResultCache()
@@ -0,0 +1,157 @@
+"""Model weights shared between worker processes through memory-mapped safetensors.
+
+The UNet, VAE and text-encoder safetensors are staged once per host into a shared directory (`/dev/shm` by
+default), already converted to the inference dtype. Every worker then maps those files copy-on-write and
+builds its modules directly on top of the mapped pages: N workers share one physical copy of the weights, and
+start-up maps pages instead of deserialising tensors.
+
+Weights only stay shared while nobody writes to them. Anything that rewrites a tensor in place or replaces it
+(moving to an accelerator, `channels_last`, int8 quantisation, LoRA fusing) gives that worker a private copy of
+the affected tensors, which is the expected cost of those options.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+from accelerate import init_empty_weights
+from diffusers import AutoencoderKL, UNet2DConditionModel
+from huggingface_hub import snapshot_download
+from safetensors.torch import load_file, save_file
+from transformers import CLIPTextConfig, CLIPTextModel
+
+from .. import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only, no cross-process lock needed.
+    fcntl = None
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Component -> weight file inside a diffusers model repository.
+COMPONENT_FILES = {
+    "unet": "unet/diffusion_pytorch_model.safetensors",
+    "vae": "vae/diffusion_pytorch_model.safetensors",
+    "text_encoder": "text_encoder/model.safetensors",
+}
+
+
+# ---- Mapping ----
+def map_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """Return the tensors of a safetensors file as views over a copy-on-write memory map of the file."""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        # MAP_PRIVATE: pages come from the shared page cache and are only copied if a tensor is written to.
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - start) // dtype.itemsize, offset=data_start + start)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+# ---- Staging ----
+@contextmanager
+def _host_lock(directory: str):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _stage_file(source: str, target: str, dtype: torch.dtype):
+    """Copy `source` to `target`, converting floating point tensors to `dtype` when they differ."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_target = f"{target}.tmp-{os.getpid()}"
+    tensors = map_safetensors(source)
+    if all(t.dtype == dtype or not t.is_floating_point() for t in tensors.values()):
+        shutil.copyfile(source, tmp_target)
+    else:
+        converted = load_file(source)
+        converted = {k: v.to(dtype) if v.is_floating_point() else v for k, v in converted.items()}
+        save_file(converted, tmp_target)
+    os.replace(tmp_target, target)
+
+
+def staged_path(source: str, namespace: str, dtype: torch.dtype) -> str:
+    """Return the shared copy of `source`, staging it on first use. Safe to call from concurrent workers."""
+    dtype_name = str(dtype).replace("torch.", "")
+    target = os.path.join(config.SHARED_WEIGHTS_DIR, namespace.replace("/", "--"), dtype_name, os.path.basename(source))
+    if os.path.exists(target):
+        return target
+    with _host_lock(config.SHARED_WEIGHTS_DIR):
+        if not os.path.exists(target):
+            print(f"Staging shared weights {source} -> {target}")
+            _stage_file(source, target, dtype)
+    return target
+
+
+def _model_snapshot(model_id: str) -> str:
+    if os.path.isdir(model_id):
+        return model_id
+    return snapshot_download(
+        model_id,
+        allow_patterns=["*/config.json", *COMPONENT_FILES.values()],
+    )
+
+
+# ---- Model construction ----
+def _assign(model: torch.nn.Module, tensors: Dict[str, torch.Tensor]):
+    missing, _ = model.load_state_dict(tensors, strict=False, assign=True)
+    missing_params = [name for name in missing if name in dict(model.named_parameters())]
+    if missing_params:
+        raise ValueError(f"Shared weights are missing parameters: {', '.join(missing_params[:5])}")
+    return model.eval()
+
+
+def load_shared_components(model_id: str, dtype: torch.dtype) -> Dict[str, torch.nn.Module]:
+    """Build the UNet, VAE and text encoder of `model_id` on top of shared, memory-mapped weights."""
+    snapshot = _model_snapshot(model_id)
+    with init_empty_weights():
+        modules = {
+            "unet": UNet2DConditionModel.from_config(UNet2DConditionModel.load_config(snapshot, subfolder="unet")),
+            "vae": AutoencoderKL.from_config(AutoencoderKL.load_config(snapshot, subfolder="vae")),
+            "text_encoder": CLIPTextModel(CLIPTextConfig.from_pretrained(snapshot, subfolder="text_encoder")),
+        }
+
+    for component, relative_path in COMPONENT_FILES.items():
+        path = staged_path(os.path.join(snapshot, relative_path), f"{model_id}/{component}", dtype)
+        _assign(modules[component], map_safetensors(path))
+    return modules
+
+
+def map_lora_weights(path: str, dtype: torch.dtype) -> Dict[str, torch.Tensor]:
+    """Memory-mapped LoRA state dict, staged in the shared directory like the base weights."""
+    return map_safetensors(staged_path(path, "lora/" + os.path.basename(os.path.dirname(path)), dtype))
@@ -0,0 +1,96 @@
+"""Coalescing of identical in-flight generation requests.
+
+The result cache only helps once an image exists. `SingleFlight` covers the window before that: the first
+request for a key runs the generation, concurrent requests for the same key wait for its result instead of
+generating their own copy.
+
+If the leader fails with an ordinary error, every waiter receives that error (the same request would fail the
+same way, and nothing is cached). If the leader is cancelled (`concurrent.futures.CancelledError`, or a
+`BaseException` such as a worker shutdown) or refused admission (`AdmissionRejected`: its client's concurrency
+cap, its queue timeout), its waiters did not cause that: one of them is promoted to leader and generates the
+result itself, going through admission on its own account.
+
+Each flight carries a `TokenGroup` of its callers' cancellation tokens, passed to `fn`: the generation is only
+cancelled once every caller has gone away, and a waiter whose own token is cancelled stops waiting.
+"""
+
+import threading
+from concurrent.futures import CancelledError
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .admission import AdmissionRejected
+from .cancellation import CancellationToken, TokenGroup
+
+
+class _Flight:
+    def __init__(self, token: Optional[CancellationToken]):
+        self.token = TokenGroup([token] if token is not None else [])
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+def _leader_cancelled(error: Optional[BaseException]) -> bool:
+    """Whether the leader failed for reasons of its own, which its waiters should not inherit."""
+    if isinstance(error, (CancelledError, AdmissionRejected)):
+        return True
+    return error is not None and not isinstance(error, Exception)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def do(
+        self, key: str, fn: Callable[[TokenGroup], Any], token: Optional[CancellationToken] = None
+    ) -> Tuple[Any, bool]:
+        """Run `fn(group_token)` once for all concurrent callers using `key`.
+
+        Returns `(result, shared)` where `shared` is True when the result came from another caller's run.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight(token)
+                else:
+                    flight.waiters += 1
+                    if token is not None:
+                        flight.token.add(token)
+
+            if leader:
+                try:
+                    flight.result = fn(flight.token)
+                except BaseException as e:
+                    # Waiters only need to know the leader was cancelled or rejected; keep its traceback (and
+                    # the tensors referenced from it) out of the shared flight.
+                    flight.error = CancelledError() if _leader_cancelled(e) else e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+                return flight.result, False
+
+            while not flight.done.wait(timeout=0.5):
+                if token is not None and token.cancelled:
+                    flight.token.discard(token)
+                    # The generation carries on for the remaining waiters; this caller saved nothing.
+                    token.raise_if_cancelled(steps_saved=0)
+            if _leader_cancelled(flight.error):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+    def in_flight(self) -> Dict[str, int]:
+        """Waiters per key currently being generated."""
+        with self._lock:
+            return {key: flight.waiters for key, flight in self._flights.items()}
+
+
+# Shared by the AI routes; their cache keys are already namespaced by model or refinement kind.
+inflight = SingleFlight()
@@ -0,0 +1,48 @@
+"""Operational status endpoints for the AI routes."""
+
+import sys
+
+from flask import jsonify, request
+
+from .admission import admission
+from .cancellation import stats as cancellation_stats
+from .prompt_index import prompt_index
+from .singleflight import inflight
+from .warmup import warmup
+
+
+def route_queue():
+    stats = admission.stats()
+    stats["in_flight"] = len(inflight.in_flight())
+    stats.update(cancellation_stats.as_dict())
+    stats["prompt_index"] = prompt_index.stats()
+    return jsonify(stats)
+
+
+def route_node():
+    """Node status polled by the request router: loaded pipelines, load and readiness."""
+    # The registry and memory manager are only consulted once something imported them; importing them here
+    # would load torch.
+    pipelines = sys.modules.get(f"{__package__}.pipelines")
+    memory = sys.modules.get(f"{__package__}.memory")
+    stats = admission.stats()
+    return jsonify(
+        {
+            "pipelines": pipelines.loaded_pipelines() if pipelines is not None else [],
+            "memory": memory.memory.stats() if memory is not None else None,
+            "active": stats["active"],
+            "max_active": stats["max_active"],
+            "queued": stats["queued"],
+            "in_flight": len(inflight.in_flight()),
+            "ready": warmup.ready,
+        }
+    )
+
+
+def route_health():
+    """Liveness, or readiness with `?ready=1`: 503 until the warm-up has loaded its pipelines."""
+    body = {"status": "ok", "warmup": warmup.stats()}
+    if request.args.get("ready") and not warmup.ready:
+        body["status"] = "warming up" if warmup.state == "running" else "warm-up failed"
+        return jsonify(body), 503
+    return jsonify(body)
@@ -0,0 +1,150 @@
+"""Token merging (ToMe) for the UNet self-attention layers.
+
+Self-attention over the latent tokens of the highest-resolution transformer blocks dominates the cost of a
+denoising step, and grows quadratically with the image size. Before those layers, `ToMeAttnProcessor` merges
+the most similar tokens (bipartite soft matching: one random destination token per 2x2 patch, the `ratio` of
+tokens most similar to a destination are averaged into it), runs the original attention processor on the
+reduced sequence and copies the results back to the merged tokens. This follows "Token Merging for Fast
+Stable Diffusion" (Bolya & Hoffman, 2023), restricted to self-attention.
+
+Merging is applied per call under `TokenMerging.active(...)`; with a ratio of 0 the processors pass straight
+through. The destination tokens are drawn from a generator reset on every call, so a seeded request renders
+the same image at the same ratio.
+"""
+
+import math
+from contextlib import contextmanager
+from typing import Callable, Tuple
+
+import torch
+
+from .. import config
+from .variants import MAX_RATIO
+
+
+def _noop(x: torch.Tensor) -> torch.Tensor:
+    return x
+
+
+def bipartite_soft_matching_2d(
+    metric: torch.Tensor, width: int, height: int, r: int, generator: torch.Generator
+) -> Tuple[Callable, Callable]:
+    """Build `merge` / `unmerge` functions removing `r` tokens from a `(B, height * width, C)` sequence."""
+    batch, tokens, _ = metric.shape
+    if r <= 0:
+        return _noop, _noop
+
+    with torch.no_grad():
+        # One random destination token per 2x2 patch; every other token is a merge source.
+        grid_h, grid_w = height // 2, width // 2
+        rand_idx = torch.randint(4, size=(grid_h, grid_w, 1), generator=generator).to(metric.device)
+        idx_buffer_view = torch.zeros(grid_h, grid_w, 4, device=metric.device, dtype=torch.int64)
+        idx_buffer_view.scatter_(dim=2, index=rand_idx, src=-torch.ones_like(rand_idx))
+        idx_buffer_view = idx_buffer_view.view(grid_h, grid_w, 2, 2).transpose(1, 2).reshape(grid_h * 2, grid_w * 2)
+        if grid_h * 2 < height or grid_w * 2 < width:
+            idx_buffer = torch.zeros(height, width, device=metric.device, dtype=torch.int64)
+            idx_buffer[: grid_h * 2, : grid_w * 2] = idx_buffer_view
+        else:
+            idx_buffer = idx_buffer_view
+        # Destination indices sort first (-1), sources after (0).
+        rand_idx = idx_buffer.reshape(1, -1, 1).argsort(dim=1)
+        num_dst = grid_h * grid_w
+        a_idx = rand_idx[:, num_dst:, :]
+        b_idx = rand_idx[:, :num_dst, :]
+
+        def split(x: torch.Tensor):
+            channels = x.shape[-1]
+            src = torch.gather(x, dim=1, index=a_idx.expand(batch, tokens - num_dst, channels))
+            dst = torch.gather(x, dim=1, index=b_idx.expand(batch, num_dst, channels))
+            return src, dst
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = split(metric)
+        scores = a @ b.transpose(-1, -2)
+
+        r = min(a.shape[1], r)
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[..., r:, :]
+        src_idx = edge_idx[..., :r, :]
+        dst_idx = torch.gather(node_idx[..., None], dim=-2, index=src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        src, dst = split(x)
+        n, t1, c = src.shape
+        unm = torch.gather(src, dim=-2, index=unm_idx.expand(n, t1 - r, c))
+        src = torch.gather(src, dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[..., :unm_len, :], x[..., unm_len:, :]
+        c = unm.shape[-1]
+        src = torch.gather(dst, dim=-2, index=dst_idx.expand(batch, r, c))
+        out = torch.zeros(batch, tokens, c, device=x.device, dtype=x.dtype)
+        source_idx = a_idx.expand(batch, a_idx.shape[1], 1)
+        out.scatter_(dim=-2, index=b_idx.expand(batch, num_dst, c), src=dst)
+        out.scatter_(dim=-2, index=torch.gather(source_idx, dim=1, index=unm_idx).expand(batch, unm_len, c), src=unm)
+        out.scatter_(dim=-2, index=torch.gather(source_idx, dim=1, index=src_idx).expand(batch, r, c), src=src)
+        return out
+
+    return merge, unmerge
+
+
+class TokenMerging:
+    """Per-call merging settings shared by the ToMe processors of one UNet."""
+
+    def __init__(self, max_downsample: int = config.TOME_MAX_DOWNSAMPLE):
+        self.max_downsample = max_downsample
+        self.ratio = 0.0
+        self.latent_size = (0, 0)
+        self.generator = torch.Generator(device="cpu")
+
+    @contextmanager
+    def active(self, ratio: float, width: int, height: int):
+        """Merge `ratio` of the tokens in the eligible self-attention layers for the duration of a call."""
+        self.ratio = min(max(ratio, 0.0), MAX_RATIO)
+        self.latent_size = (height // 8, width // 8)
+        self.generator.manual_seed(0)
+        try:
+            yield
+        finally:
+            self.ratio = 0.0
+
+    def merge_fns(self, hidden_states: torch.Tensor) -> Tuple[Callable, Callable]:
+        latent_h, latent_w = self.latent_size
+        tokens = hidden_states.shape[1]
+        if not self.ratio or not tokens:
+            return _noop, _noop
+        downsample = round(math.sqrt(latent_h * latent_w / tokens))
+        if downsample < 1 or downsample > self.max_downsample:
+            return _noop, _noop
+        width, height = math.ceil(latent_w / downsample), math.ceil(latent_h / downsample)
+        if width * height != tokens:
+            return _noop, _noop
+        return bipartite_soft_matching_2d(hidden_states, width, height, int(tokens * self.ratio), self.generator)
+
+
+class ToMeAttnProcessor:
+    """Wraps a self-attention processor, running it on the merged token sequence."""
+
+    def __init__(self, inner, state: TokenMerging):
+        self.inner = inner
+        self.state = state
+
+    def __call__(self, attn, hidden_states, *args, **kwargs):
+        # Self-attention: there are no encoder states to merge, and the mask (if any) is not per token.
+        merge, unmerge = self.state.merge_fns(hidden_states)
+        return unmerge(self.inner(attn, merge(hidden_states), *args, **kwargs))
+
+
+def apply_token_merging(unet, max_downsample: int = config.TOME_MAX_DOWNSAMPLE) -> TokenMerging:
+    """Wrap the UNet's self-attention (`attn1`) processors; call after any other processor change."""
+    state = TokenMerging(max_downsample)
+    processors = {
+        name: ToMeAttnProcessor(processor, state) if name.endswith("attn1.processor") else processor
+        for name, processor in unet.attn_processors.items()
+    }
+    unet.set_attn_processor(processors)
+    return state
@@ -1,21 +1,16 @@
-from flask import jsonify, request, send_file
-from diffusers import StableDiffusionPipeline
-import torch
-import io
-import os
-from typing import Dict
-from PIL import Image
+from flask import jsonify, request
 
+from .admission import add_queue_headers, admission, lane_for
+from .cancellation import request_token
+from .degradation import add_effective_headers, degrade, exact_params
+from .generation import generate_image, serve_generation
+from .images import image_response
+from .latent_cache import CachedLatents
+from .prompt_index import prompt_index, prompt_scope
+from .result_cache import example_cache, lora_cache_key
+from .variants import add_deepcache_headers, cache_interval, cache_key_suffix, tome_key_suffix, tome_ratio
 
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, "../../../"))
-
-
-
-# ---- LAZY CACHE ----
-example_cache: Dict[str, Image.Image] = {}
-
 def route_trainedModel():
     
 
@@ -33,56 +28,80 @@ def route_trainedModel():
 
     if not prompt:
         return jsonify({"error": "Prompt required"}), 400
+    try:
+        merge_ratio = tome_ratio(payload)
+        feature_interval = cache_interval(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # ---- Seed handling ----
-    generator = None
-    if seed != -1:
-        generator = torch.Generator(device="cuda").manual_seed(seed)
+    # ---- Effective parameters under load ----
+    exact = exact_params(steps, width, height)
+    params = degrade(payload, steps, width, height, admission.estimated_wait())
+    variant_suffix = tome_key_suffix(merge_ratio) + cache_key_suffix(feature_interval)
 
     # ---- Cache key ----
-    cache_key = (
-        f"lora::{prompt}::{negative_prompt}::{steps}::{cfg_scale}::"
-        f"{seed}::{width}::{height}::{lora_scale}"
-    )
-
-    if cache_key in example_cache:
-        print("LoRA image served from cache")
-        image = example_cache[cache_key]
-    else:
-        
-        model_id = "runwayml/stable-diffusion-v1-5"
-
-        pipe = StableDiffusionPipeline.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16,
-            device_map="cuda"
-        )
-        pipe.load_lora_weights(
-        os.path.join(PROJECT_ROOT, "model", "sd-indoor-segmentation-lora"),
-        weight_name="pytorch_lora_weights.safetensors"
+    def make_cache_key(p):
+        return lora_cache_key(
+            prompt,
+            negative_prompt,
+            p.steps,
+            cfg_scale,
+            seed,
+            p.width,
+            p.height,
+            lora_scale,
+            p.key_suffix + variant_suffix,
         )
 
-        print("LoRA model loaded")
-        
-        print("LoRA image generated (cache miss)")
-
-        image = pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=steps,
-            guidance_scale=cfg_scale,
-            width=width,
-            height=height,
-            generator=generator,
-            cross_attention_kwargs={"scale": lora_scale},
-        ).images[0]
-
-        example_cache[cache_key] = image
-
-    img_io = io.BytesIO()
-    image.save(img_io, "PNG")
-    img_io.seek(0)
-
-    return send_file(img_io, mimetype="image/png")
+    # An exact render already in the cache beats a degraded one.
+    if params.level and make_cache_key(exact) in example_cache:
+        params = exact
+    cache_key = make_cache_key(params)
+
+    lane = lane_for(payload, params.steps, params.render_width, params.render_height)
+    scope = prompt_scope("lora", width, height)
+    token = request_token(params.steps)
+
+    measured = {}
+
+    def render(entry, callback):
+        from .device import make_generator
+        from .pipelines import LORA_ADAPTER
+
+        with entry.scheduler(params.scheduler), entry.token_merging(
+            merge_ratio, params.render_width, params.render_height
+        ), entry.feature_cache(feature_interval) as run:
+            cross_attention_kwargs = entry.lora_kwargs(LORA_ADAPTER, lora_scale)
+            image = entry(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=params.steps,
+                guidance_scale=cfg_scale,
+                width=params.render_width,
+                height=params.render_height,
+                generator=make_generator(seed),
+                callback_on_step_end=callback,
+                cross_attention_kwargs=cross_attention_kwargs,
+            ).images[0]
+        measured["run"] = run
+        return params.upscale(image)
+
+    # Kept for /variation and /upscale; the latents of a degraded render do not match the returned image.
+    latents = None
+    if not params.level:
+        latents = CachedLatents(None, "lora", prompt, negative_prompt, cfg_scale, lora_scale=lora_scale)
+
+    def generate(flight_token):
+        return generate_image("lora", cache_key, render, lane, flight_token, "LoRA image", latents)
+
+    preview = (prompt, scope) if payload.get("preview") else None
+    digest, response = serve_generation(cache_key, generate, token, "LoRA image", preview)
+    if response is not None:
+        return response
+
+    prompt_index.add(prompt, scope, digest)
+    response = add_queue_headers(image_response(digest))
+    response = add_effective_headers(response, params)
+    return add_deepcache_headers(response, measured.get("run"))
 
 
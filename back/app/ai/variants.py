@@ -0,0 +1,82 @@
+"""Per-request render variants: token merging and feature caching.
+
+Payload parsing, cache-key suffixes and response headers for the options implemented in `tome.py` and
+`deepcache.py`. This module does not import torch, so the routes can use it without loading the ML stack.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from .. import config
+
+# Merging more than this fraction of tokens degrades images badly.
+MAX_RATIO = 0.75
+# Beyond this interval the reused features are too stale for usable images.
+MAX_INTERVAL = 10
+
+
+def _number(payload: dict, field: str, default) -> float:
+    """`payload[field]` (or `default`) as a finite number; missing or empty means 0. Raises ValueError otherwise."""
+    value = payload.get(field, default)
+    if value is None or value == "":
+        return 0.0
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = math.nan
+    if isinstance(value, bool) or not math.isfinite(number):
+        raise ValueError(f"{field} must be a number")
+    return number
+
+
+# ---- Token merging ----
+def tome_ratio(payload: dict) -> float:
+    """Requested fraction of tokens to merge, clamped to [0, MAX_RATIO]. Raises ValueError for a non-number."""
+    ratio = _number(payload, "tome_ratio", config.TOME_RATIO)
+    return min(max(ratio, 0.0), MAX_RATIO)
+
+
+def tome_key_suffix(ratio: float) -> str:
+    """Cache-key suffix for renders with token merging (empty without)."""
+    return f"::tome::{ratio}" if ratio else ""
+
+
+# ---- Feature caching ----
+@dataclass
+class DeepCacheRun:
+    interval: int
+    full_calls: int = 0
+    cached_calls: int = 0
+    full_time_s: float = 0.0
+    cached_time_s: float = 0.0
+
+    @property
+    def speedup(self) -> Optional[float]:
+        """UNet time the call would have taken without caching, over the time it took."""
+        if not self.full_calls:
+            return None
+        calls = self.full_calls + self.cached_calls
+        baseline = calls * self.full_time_s / self.full_calls
+        return baseline / (self.full_time_s + self.cached_time_s)
+
+
+def cache_interval(payload: dict) -> int:
+    """Requested feature-caching interval, clamped to [0, MAX_INTERVAL]. Raises ValueError for a non-integer."""
+    interval = _number(payload, "cache_interval", config.DEEPCACHE_INTERVAL)
+    if not interval.is_integer():
+        raise ValueError("cache_interval must be an integer")
+    return min(max(int(interval), 0), MAX_INTERVAL)
+
+
+def cache_key_suffix(interval: int) -> str:
+    """Cache-key suffix for renders with feature caching (empty without)."""
+    return f"::deepcache::{interval}" if interval > 1 else ""
+
+
+def add_deepcache_headers(response, run: Optional[DeepCacheRun]):
+    if run is not None:
+        response.headers["X-DeepCache-Interval"] = str(run.interval)
+        if run.speedup is not None:
+            response.headers["X-DeepCache-Speedup"] = f"{run.speedup:.2f}"
+    return response
@@ -0,0 +1,156 @@
+"""Cheap variations and hi-res refinement of earlier generations.
+
+Both endpoints take the digest of an image generated by this node (`"image"`) and denoise it again as img2img,
+running only the last `strength` fraction of the `num_inference_steps` schedule:
+
+- `POST /api/ai/variation` restarts from the image's cached final latents (`latent_cache.py`) with a new seed
+  and, optionally, a tweaked prompt;
+- `POST /api/ai/upscale` upscales the latents by `scale` and runs a short denoise on top of them (hi-res fix).
+
+Prompt, negative prompt, guidance and LoRA scale default to those of the source image. When its latents are
+no longer cached but the image still is, the image itself is the img2img input (one extra VAE encode, and a
+pixel-space upscale); the request must then supply the prompt.
+"""
+
+import io
+import random
+from typing import Optional, Tuple
+
+from flask import jsonify, request
+
+from .. import config
+from .admission import add_queue_headers, lane_for
+from .cancellation import request_token
+from .generation import generate_image, serve_generation
+from .images import image_response
+from .latent_cache import CachedLatents, latent_cache
+from .result_cache import example_cache, refine_cache_key
+
+MIN_STRENGTH = 0.05
+MODELS = {"base", "lora"}
+
+
+def _round_to_8(value: float) -> int:
+    return max(8, int(value) // 8 * 8)
+
+
+def _source(payload: dict, digest: str) -> Tuple[Optional[CachedLatents], object, Optional[str]]:
+    """The source's generation settings and the PIL image to start from when its latents are gone.
+
+    The last element is an error message when the source cannot be used.
+    """
+    cached = latent_cache.get(digest)
+    if cached is not None:
+        return cached, None, None
+    data = example_cache.read(digest)
+    if data is None:
+        return None, None, "unknown image"
+    if not payload.get("prompt"):
+        return None, None, "Prompt required: the latents of this image are no longer cached"
+    model = payload.get("model", "base")
+    if model not in MODELS:
+        return None, None, f"model must be one of {sorted(MODELS)}"
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    return CachedLatents(latents=None, model=model, prompt=payload["prompt"]), image, None
+
+
+def _refine(kind: str, default_strength: float, scale: float):
+    payload = request.get_json(silent=True) or {}
+
+    digest = payload.get("image")
+    if not isinstance(digest, str) or not digest:
+        return jsonify({"error": "image (digest) required"}), 400
+    source, image, error = _source(payload, digest)
+    if error is not None:
+        return jsonify({"error": error}), 404 if error == "unknown image" else 400
+
+    prompt = payload.get("prompt", source.prompt)
+    negative_prompt = payload.get("negative_prompt", source.negative_prompt)
+    steps = payload.get("num_inference_steps", 30)
+    cfg_scale = payload.get("guidance_scale", source.guidance_scale)
+    seed = payload.get("seed", -1)
+    if seed == -1 and kind == "variation":
+        # Drawn here rather than by the pipeline: the seed is part of the cache key, and a repeated request for a
+        # new variation must not be answered with the cached one. Reported in X-Seed so it can be reproduced.
+        seed = random.randrange(2**63)
+    lora_scale = payload.get("lora_scale", source.lora_scale)
+    try:
+        strength = min(max(float(payload.get("strength", default_strength)), MIN_STRENGTH), 1.0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "strength must be a number"}), 400
+
+    if source.latents is not None:
+        width, height = source.latents.shape[-1] * 8, source.latents.shape[-2] * 8
+    else:
+        width, height = image.size
+    width, height = _round_to_8(width * scale), _round_to_8(height * scale)
+
+    cache_key = refine_cache_key(
+        f"{kind}::{source.model}", digest, prompt, negative_prompt, steps, cfg_scale, seed, strength, scale, lora_scale
+    )
+    # img2img skips the first (1 - strength) of the schedule.
+    run_steps = max(1, int(steps * strength))
+    lane = lane_for(payload, run_steps, width, height)
+    token = request_token(run_steps)
+
+    def render(entry, callback):
+        import torch.nn.functional as F
+        from PIL import Image
+
+        from .device import make_generator
+        from .pipelines import LORA_ADAPTER
+
+        if source.latents is not None:
+            init = source.latents.to(entry.pipe.device, entry.pipe.unet.dtype)
+            if scale != 1:
+                init = F.interpolate(init, size=(height // 8, width // 8), mode="bicubic", align_corners=False)
+        else:
+            init = image.resize((width, height), Image.LANCZOS) if image.size != (width, height) else image
+        kwargs = {}
+        if source.model == "lora":
+            kwargs["cross_attention_kwargs"] = entry.lora_kwargs(LORA_ADAPTER, lora_scale)
+        return entry.img2img(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            image=init,
+            strength=strength,
+            num_inference_steps=steps,
+            guidance_scale=cfg_scale,
+            generator=make_generator(seed),
+            callback_on_step_end=callback,
+            **kwargs,
+        ).images[0]
+
+    # Variations of variations start from the new latents.
+    latents = source.derive(
+        prompt=prompt, negative_prompt=negative_prompt, guidance_scale=cfg_scale, lora_scale=lora_scale
+    )
+    label = f"{kind.capitalize()} of {digest[:12]}"
+
+    def generate(flight_token):
+        return generate_image(source.model, cache_key, render, lane, flight_token, label, latents)
+
+    result_digest, response = serve_generation(cache_key, generate, token, label)
+    if response is not None:
+        return response
+
+    response = add_queue_headers(image_response(result_digest))
+    response.headers["X-Source-Image"] = digest
+    if seed != -1:
+        response.headers["X-Seed"] = str(seed)
+    return response
+
+
+def route_variation():
+    return _refine("variation", config.VARIATION_STRENGTH, 1.0)
+
+
+def route_upscale():
+    payload = request.get_json(silent=True) or {}
+    try:
+        scale = float(payload.get("scale", config.HIRES_MAX_SCALE))
+    except (TypeError, ValueError):
+        return jsonify({"error": "scale must be a number"}), 400
+    return _refine("upscale", config.HIRES_STRENGTH, min(max(scale, 1.0), config.HIRES_MAX_SCALE))
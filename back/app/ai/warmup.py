@@ -0,0 +1,69 @@
+"""Background warm-up of the ML stack.
+
+The routes do not import torch, diffusers or PIL, so the app starts and answers health checks and CORS
+preflights in well under a second. The first generation then pays for those imports and for loading its
+pipeline. With `AI_WARMUP_MODELS` set, `warmup.start()` does that work in a daemon thread as soon as the app
+is created instead. Requests arriving meanwhile simply wait on the pipeline registry lock.
+"""
+
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from .. import config
+
+
+class Warmup:
+    def __init__(self):
+        self.state = "idle"  # idle, running, done or failed
+        self.loaded: List[str] = []
+        self.error: Optional[str] = None
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, models: List[str] = config.WARMUP_MODELS):
+        """Load `models` in a background thread (once per process; no-op without models)."""
+        with self._lock:
+            if self._thread is not None or not models:
+                return
+            self.state = "running"
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, args=(list(models),), name="ai-warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self, models: List[str]):
+        try:
+            from .pipelines import get_pipeline
+
+            for name in models:
+                get_pipeline(name)
+                self.loaded.append(name)
+            self.state = "done"
+            print(f"Warm-up done in {time.perf_counter() - self._started_at:.1f}s: {', '.join(models)}")
+        except Exception as e:
+            self.state = "failed"
+            self.error = repr(e)
+            print(f"Warm-up failed: {e!r}")
+        finally:
+            self._finished_at = time.perf_counter()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the configured pipelines are loaded (always true without warm-up)."""
+        return self.state in {"idle", "done"}
+
+    def stats(self) -> dict:
+        end = self._finished_at or time.perf_counter()
+        return {
+            "state": self.state,
+            "loaded": list(self.loaded),
+            "seconds": round(end - self._started_at, 2) if self._started_at is not None else None,
+            "error": self.error,
+            "ml_imported": "torch" in sys.modules,
+        }
+
+
+warmup = Warmup()
@@ -1,9 +1,11 @@
 from flask import Blueprint
 
 from .ai.ai_bp import ai_bp
+from .ai.status import route_health
 
 api_bp = Blueprint("api", __name__)
 
 # Group AI-related endpoints under /api/ai
 api_bp.register_blueprint(ai_bp, url_prefix="/ai")
 
+api_bp.add_url_rule("/health", view_func=route_health, methods=["GET"])
@@ -0,0 +1,180 @@
+"""Runtime configuration read from environment variables."""
+
+import os
+import tempfile
+from typing import List, Tuple
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.environ.get(name, default).lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)))
+
+
+def _env_floats(name: str, default: str) -> List[float]:
+    return [float(part) for part in os.environ.get(name, default).split(",") if part.strip()]
+
+
+def _env_shapes(name: str, default: str) -> List[Tuple[int, int, int]]:
+    """Parse `HxWxB` entries separated by commas, e.g. `512x512x1,768x512x1`."""
+    shapes = []
+    for entry in os.environ.get(name, default).split(","):
+        entry = entry.strip()
+        if entry:
+            height, width, batch = (int(part) for part in entry.lower().split("x"))
+            shapes.append((height, width, batch))
+    return shapes
+
+
+# ---- Models ----
+MODEL_ID = os.environ.get("AI_MODEL_ID", "runwayml/stable-diffusion-v1-5")
+
+# ---- Startup ----
+# Pipelines loaded by a background thread when the app starts, e.g. `base,lora` ("" loads them on first use).
+WARMUP_MODELS = [name.strip() for name in os.environ.get("AI_WARMUP_MODELS", "").split(",") if name.strip()]
+
+# ---- Memory budget ----
+# Device memory (MiB) for resident pipelines; least recently used idle pipelines are offloaded past it (0: no limit).
+MEMORY_BUDGET_MB = _env_int("AI_MEMORY_BUDGET_MB", 0)
+# Host memory (MiB) for offloaded pipelines; past it the least recently used are unloaded and reloaded from disk
+# on next use (0: no limit).
+MEMORY_HOST_BUDGET_MB = _env_int("AI_MEMORY_HOST_BUDGET_MB", 0)
+# Seconds without a request after which a pipeline is offloaded even within the budget (0 disables).
+MEMORY_IDLE_S = _env_float("AI_MEMORY_IDLE_S", 0.0)
+# How a pipeline larger than the whole budget runs: diffusers `model` or `sequential` CPU offload.
+MEMORY_OVERSIZE = os.environ.get("AI_MEMORY_OVERSIZE", "model")
+
+# ---- Shared weights ----
+# Map UNet / VAE / text-encoder / LoRA safetensors from a host-wide directory so workers share one copy.
+SHARED_WEIGHTS = _env_flag("AI_SHARED_WEIGHTS")
+SHARED_WEIGHTS_DIR = os.environ.get(
+    "AI_SHARED_WEIGHTS_DIR",
+    "/dev/shm/ai54-weights" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "ai54-weights"),
+)
+
+# ---- Device ----
+# "auto" picks cuda, then mps, then cpu. Any torch device string is accepted.
+DEVICE = os.environ.get("AI_DEVICE", "auto").lower()
+# "auto" uses float16 on accelerators and float32 on CPU.
+DTYPE = os.environ.get("AI_DTYPE", "auto").lower()
+
+# ---- CPU inference ----
+# Dynamic int8 quantisation of the UNet and text-encoder linear layers (CPU only).
+CPU_QUANTIZE = _env_flag("AI_CPU_QUANTIZE")
+# 0 lets the worker use every core it is pinned to.
+CPU_THREADS = _env_int("AI_CPU_THREADS", 0)
+CPU_INTEROP_THREADS = _env_int("AI_CPU_INTEROP_THREADS", 0)
+# "" leaves affinity alone, "auto" splits the host's NUMA nodes between workers, or an explicit cpulist ("0-7").
+CPU_AFFINITY = os.environ.get("AI_CPU_AFFINITY", "")
+WORKERS = _env_int("AI_WORKERS", 1)
+WORKER_INDEX = _env_int("AI_WORKER_INDEX", 0)
+
+# ---- Inference engine ----
+# "eager" runs the pipelines as loaded; "compiled" enables SDPA attention, channels_last and torch.compile.
+ENGINE_MODE = os.environ.get("AI_ENGINE", "eager").lower()
+ENGINE_COMPILE_MODE = os.environ.get("AI_COMPILE_MODE", "default")
+# Shapes compiled at start-up, as height x width x images per prompt.
+ENGINE_WARM_SHAPES = _env_shapes("AI_ENGINE_WARM_SHAPES", "512x512x1")
+# Upper bound on compiled shape keys; requests for other shapes run eagerly.
+ENGINE_MAX_GRAPHS = _env_int("AI_ENGINE_MAX_GRAPHS", 8)
+# Compile shapes that were not pre-warmed on first use (the first such request pays the compile time).
+ENGINE_COMPILE_ON_DEMAND = _env_flag("AI_ENGINE_COMPILE_ON_DEMAND")
+
+# ---- LoRA ----
+# Fold the requested adapter/scale into the UNet weights instead of applying it on every attention call.
+LORA_FUSE = _env_flag("AI_LORA_FUSE")
+# Number of adapters whose fused weight deltas are kept in memory.
+LORA_FUSED_CACHE_SIZE = _env_int("AI_LORA_FUSED_CACHE_SIZE", 2)
+
+# ---- Admission control ----
+# Generations running at once (they share one device).
+QUEUE_MAX_ACTIVE = _env_int("AI_MAX_ACTIVE", 1)
+# Requests allowed to wait for a slot; further requests get 429.
+QUEUE_DEPTH = _env_int("AI_QUEUE_DEPTH", 16)
+# Queued plus running requests per client (remote address, or X-Client-Id from a trusted proxy).
+QUEUE_CLIENT_CONCURRENCY = _env_int("AI_CLIENT_CONCURRENCY", 4)
+# Addresses of proxies (e.g. the request router) whose X-Client-Id header names the original client. The header of
+# any other peer is ignored, so a client cannot get around its cap by sending a new id with every request.
+TRUSTED_PROXIES = {addr.strip() for addr in os.environ.get("AI_TRUSTED_PROXIES", "").split(",") if addr.strip()}
+QUEUE_TIMEOUT_S = _env_float("AI_QUEUE_TIMEOUT_S", 120.0)
+# A waiting request moves up one lane per this many seconds.
+QUEUE_AGING_S = _env_float("AI_QUEUE_AGING_S", 30.0)
+# Lane thresholds, in steps at 512x512 (cost = steps * width * height / 512^2).
+QUEUE_PREVIEW_MAX_COST = _env_float("AI_PREVIEW_MAX_COST", 15.0)
+QUEUE_BATCH_MIN_COST = _env_float("AI_BATCH_MIN_COST", 60.0)
+
+# ---- Cancellation ----
+# Default time budget for a generation request, in seconds (0 disables the deadline).
+REQUEST_DEADLINE_S = _env_float("AI_REQUEST_DEADLINE_S", 0.0)
+
+# ---- Load-adaptive degradation ----
+# Lower steps / resolution for new requests when the expected queue wait is high (opt-in).
+DEGRADE = _env_flag("AI_DEGRADE")
+# Expected-wait thresholds in seconds; each one crossed is one degradation level.
+DEGRADE_WAIT_S = sorted(_env_floats("AI_DEGRADE_WAIT_S", "10,30"))
+DEGRADE_STEP_FACTOR = _env_float("AI_DEGRADE_STEP_FACTOR", 0.6)
+DEGRADE_MIN_STEPS = _env_int("AI_DEGRADE_MIN_STEPS", 12)
+# Render scale at the last level; the image is upscaled back to the requested size.
+DEGRADE_RENDER_SCALE = _env_float("AI_DEGRADE_RENDER_SCALE", 0.75)
+
+# ---- Result cache ----
+# Directory of generated PNGs shared by every worker and by `prepopulate_cache.py` ("" keeps results in memory).
+RESULT_CACHE_DIR = os.environ.get(
+    "AI_RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "results")
+)
+# Decoded images kept in memory per process, in front of the directory.
+RESULT_CACHE_MEMORY_ITEMS = _env_int("AI_RESULT_CACHE_MEMORY_ITEMS", 256)
+# Rows per batch accepted by `POST /api/ai/admin/prepopulate`.
+PREPOPULATE_MAX_BATCH = _env_int("AI_PREPOPULATE_MAX_BATCH", 16)
+
+# ---- Latent cache (variations and hi-res refinement) ----
+# Final latents of recent generations kept in host memory, keyed by image digest.
+LATENT_CACHE_ITEMS = _env_int("AI_LATENT_CACHE_ITEMS", 256)
+# Default fraction of the denoising schedule re-run by `/variation` (img2img strength).
+VARIATION_STRENGTH = _env_float("AI_VARIATION_STRENGTH", 0.4)
+# Default strength of the short denoise run by `/upscale` on the upscaled latents.
+HIRES_STRENGTH = _env_float("AI_HIRES_STRENGTH", 0.5)
+# Largest (and default) upscaling factor of `/upscale`.
+HIRES_MAX_SCALE = _env_float("AI_HIRES_MAX_SCALE", 2.0)
+
+# ---- Prompt index (preview responses) ----
+# Previously generated prompts indexed for `"preview": true` requests (0 disables the index).
+PROMPT_INDEX_ITEMS = _env_int("AI_PROMPT_INDEX_ITEMS", 5000)
+# Also match near-duplicates by CLIP text-embedding similarity, not only by normalised prompt. Off by default: it
+# loads a separate CPU text encoder per worker and embeds the prompt of every generation, previews or not.
+PROMPT_INDEX_EMBED = _env_flag("AI_PROMPT_INDEX_EMBED")
+# Cosine similarity a nearest neighbour needs to be served as a preview.
+PROMPT_INDEX_THRESHOLD = _env_float("AI_PROMPT_INDEX_THRESHOLD", 0.92)
+# Directory the index is saved to ("" keeps it in memory).
+PROMPT_INDEX_DIR = os.environ.get(
+    "AI_PROMPT_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "prompts")
+)
+# Threads queueing the exact generations of requests answered with a preview.
+PREVIEW_WORKERS = _env_int("AI_PREVIEW_WORKERS", 2)
+
+# ---- Token merging ----
+# Default fraction of self-attention tokens merged per request (0 disables; requests may set `tome_ratio`).
+TOME_RATIO = _env_float("AI_TOME_RATIO", 0.0)
+# Deepest UNet level merged, as a latent downsampling factor (1: only the highest-resolution blocks).
+TOME_MAX_DOWNSAMPLE = _env_int("AI_TOME_MAX_DOWNSAMPLE", 1)
+
+# ---- Feature caching (DeepCache) ----
+# Default number of denoising steps sharing one set of deep UNet features (0 or 1 disables; requests may set
+# `cache_interval`).
+DEEPCACHE_INTERVAL = _env_int("AI_DEEPCACHE_INTERVAL", 0)
+
+# ---- Profiling ----
+# Token for the admin endpoints (`Authorization: Bearer <token>`); empty disables them.
+ADMIN_TOKEN = os.environ.get("AI_ADMIN_TOKEN", "")
+# Directory of the Chrome traces and folded stacks written by the flight recorder.
+PROFILE_DIR = os.environ.get(
+    "AI_PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "profiles")
+)
+# Stack samples per second taken by the sampling profiler on a captured request.
+PROFILE_SAMPLE_HZ = _env_int("AI_PROFILE_SAMPLE_HZ", 200)
@@ -0,0 +1,146 @@
+"""Benchmark token merging against the unmerged baseline.
+
+For every resolution and merge ratio, the same prompts are rendered with the same seeds and compared with the
+ratio-0 render of that resolution:
+
+- latency: median seconds per image over `--repeats` runs, after one warm-up run per resolution;
+- speedup: baseline latency / latency;
+- PSNR (dB) against the baseline image, a measure of how far merging moved the image;
+- CLIP score (cosine similarity x 100 between prompt and image), with `--clip`.
+
+Usage:
+    python benchmark_tome.py --model base --resolutions 512 768 1024 --ratios 0 0.3 0.5 --output tome.json
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from app.ai.device import inference_device, make_generator
+from app.ai.pipelines import LORA_ADAPTER, get_pipeline
+
+DEFAULT_PROMPTS = [
+    "a cozy living room with a fireplace, wooden floor and large windows",
+    "a modern kitchen with white cabinets and a marble island",
+    "a small bedroom with a desk, bookshelves and a window at night",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark token merging speed and quality.")
+    parser.add_argument("--model", choices=["base", "lora"], default="base")
+    parser.add_argument("--prompts", nargs="+", default=DEFAULT_PROMPTS)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 768])
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.0, 0.3, 0.5])
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--guidance_scale", type=float, default=7.5)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per prompt and setting.")
+    parser.add_argument("--clip", action="store_true", help="Also report CLIP scores.")
+    parser.add_argument("--clip_model", default="openai/clip-vit-base-patch32")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    return parser.parse_args()
+
+
+def _synchronize():
+    device = inference_device()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def render(entry, prompt: str, size: int, ratio: float, args):
+    kwargs = dict(
+        prompt=prompt,
+        num_inference_steps=args.steps,
+        guidance_scale=args.guidance_scale,
+        width=size,
+        height=size,
+        generator=make_generator(args.seed),
+    )
+    with entry.in_use(), entry.token_merging(ratio, size, size):
+        if entry.name == "lora":
+            kwargs["cross_attention_kwargs"] = entry.lora_kwargs(LORA_ADAPTER, 1.0)
+        _synchronize()
+        start = time.perf_counter()
+        image = entry(**kwargs).images[0]
+        _synchronize()
+    return image, time.perf_counter() - start
+
+
+def psnr(image, reference) -> float:
+    a = np.asarray(image, dtype=np.float64)
+    b = np.asarray(reference, dtype=np.float64)
+    mse = np.mean((a - b) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0**2 / mse))
+
+
+class ClipScorer:
+    def __init__(self, model_name: str):
+        from transformers import CLIPModel, CLIPProcessor
+
+        self.model = CLIPModel.from_pretrained(model_name).eval()
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+
+    @torch.no_grad()
+    def __call__(self, image, prompt: str) -> float:
+        inputs = self.processor(text=[prompt], images=[image], return_tensors="pt", padding=True, truncation=True)
+        outputs = self.model(**inputs)
+        image_embeds = outputs.image_embeds / outputs.image_embeds.norm(dim=-1, keepdim=True)
+        text_embeds = outputs.text_embeds / outputs.text_embeds.norm(dim=-1, keepdim=True)
+        return float((image_embeds * text_embeds).sum()) * 100
+
+
+def main():
+    args = parse_args()
+    entry = get_pipeline(args.model)
+    scorer = ClipScorer(args.clip_model) if args.clip else None
+    ratios = sorted(set([0.0] + args.ratios))
+
+    results = []
+    for size in args.resolutions:
+        render(entry, args.prompts[0], size, 0.0, args)  # warm-up
+        baseline_images = {}
+        baseline_latency = None
+        for ratio in ratios:
+            latencies, psnrs, clip_scores = [], [], []
+            for prompt in args.prompts:
+                for _ in range(args.repeats):
+                    image, seconds = render(entry, prompt, size, ratio, args)
+                    latencies.append(seconds)
+                if ratio == 0.0:
+                    baseline_images[prompt] = image
+                else:
+                    psnrs.append(psnr(image, baseline_images[prompt]))
+                if scorer is not None:
+                    clip_scores.append(scorer(image, prompt))
+            latency = statistics.median(latencies)
+            if ratio == 0.0:
+                baseline_latency = latency
+            results.append(
+                {
+                    "resolution": size,
+                    "ratio": ratio,
+                    "latency_s": round(latency, 3),
+                    "speedup": round(baseline_latency / latency, 3),
+                    "psnr_db": round(statistics.mean(psnrs), 2) if psnrs else None,
+                    "clip_score": round(statistics.mean(clip_scores), 2) if clip_scores else None,
+                }
+            )
+            print(
+                f"{size}x{size} ratio={ratio:.2f}: {latency:.2f}s/image, "
+                f"x{baseline_latency / latency:.2f}, PSNR {results[-1]['psnr_db']}, CLIP {results[-1]['clip_score']}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "steps": args.steps, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Check that creating the app stays fast and does not import the ML stack.
+
+Runs `import app; app.create_app(warmup=False)` in fresh interpreters and fails (exit status 1) when:
+
+- the fastest of `--repeats` runs takes longer than `--budget-ms`;
+- any heavy module (torch, diffusers, PIL, ...) was imported along the way.
+
+On failure, or with `--verbose`, the slowest imports reported by `python -X importtime` are listed.
+
+Usage:
+    python check_import_time.py --budget-ms 1000
+
+`tests/test_import_time.py` runs the same check under pytest.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+HEAVY_MODULES = [
+    "torch",
+    "diffusers",
+    "transformers",
+    "accelerate",
+    "peft",
+    "safetensors",
+    "huggingface_hub",
+    "PIL",
+    "numpy",
+]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+app.create_app(warmup=False)
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the app import time and the modules it imports.")
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="Maximum time to create the app.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs; the fastest one is compared to the budget.")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports listed.")
+    parser.add_argument("--verbose", action="store_true", help="Always list the slowest imports.")
+    return parser.parse_args()
+
+
+def _run(*python_args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *python_args, "-c", CHILD],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def slowest_imports(top: int) -> List[Tuple[int, str]]:
+    """(cumulative microseconds, module) of the slowest imports, from `-X importtime`."""
+    timings = []
+    for line in _run("-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timings.append((int(cumulative), name.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def measure(repeats: int) -> Tuple[float, List[str]]:
+    """Milliseconds of the fastest of `repeats` app creations, and the heavy modules they imported."""
+    runs = [json.loads(_run().stdout.strip().splitlines()[-1]) for _ in range(repeats)]
+    modules = set(runs[0]["modules"])
+    return min(run["seconds"] for run in runs) * 1000, [name for name in HEAVY_MODULES if name in modules]
+
+
+def main():
+    args = parse_args()
+    elapsed_ms, heavy = measure(args.repeats)
+
+    failed = False
+    print(f"create_app: {elapsed_ms:.0f} ms (budget {args.budget_ms:.0f} ms, best of {args.repeats})")
+    if elapsed_ms > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+
+    if failed or args.verbose:
+        print("Slowest imports (cumulative ms):")
+        for microseconds, name in slowest_imports(args.top):
+            print(f"  {microseconds / 1000:8.1f}  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
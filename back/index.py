@@ -1,11 +1,15 @@
 import os
 
+from werkzeug.serving import is_running_from_reloader
+
 from app import create_app
 
-app = create_app()
+debug_flag = os.environ.get("FLASK_DEBUG", "1").lower() in {"1", "true", "yes", "on"}
+
+# Under the debug reloader the parent process only watches files; the serving child process warms up.
+app = create_app(warmup=not (__name__ == "__main__" and debug_flag and not is_running_from_reloader()))
 
 if __name__ == "__main__":
     host = os.environ.get("BACKEND_HOST", "0.0.0.0")
     port = int(os.environ.get("BACKEND_PORT", "8000"))
-    debug_flag = os.environ.get("FLASK_DEBUG", "1").lower() in {"1", "true", "yes", "on"}
     app.run(host=host, port=port, debug=debug_flag)
@@ -0,0 +1,159 @@
+"""Pre-populate the result cache from a manifest of prompts.
+
+Each manifest row is the JSON payload a client would POST, plus a `model` field (`base` or `lora`, default
+`base`). JSONL manifests hold one payload per line; CSV manifests have one column per payload field, and the
+numeric fields are read as JSON numbers so `30` and `7.5` key the cache exactly like the numbers of a JSON
+request body. Every other cell stays text, so a prompt such as `1984` is still a prompt.
+
+Rows whose image is already cached are skipped, so an interrupted run can simply be started again. Rows with
+the same model and parameters are generated together in batches, keyed, rendered and stored like the routes'
+requests (`app/ai/prepopulate.py`), final latents included.
+
+With `--server`, each batch is sent to the node's `POST /api/ai/admin/prepopulate` (`AI_ADMIN_TOKEN` must match
+the node's). There it waits in the lowest admission lane, behind every live request; a batch rejected because
+live traffic kept the node busy is retried after its `Retry-After`. Without `--server` the batches are rendered
+in this process, on a node that serves no traffic. Either way the job can be capped at N images per minute.
+
+Usage:
+    AI_ADMIN_TOKEN=... python prepopulate_cache.py example_prompts.jsonl --batch-size 8 --server http://localhost:8000
+    AI_RESULT_CACHE_DIR=... python prepopulate_cache.py example_prompts.jsonl --batch-size 8
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from app import config
+from app.ai.cancellation import CancellationToken
+from app.ai.prepopulate import NUMERIC_FIELDS, batch_group, cache_key, complete_row, generate_batch
+from app.ai.result_cache import example_cache
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate manifest prompts into the result cache.")
+    parser.add_argument("manifest", help="CSV or JSONL file of request payloads.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images generated per pipeline call.")
+    parser.add_argument(
+        "--max-per-minute", type=float, default=0, help="Upper bound on images generated per minute (0: unbounded)."
+    )
+    parser.add_argument(
+        "--server",
+        default=None,
+        help="Base URL of a running backend; batches are rendered there, behind its live requests.",
+    )
+    parser.add_argument("--timeout", type=float, default=3600.0, help="Seconds to wait for one batch on the server.")
+    parser.add_argument("--nice", type=int, default=10, help="CPU niceness increment when rendering in-process.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many rows are missing.")
+    return parser.parse_args()
+
+
+# ---- Manifest ----
+def _cell(field: str, value: str):
+    if field not in NUMERIC_FIELDS:
+        return value
+    try:
+        number = json.loads(value)
+    except ValueError:
+        return value
+    return number if isinstance(number, (int, float)) and not isinstance(number, bool) else value
+
+
+def read_manifest(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield {key: _cell(key, value) for key, value in row.items() if value not in (None, "")}
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def pending_batches(rows: List[dict], batch_size: int) -> List[Tuple[tuple, List[dict]]]:
+    """Group uncached rows by everything a batched pipeline call must share, then chunk the groups."""
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    seen = set()
+    for row in rows:
+        key = cache_key(row)
+        if key in seen or key in example_cache:
+            continue
+        seen.add(key)
+        groups[batch_group(row)].append(row)
+    return [
+        (group, items[start : start + batch_size])
+        for group, items in groups.items()
+        for start in range(0, len(items), batch_size)
+    ]
+
+
+# ---- Rendering ----
+def send_batch(server: str, rows: List[dict], timeout: float) -> int:
+    """Render `rows` on the server, retrying while live traffic keeps it busy; returns the images generated."""
+    request = urllib.request.Request(
+        server.rstrip("/") + "/api/ai/admin/prepopulate",
+        data=json.dumps({"rows": rows}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {config.ADMIN_TOKEN}"},
+        method="POST",
+    )
+    while True:
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)["generated"]
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                raise SystemExit(f"Server refused the batch: {e.code} {e.read().decode('utf-8', 'replace')}")
+            retry_after = int(e.headers.get("Retry-After", "5"))
+            print(f"Server busy with live requests, retrying in {retry_after}s")
+            time.sleep(retry_after)
+
+
+def main():
+    args = parse_args()
+    if not args.server and not example_cache.directory:
+        raise SystemExit("AI_RESULT_CACHE_DIR is empty: results would only live in this process.")
+    if args.server and not config.ADMIN_TOKEN:
+        raise SystemExit("AI_ADMIN_TOKEN is empty: the server only accepts batches with its admin token.")
+
+    rows = []
+    for row in read_manifest(args.manifest):
+        if not row.get("prompt"):
+            continue
+        try:
+            rows.append(complete_row(row))
+        except ValueError as e:
+            raise SystemExit(str(e))
+
+    batches = pending_batches(rows, args.batch_size)
+    missing = sum(len(items) for _, items in batches)
+    # With --server, the node skips what its own cache already holds.
+    print(f"{len(rows)} manifest rows, {missing} not cached yet, {len(batches)} batches")
+    if args.dry_run or not batches:
+        return
+
+    if args.nice and not args.server:
+        os.nice(args.nice)
+
+    done = 0
+    started = time.monotonic()
+    for group, items in batches:
+        if args.max_per_minute > 0:
+            # Start a batch only once the images generated so far fit within the rate.
+            earliest = started + done * 60.0 / args.max_per_minute
+            time.sleep(max(0.0, earliest - time.monotonic()))
+        if args.server:
+            generated = send_batch(args.server, items, args.timeout)
+        else:
+            generated = len(generate_batch(items, CancellationToken(steps=group[1])))
+        done += generated
+        print(f"[{done}/{missing}] {group[0]} batch of {len(items)} cached ({generated} generated)")
+
+
+if __name__ == "__main__":
+    main()
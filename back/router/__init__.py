@@ -0,0 +1,16 @@
+"""Adapter-affinity request router in front of several backend nodes (see `nodes.py`)."""
+
+from flask import Flask
+from flask_cors import CORS
+
+from .nodes import pool
+from .router_bp import router_bp
+
+
+def create_router() -> Flask:
+    """Router application factory; starts the node health checks."""
+    app = Flask(__name__)
+    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    app.register_blueprint(router_bp)
+    pool.start()
+    return app
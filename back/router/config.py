@@ -0,0 +1,39 @@
+"""Router configuration read from environment variables."""
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)))
+
+
+# ---- Nodes ----
+# Backend base URLs, comma-separated, e.g. `http://10.0.0.1:8000,http://10.0.0.2:8000`.
+NODES = [
+    url.strip().rstrip("/") for url in os.environ.get("ROUTER_NODES", "http://127.0.0.1:8000").split(",") if url.strip()
+]
+# Points per node on the hash ring; more points spread keys more evenly.
+VIRTUAL_NODES = _env_int("ROUTER_VIRTUAL_NODES", 64)
+
+# ---- Health checks ----
+HEALTH_INTERVAL_S = _env_float("ROUTER_HEALTH_INTERVAL_S", 5.0)
+HEALTH_TIMEOUT_S = _env_float("ROUTER_HEALTH_TIMEOUT_S", 2.0)
+# Consecutive failed checks or refused connections before a node is taken out of rotation.
+HEALTH_FAILURES = _env_int("ROUTER_HEALTH_FAILURES", 2)
+
+# ---- Routing ----
+# Generations running or queued on a node above which new requests spill over to the next node on the ring.
+MAX_LOAD = _env_int("ROUTER_MAX_LOAD", 4)
+# Request fingerprints and image digests remembered with the node that served them.
+HOT_ENTRIES = _env_int("ROUTER_HOT_ENTRIES", 10000)
+# Seconds to wait for a backend response; generations can take minutes under load.
+PROXY_TIMEOUT_S = _env_float("ROUTER_PROXY_TIMEOUT_S", 600.0)
+
+# ---- Admin ----
+# Token for `POST /router/drain` (`Authorization: Bearer <token>`), defaulting to the nodes' `AI_ADMIN_TOKEN`;
+# empty disables the endpoint.
+ADMIN_TOKEN = os.environ.get("ROUTER_ADMIN_TOKEN", os.environ.get("AI_ADMIN_TOKEN", ""))
@@ -0,0 +1,170 @@
+"""Backend nodes: health, load, and what each of them holds.
+
+A background thread polls `GET /api/ai/node` on every node for its readiness, its loaded pipelines and its
+queue. Nodes failing `HEALTH_FAILURES` checks in a row (or refusing proxied connections) leave the rotation
+until a check succeeds again. Drained nodes keep serving the requests they already have but get no new ones.
+
+Generations are placed by consistent hashing on the pipeline and resolution, so each node keeps serving the
+adapters and compiled shapes it already holds. A node whose load reaches `MAX_LOAD` spills new requests over
+to the next node on the ring, preferring nodes that already hold the pipeline. Identical requests and image
+downloads go back to the node that served them, whose result cache holds the image.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import requests
+
+from . import config
+from .ring import HashRing
+
+
+@dataclass
+class Node:
+    url: str
+    healthy: bool = True  # until the first check says otherwise
+    ready: bool = True
+    draining: bool = False
+    failures: int = 0
+    in_flight: int = 0  # requests proxied by this router and not finished yet
+    reported_load: int = 0  # generations running or queued, as reported by the node
+    pipelines: Set[str] = field(default_factory=set)
+    checked_at: Optional[float] = None
+
+    @property
+    def load(self) -> int:
+        return max(self.in_flight, self.reported_load)
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.ready and not self.draining
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ready": self.ready,
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            "load": self.load,
+            "pipelines": sorted(self.pipelines),
+            "checked_s_ago": round(time.monotonic() - self.checked_at, 1) if self.checked_at is not None else None,
+        }
+
+
+class NodePool:
+    def __init__(self, urls: List[str] = config.NODES, max_load: int = config.MAX_LOAD):
+        self.ring = HashRing(urls)
+        self.nodes = {url: Node(url) for url in self.ring.nodes}
+        self.max_load = max_load
+        self._lock = threading.Lock()
+        # Request fingerprint or image digest -> URL of the node that served it.
+        self._hot: "OrderedDict[str, str]" = OrderedDict()
+        self._checker: Optional[threading.Thread] = None
+
+    # ---- Health ----
+    def start(self):
+        """Start the background health checks (once)."""
+        with self._lock:
+            if self._checker is not None:
+                return
+            self._checker = threading.Thread(target=self._check_loop, name="router-health", daemon=True)
+            self._checker.start()
+
+    def _check_loop(self):
+        while True:
+            for node in list(self.nodes.values()):
+                self.check(node)
+            time.sleep(config.HEALTH_INTERVAL_S)
+
+    def check(self, node: Node):
+        try:
+            response = requests.get(f"{node.url}/api/ai/node", timeout=config.HEALTH_TIMEOUT_S)
+            response.raise_for_status()
+            status = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.mark_failed(node, e)
+            return
+        with self._lock:
+            if not node.healthy:
+                print(f"Node {node.url} is back in rotation")
+            node.healthy = True
+            node.failures = 0
+            node.ready = bool(status.get("ready", True))
+            node.reported_load = int(status.get("active", 0)) + int(status.get("queued", 0))
+            node.pipelines = set(status.get("pipelines", []))
+            node.checked_at = time.monotonic()
+
+    def mark_failed(self, node: Node, error: Exception):
+        with self._lock:
+            node.failures += 1
+            node.checked_at = time.monotonic()
+            if node.healthy and node.failures >= config.HEALTH_FAILURES:
+                node.healthy = False
+                print(f"Node {node.url} taken out of rotation: {error}")
+
+    def drain(self, url: str, draining: bool = True) -> Optional[Node]:
+        with self._lock:
+            node = self.nodes.get(url.rstrip("/"))
+            if node is not None:
+                node.draining = draining
+                print(f"Node {node.url} {'draining' if draining else 'back in rotation'}")
+            return node
+
+    # ---- Hot entries ----
+    def remember(self, key: str, node: Node):
+        with self._lock:
+            self._hot[key] = node.url
+            self._hot.move_to_end(key)
+            while len(self._hot) > config.HOT_ENTRIES:
+                self._hot.popitem(last=False)
+
+    def holder(self, key: str) -> Optional[Node]:
+        with self._lock:
+            url = self._hot.get(key)
+            return self.nodes.get(url) if url is not None else None
+
+    # ---- Selection ----
+    def _usable(self, key: str, exclude: Set[str]) -> List[Node]:
+        ordered = [self.nodes[url] for url in self.ring.candidates(key) if url not in exclude]
+        # With no ready node (all warming up), reachable ones still load pipelines on demand.
+        return [n for n in ordered if n.available] or [n for n in ordered if n.healthy and not n.draining]
+
+    def acquire(
+        self, key: str, pipeline: Optional[str] = None, hot_key: Optional[str] = None, exclude: Set[str] = frozenset()
+    ) -> Optional[Node]:
+        """Pick the node for a request and count it as in flight there; None when no node can take it."""
+        with self._lock:
+            usable = self._usable(key, exclude)
+            if not usable:
+                return None
+            node = None
+            holder = self.nodes.get(self._hot.get(hot_key)) if hot_key is not None else None
+            if holder in usable and holder.load < self.max_load:
+                node = holder
+            elif usable[0].load < self.max_load:
+                node = usable[0]
+            else:
+                spill = [n for n in usable[1:] if n.load < self.max_load]
+                warm = [n for n in spill if pipeline in n.pipelines]
+                node = (warm or spill or [min(usable, key=lambda n: n.load)])[0]
+            node.in_flight += 1
+            return node
+
+    def release(self, node: Node):
+        with self._lock:
+            node.in_flight -= 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "nodes": [node.as_dict() for node in self.nodes.values()],
+                "max_load": self.max_load,
+                "hot_entries": len(self._hot),
+            }
+
+
+pool = NodePool()
@@ -0,0 +1,69 @@
+"""Forwarding of the current request to a backend node."""
+
+from typing import Callable, Optional
+
+import requests
+from flask import Response, request
+
+from . import config
+from .nodes import Node, pool
+
+# Headers that only concern one connection.
+_SKIPPED_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+_CHUNK_SIZE = 64 * 1024
+
+
+def _forwarded_headers():
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _SKIPPED_HEADERS | {"x-client-id"}}
+    # Backends attribute admission-control quotas to the original client; a client's own id is never passed on.
+    headers["X-Client-Id"] = request.remote_addr or "anonymous"
+    return headers
+
+
+def forward(node: Node, on_response: Optional[Callable[[Node, requests.Response], None]] = None) -> Response:
+    """Proxy the current request to `node`, streaming the response back; releases the node once closed.
+
+    Raises `requests.ConnectionError` (with the node already released) when the node cannot be reached.
+    """
+    url = node.url + request.path
+    if request.query_string:
+        url += "?" + request.query_string.decode("latin-1")
+    try:
+        upstream = requests.request(
+            request.method,
+            url,
+            headers=_forwarded_headers(),
+            data=request.get_data(),
+            stream=True,
+            allow_redirects=False,
+            timeout=(config.HEALTH_TIMEOUT_S, config.PROXY_TIMEOUT_S),
+        )
+    except BaseException:
+        pool.release(node)
+        raise
+    if on_response is not None:
+        on_response(node, upstream)
+
+    # The router answers CORS itself.
+    headers = [
+        (k, v)
+        for k, v in upstream.headers.items()
+        if k.lower() not in _SKIPPED_HEADERS and not k.lower().startswith("access-control-")
+    ]
+    headers.append(("X-Routed-Node", node.url))
+    body = upstream.raw.stream(_CHUNK_SIZE, decode_content=False)
+    response = Response(body, status=upstream.status_code, headers=headers)
+    # Run once the body has been sent, or when the response is discarded.
+    response.call_on_close(upstream.close)
+    response.call_on_close(lambda: pool.release(node))
+    return response
@@ -0,0 +1,33 @@
+"""Consistent hash ring over the backend nodes."""
+
+import bisect
+import hashlib
+from typing import Iterable, List
+
+from . import config
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], virtual_nodes: int = config.VIRTUAL_NODES):
+        self.nodes = list(dict.fromkeys(nodes))
+        self._points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in self._points]
+
+    def candidates(self, key: str) -> List[str]:
+        """Every node in ring order from `key`: its home node first, then the nodes it spills over to.
+
+        Taking a node out of rotation only moves the keys it was home to, onto their next candidate.
+        """
+        order: List[str] = []
+        start = bisect.bisect(self._hashes, _hash(key))
+        for i in range(len(self._points)):
+            node = self._points[(start + i) % len(self._points)][1]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
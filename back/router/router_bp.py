@@ -0,0 +1,125 @@
+"""Routes of the request router: the proxied `/api` endpoints and the router's own status and drain endpoints."""
+
+import hashlib
+import hmac
+import json
+
+import requests
+from flask import Blueprint, jsonify, request
+
+from . import config
+from .nodes import Node, pool
+from .proxy import forward
+
+router_bp = Blueprint("router", __name__)
+
+# Generation route -> pipeline it runs on the backend.
+PIPELINES = {"baseModel": "base", "trainedModel": "lora"}
+
+
+def _unavailable():
+    response = jsonify({"error": "no backend node available"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+def _remember_image(node: Node, upstream: requests.Response):
+    etag = upstream.headers.get("ETag", "").strip('"')
+    if upstream.status_code == 200 and etag:
+        pool.remember(f"image::{etag}", node)
+
+
+def _proxy(key: str, pipeline=None, hot_key=None, on_response=None, retry_statuses=()):
+    """Forward to the node picked for `key`, moving on to the next node when one cannot be reached.
+
+    Responses with a status in `retry_statuses` are also retried on the next node, while there is one.
+    """
+    tried = set()
+    retried_status = None
+    while True:
+        node = pool.acquire(key, pipeline, hot_key, exclude=tried)
+        if node is None:
+            if retried_status is not None:
+                return jsonify({"error": "not found on any node"}), retried_status
+            return _unavailable()
+        tried.add(node.url)
+        try:
+            response = forward(node, on_response)
+        except requests.ConnectionError as e:
+            pool.mark_failed(node, e)
+            continue
+        if response.status_code in retry_statuses and len(tried) < len(pool.nodes):
+            retried_status = response.status_code
+            response.close()
+            continue
+        return response
+
+
+def route_generate(model: str):
+    payload = request.get_json(silent=True) or {}
+    pipeline = PIPELINES[model]
+    # Nodes hold compiled graphs per resolution, so the resolution is part of the placement.
+    key = f"{pipeline}::{payload.get('width', 512)}x{payload.get('height', 512)}"
+    fingerprint = f"{model}::" + hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def remember(node: Node, upstream: requests.Response):
+        if upstream.status_code == 200:
+            pool.remember(fingerprint, node)
+        _remember_image(node, upstream)
+
+    return _proxy(key, pipeline, hot_key=fingerprint, on_response=remember)
+
+
+def route_image(digest: str):
+    # Result caches are per host: ask the node that produced the image first, then the others.
+    return _proxy(digest, hot_key=f"image::{digest}", on_response=_remember_image, retry_statuses=(404,))
+
+
+def route_refine(kind: str):
+    # Latents of recent generations are cached on the node that produced the image.
+    digest = str((request.get_json(silent=True) or {}).get("image", ""))
+    return _proxy(digest, hot_key=f"image::{digest}", on_response=_remember_image, retry_statuses=(404,))
+
+
+def route_passthrough(path: str):
+    return _proxy(request.path)
+
+
+def route_status():
+    return jsonify(pool.stats())
+
+
+def _admin_error():
+    """Error response when the caller may not change the rotation, else None."""
+    if not config.ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoints are disabled"}), 404
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {config.ADMIN_TOKEN}".encode("utf-8")):
+        return jsonify({"error": "unauthorized"}), 401
+    return None
+
+
+def route_drain():
+    """`{"node": url, "drain": true}` stops routing new requests to the node; `"drain": false` resumes it.
+
+    Requires the admin token.
+    """
+    error = _admin_error()
+    if error is not None:
+        return error
+    payload = request.get_json(silent=True) or {}
+    node = pool.drain(str(payload.get("node", "")), bool(payload.get("drain", True)))
+    if node is None:
+        return jsonify({"error": "unknown node"}), 404
+    return jsonify(node.as_dict())
+
+
+router_bp.add_url_rule("/api/ai/<any(baseModel, trainedModel):model>", view_func=route_generate, methods=["POST"])
+router_bp.add_url_rule("/api/ai/<any(variation, upscale):kind>", view_func=route_refine, methods=["POST"])
+router_bp.add_url_rule("/api/ai/images/<digest>.png", view_func=route_image, methods=["GET"])
+router_bp.add_url_rule(
+    "/api/<path:path>", view_func=route_passthrough, methods=["GET", "POST", "PUT", "PATCH", "DELETE"]
+)
+router_bp.add_url_rule("/router/status", view_func=route_status, methods=["GET"])
+router_bp.add_url_rule("/router/drain", view_func=route_drain, methods=["POST"])
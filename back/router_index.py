@@ -0,0 +1,11 @@
+import os
+
+from router import create_router
+
+app = create_router()
+
+if __name__ == "__main__":
+    host = os.environ.get("ROUTER_HOST", "0.0.0.0")
+    port = int(os.environ.get("ROUTER_PORT", "8080"))
+    # Generations are long-lived requests: keep one thread per proxied request.
+    app.run(host=host, port=port, threaded=True)
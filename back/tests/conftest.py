@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import `app`, `router` and the scripts from `back/`, like the servers do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
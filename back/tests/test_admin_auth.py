@@ -0,0 +1,41 @@
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from app import config as app_config  # noqa: E402
+from app.ai.admin import admin_error  # noqa: E402
+from router import config as router_config  # noqa: E402
+from router.router_bp import router_bp  # noqa: E402
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(router_config, "ADMIN_TOKEN", TOKEN)
+    app = flask.Flask(__name__)
+    app.register_blueprint(router_bp)
+    return app.test_client()
+
+
+def drain(client, authorization=None):
+    headers = {"Authorization": authorization} if authorization else {}
+    return client.post("/router/drain", json={"node": "http://unknown:8000"}, headers=headers)
+
+
+def test_drain_requires_the_admin_token(router):
+    assert drain(router).status_code == 401
+    assert drain(router, "Bearer wrong").status_code == 401
+    assert drain(router, f"Bearer {TOKEN}").status_code == 404  # authorized; the node is unknown
+
+
+def test_drain_is_disabled_without_a_token(router, monkeypatch):
+    monkeypatch.setattr(router_config, "ADMIN_TOKEN", "")
+    assert drain(router, "Bearer ").status_code == 404
+
+
+def test_nodes_and_router_answer_bad_tokens_alike(router, monkeypatch):
+    monkeypatch.setattr(app_config, "ADMIN_TOKEN", TOKEN)
+    with flask.Flask(__name__).test_request_context(headers={"Authorization": "Bearer wrong"}):
+        _, status = admin_error()
+    assert status == drain(router, "Bearer wrong").status_code
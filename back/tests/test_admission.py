@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from app import config  # noqa: E402
+from app.ai.admission import AdmissionController, AdmissionRejected, client_id  # noqa: E402
+from app.ai.cancellation import CancellationToken, GenerationCancelled  # noqa: E402
+
+
+def controller(**kwargs):
+    settings = dict(max_active=1, max_queued=8, per_client=4, timeout_s=5.0, aging_s=0.0)
+    settings.update(kwargs)
+    return AdmissionController(**settings)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def queue_in_background(admission, client, lane, order):
+    def run():
+        with admission.admit(client, lane):
+            order.append(lane)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_per_client_cap_rejects_extra_requests():
+    admission = controller(per_client=1)
+    with admission.admit("alice", "standard"):
+        with pytest.raises(AdmissionRejected) as error:
+            with admission.admit("alice", "standard"):
+                pass
+        assert "client" in error.value.reason
+        assert error.value.retry_after >= 1
+        assert admission.stats()["rejected"]["standard"] == 1
+    # The slot and the client's count are released on exit.
+    with admission.admit("alice", "standard"):
+        pass
+
+
+def test_full_queue_rejects():
+    admission = controller(max_queued=1)
+    order = []
+    with admission.admit("alice", "standard"):
+        thread = queue_in_background(admission, "bob", "standard", order)
+        wait_for(lambda: admission.stats()["queued"] == 1)
+        with pytest.raises(AdmissionRejected, match="queue is full"):
+            with admission.admit("carol", "standard"):
+                pass
+    thread.join()
+    assert order == ["standard"]
+
+
+def test_lanes_are_served_in_priority_order():
+    admission = controller()
+    order = []
+    threads = []
+    with admission.admit("holder", "standard"):
+        for lane in ("batch", "standard", "preview"):
+            threads.append(queue_in_background(admission, lane, lane, order))
+            wait_for(lambda: admission.stats()["queued"] == len(threads))
+    for thread in threads:
+        thread.join()
+    assert order == ["preview", "standard", "batch"]
+
+
+def test_aging_promotes_waiting_requests():
+    admission = controller(aging_s=10.0)
+    batch = admission._enqueue("alice", "batch")
+    preview = admission._enqueue("bob", "preview")
+    assert admission._next_ticket() is preview
+    # 25 seconds of waiting is worth more than the two lanes between batch and preview.
+    batch.enqueued_at -= 25.0
+    assert admission._next_ticket() is batch
+
+
+def test_background_lane_never_ages_past_live_requests():
+    admission = controller(aging_s=1.0)
+    background = admission._enqueue("job", "background")
+    background.enqueued_at -= 3600.0
+    batch = admission._enqueue("alice", "batch")
+    assert admission._next_ticket() is batch
+
+
+def test_background_requests_do_not_count_in_live_wait_estimate():
+    admission = controller()
+    admission._enqueue("job", "background")
+    assert admission.estimated_wait() == 0.0
+    admission._enqueue("alice", "standard")
+    assert admission.estimated_wait() > 0.0
+
+
+def test_queue_timeout_rejects():
+    admission = controller(timeout_s=0.05)
+    with admission.admit("alice", "standard"):
+        with pytest.raises(AdmissionRejected, match="timed out"):
+            with admission.admit("bob", "standard"):
+                pass
+    assert admission.stats()["queued"] == 0
+
+
+def test_cancelled_token_leaves_the_queue():
+    admission = controller()
+    token = CancellationToken()
+    token.cancel("client disconnected")
+    with admission.admit("alice", "standard"):
+        with pytest.raises(GenerationCancelled):
+            with admission.admit("bob", "standard", token):
+                pass
+    stats = admission.stats()
+    assert stats["queued"] == 0 and stats["active"] == 0
+
+
+def test_client_id_header_is_only_trusted_from_a_configured_proxy(monkeypatch):
+    app = flask.Flask(__name__)
+    headers = {"X-Client-Id": "someone-else"}
+    monkeypatch.setattr(config, "TRUSTED_PROXIES", {"10.0.0.2"})
+    with app.test_request_context(headers=headers, environ_base={"REMOTE_ADDR": "203.0.113.7"}):
+        assert client_id() == "203.0.113.7"
+    with app.test_request_context(headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.2"}):
+        assert client_id() == "someone-else"
+    with app.test_request_context(environ_base={"REMOTE_ADDR": "10.0.0.2"}):
+        assert client_id() == "10.0.0.2"
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("flask")
+
+from app.ai.prompt_index import normalize_prompt, prompt_scope  # noqa: E402
+from app.ai.result_cache import KEY_VERSION, base_cache_key, lora_cache_key, refine_cache_key  # noqa: E402
+
+
+def test_keys_are_versioned():
+    keys = [
+        base_cache_key("a cozy loft", 30, 7.5, 1, 512, 512),
+        lora_cache_key("a cozy loft", "", 30, 7.5, 1, 512, 512, 1.0),
+        refine_cache_key("variation", "abc", "a cozy loft", "", 30, 7.5, 1, 0.6, 1, 1.0),
+    ]
+    assert all(key.startswith(f"{KEY_VERSION}::") for key in keys)
+
+
+def test_prompt_case_and_whitespace_share_a_key():
+    assert base_cache_key("A  Cozy\tLoft ", 30, 7.5, 1, 512, 512) == base_cache_key("a cozy loft", 30, 7.5, 1, 512, 512)
+    assert lora_cache_key(" A cozy LOFT", "", 30, 7.5, 1, 512, 512, 1.0) == lora_cache_key(
+        "a cozy loft", "", 30, 7.5, 1, 512, 512, 1.0
+    )
+
+
+def test_render_parameters_and_suffixes_distinguish_keys():
+    keys = {
+        base_cache_key("a cozy loft", 30, 7.5, 1, 512, 512),
+        base_cache_key("a cozy loft", 20, 7.5, 1, 512, 512),
+        base_cache_key("a cozy loft", 30, 7.5, 2, 512, 512),
+        base_cache_key("a cozy loft", 30, 7.5, 1, 512, 768),
+        base_cache_key("a cozy loft", 30, 7.5, 1, 512, 512, "::tome::0.5"),
+        lora_cache_key("a cozy loft", "", 30, 7.5, 1, 512, 512, 1.0),
+        lora_cache_key("a cozy loft", "", 30, 7.5, 1, 512, 512, 0.5),
+        lora_cache_key("a cozy loft", "blurry", 30, 7.5, 1, 512, 512, 1.0),
+    }
+    assert len(keys) == 8
+
+
+def test_normalize_prompt_folds_case_forms_punctuation_and_whitespace():
+    assert normalize_prompt("A Cozy, Sunlit  LOFT!") == "a cozy sunlit loft"
+    assert normalize_prompt("ｃｏｚｙ loft") == "cozy loft"
+    assert normalize_prompt("Straße") == normalize_prompt("STRASSE")
+    assert normalize_prompt("   ") == ""
+
+
+def test_prompt_scope_separates_models_and_sizes():
+    assert prompt_scope("base", 512, 768) == "base::512x768"
+    assert prompt_scope("base", 512, 512) != prompt_scope("lora", 512, 512)
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from werkzeug.exceptions import HTTPException  # noqa: E402
+
+from app import config  # noqa: E402
+from app.ai.cancellation import CancellationToken, GenerationCancelled, TokenGroup, request_token  # noqa: E402
+
+
+def test_token_cancels_at_its_deadline():
+    token = CancellationToken(deadline=time.monotonic() - 1, steps=30)
+    assert token.cancelled == "deadline exceeded"
+    with pytest.raises(GenerationCancelled) as error:
+        token.raise_if_cancelled()
+    assert error.value.steps_saved == 30
+    assert CancellationToken(deadline=time.monotonic() + 60).cancelled is None
+
+
+def test_first_cancellation_reason_sticks():
+    token = CancellationToken()
+    token.cancel("client disconnected")
+    token.cancel("deadline exceeded")
+    assert token.cancelled == "client disconnected"
+
+
+def test_step_callback_reports_the_remaining_steps():
+    token = CancellationToken(steps=30)
+    callback = token.step_callback()
+    assert callback(None, 4, None, {"latents": 1}) == {"latents": 1}
+    token.cancel()
+    with pytest.raises(GenerationCancelled) as error:
+        callback(None, 9, None, {})
+    assert error.value.steps_saved == 20
+
+
+def test_token_group_cancels_once_every_member_has():
+    first, second = CancellationToken(steps=30), CancellationToken(steps=30)
+    group = TokenGroup([first])
+    group.add(second)
+    first.cancel("client disconnected")
+    assert group.cancelled is None
+    second.cancel("client disconnected")
+    assert group.cancelled == "client disconnected"
+
+
+def test_token_group_ignores_discarded_members():
+    live, gone = CancellationToken(), CancellationToken()
+    group = TokenGroup([live, gone])
+    group.discard(live)
+    gone.cancel()
+    assert group.cancelled == "cancelled"
+
+
+@pytest.fixture
+def app():
+    return flask.Flask(__name__)
+
+
+def test_request_deadline_from_payload_or_header(app):
+    with app.test_request_context(json={"deadline_ms": 2000}):
+        token = request_token(30)
+    assert 1.0 < token.deadline - time.monotonic() <= 2.0
+    assert token.steps == 30
+    with app.test_request_context(headers={"X-Request-Deadline-Ms": "500"}):
+        token = request_token(30)
+    assert 0.0 < token.deadline - time.monotonic() <= 0.5
+
+
+def test_missing_deadline_uses_the_configured_default(app, monkeypatch):
+    monkeypatch.setattr(config, "REQUEST_DEADLINE_S", 0)
+    with app.test_request_context(headers={"X-Request-Deadline-Ms": ""}):
+        assert request_token(30).deadline is None
+    monkeypatch.setattr(config, "REQUEST_DEADLINE_S", 60)
+    with app.test_request_context(json={}):
+        assert 59.0 < request_token(30).deadline - time.monotonic() <= 60.0
+
+
+@pytest.mark.parametrize("header", ["abc", "-5", "0", "nan", "inf"])
+def test_malformed_deadline_header_is_a_bad_request(app, header):
+    with app.test_request_context(headers={"X-Request-Deadline-Ms": header}):
+        with pytest.raises(HTTPException) as error:
+            request_token(30)
+    assert error.value.response.status_code == 400
+
+
+@pytest.mark.parametrize("value", [True, "soon", [1000], -1])
+def test_malformed_deadline_field_is_a_bad_request(app, value):
+    with app.test_request_context(json={"deadline_ms": value}):
+        with pytest.raises(HTTPException) as error:
+            request_token(30)
+    assert error.value.response.status_code == 400
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("flask")
+
+from app import config  # noqa: E402
+from app.ai.degradation import FAST_SCHEDULER, degrade, exact_params  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "DEGRADE", True)
+    monkeypatch.setattr(config, "DEGRADE_WAIT_S", [10.0, 30.0])
+    monkeypatch.setattr(config, "DEGRADE_STEP_FACTOR", 0.6)
+    monkeypatch.setattr(config, "DEGRADE_MIN_STEPS", 12)
+    monkeypatch.setattr(config, "DEGRADE_RENDER_SCALE", 0.75)
+
+
+def test_short_queue_renders_exactly():
+    params = degrade({}, 30, 512, 512, expected_wait_s=5.0)
+    assert params == exact_params(30, 512, 512)
+    assert params.key_suffix == ""
+
+
+def test_first_threshold_cuts_steps_and_switches_scheduler():
+    params = degrade({}, 30, 512, 512, expected_wait_s=10.0)
+    assert params.level == 1
+    assert params.steps == 18
+    assert params.scheduler == FAST_SCHEDULER
+    assert (params.render_width, params.render_height) == (512, 512)
+
+
+def test_steps_never_drop_below_the_minimum():
+    assert degrade({}, 15, 512, 512, expected_wait_s=10.0).steps == 12
+    # Requests already below the minimum keep their own step count.
+    assert degrade({}, 8, 512, 512, expected_wait_s=10.0).steps == 8
+
+
+def test_last_threshold_renders_smaller_and_upscales():
+    params = degrade({}, 30, 512, 768, expected_wait_s=45.0)
+    assert params.level == 2
+    assert (params.render_width, params.render_height) == (384, 576)
+    assert (params.width, params.height) == (512, 768)
+    assert params.key_suffix == f"::degraded::{FAST_SCHEDULER}::384x576"
+
+
+def test_pinned_requests_and_disabled_degradation_render_exactly(monkeypatch):
+    assert degrade({"pin_params": True}, 30, 512, 512, expected_wait_s=45.0).level == 0
+    monkeypatch.setattr(config, "DEGRADE", False)
+    assert degrade({}, 30, 512, 512, expected_wait_s=45.0).level == 0
+
+
+def test_degraded_levels_have_distinct_cache_keys():
+    suffixes = {degrade({}, 30, 512, 512, expected_wait_s=wait).key_suffix for wait in (0.0, 10.0, 45.0)}
+    assert len(suffixes) == 3
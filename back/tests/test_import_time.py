@@ -0,0 +1,17 @@
+"""Import-time budget of the app: creating it must stay fast and must not load the ML stack."""
+
+import os
+
+import pytest
+
+pytest.importorskip("flask")
+
+from check_import_time import measure  # noqa: E402
+
+BUDGET_MS = float(os.environ.get("APP_IMPORT_BUDGET_MS", "1000"))
+
+
+def test_create_app_does_not_import_ml_stack():
+    elapsed_ms, heavy = measure(repeats=3)
+    assert heavy == [], f"heavy modules imported at startup: {', '.join(heavy)} (see check_import_time.py --verbose)"
+    assert elapsed_ms <= BUDGET_MS, f"create_app took {elapsed_ms:.0f} ms, budget {BUDGET_MS:.0f} ms"
@@ -0,0 +1,56 @@
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("flask")
+
+from router.ring import HashRing  # noqa: E402
+
+NODES = [f"http://node-{i}:8000" for i in range(4)]
+KEYS = [f"v2::base::prompt {i}::30::7.5::{i}::512::512" for i in range(2000)]
+
+
+def homes(ring):
+    return {key: ring.candidates(key)[0] for key in KEYS}
+
+
+def test_candidates_list_every_node_once_in_a_stable_order():
+    ring = HashRing(NODES)
+    for key in KEYS[:100]:
+        order = ring.candidates(key)
+        assert sorted(order) == sorted(NODES)
+        assert order == HashRing(list(reversed(NODES))).candidates(key)
+
+
+def test_duplicate_nodes_are_ignored():
+    assert HashRing(NODES + NODES[:1]).nodes == NODES
+
+
+def test_removing_a_node_only_remaps_its_own_keys():
+    before = homes(HashRing(NODES))
+    removed = NODES[1]
+    after = homes(HashRing([node for node in NODES if node != removed]))
+    for key, home in before.items():
+        if home == removed:
+            # Moved to the key's next candidate on the full ring.
+            assert after[key] == HashRing(NODES).candidates(key)[1]
+        else:
+            assert after[key] == home
+
+
+def test_adding_a_node_only_moves_keys_onto_it():
+    before = homes(HashRing(NODES))
+    added = "http://node-new:8000"
+    after = homes(HashRing(NODES + [added]))
+    moved = [key for key in KEYS if after[key] != before[key]]
+    assert moved
+    assert all(after[key] == added for key in moved)
+    # Roughly its fair share, not a reshuffle of the whole key space.
+    assert len(moved) < len(KEYS) * 0.35
+
+
+def test_keys_spread_across_the_nodes():
+    counts = Counter(homes(HashRing(NODES)).values())
+    fair = len(KEYS) / len(NODES)
+    assert set(counts) == set(NODES)
+    assert all(0.5 * fair < count < 1.5 * fair for count in counts.values())
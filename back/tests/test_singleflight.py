@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+
+from app.ai.admission import AdmissionRejected  # noqa: E402
+from app.ai.cancellation import CancellationToken, GenerationCancelled  # noqa: E402
+from app.ai.singleflight import SingleFlight  # noqa: E402
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+class Leader:
+    """`fn` for the first caller: blocks until released, then returns or raises `outcome`."""
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, token):
+        self.started.set()
+        self.release.wait(5.0)
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return self.outcome
+
+
+def run_leader(flight, key, leader):
+    results = {}
+
+    def run():
+        try:
+            results["value"] = flight.do(key, leader)
+        except BaseException as e:
+            results["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    leader.started.wait(5.0)
+    return thread, results
+
+
+def join_waiter(flight, key, fn, token=None):
+    results = {}
+
+    def run():
+        try:
+            results["value"] = flight.do(key, fn, token)
+        except BaseException as e:
+            results["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_for(lambda: flight.in_flight().get(key) == 1)
+    return thread, results
+
+
+def never_called(token):
+    raise AssertionError("a waiter generated although the leader succeeded")
+
+
+def test_concurrent_callers_share_the_leaders_result():
+    flight = SingleFlight()
+    leader = Leader("digest")
+    leader_thread, leader_results = run_leader(flight, "key", leader)
+    waiter_thread, waiter_results = join_waiter(flight, "key", never_called)
+    leader.release.set()
+    leader_thread.join()
+    waiter_thread.join()
+    assert leader_results["value"] == ("digest", False)
+    assert waiter_results["value"] == ("digest", True)
+    assert flight.in_flight() == {}
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [GenerationCancelled("client disconnected"), AdmissionRejected("too many concurrent requests for this client", 5)],
+)
+def test_waiter_is_promoted_when_the_leader_is_cancelled_or_rejected(failure):
+    flight = SingleFlight()
+    leader = Leader(failure)
+    leader_thread, leader_results = run_leader(flight, "key", leader)
+    waiter_thread, waiter_results = join_waiter(flight, "key", lambda token: "own digest")
+    leader.release.set()
+    leader_thread.join()
+    waiter_thread.join()
+    assert leader_results["error"] is failure
+    # The waiter ran the generation itself, as the new leader.
+    assert waiter_results["value"] == ("own digest", False)
+
+
+def test_ordinary_leader_errors_reach_the_waiters():
+    flight = SingleFlight()
+    failure = RuntimeError("out of memory")
+    leader = Leader(failure)
+    leader_thread, _ = run_leader(flight, "key", leader)
+    waiter_thread, waiter_results = join_waiter(flight, "key", never_called)
+    leader.release.set()
+    leader_thread.join()
+    waiter_thread.join()
+    assert waiter_results["error"] is failure
+
+
+def test_cancelled_waiter_stops_waiting_without_cancelling_the_flight():
+    flight = SingleFlight()
+    leader = Leader("digest")
+    leader_thread, leader_results = run_leader(flight, "key", leader)
+    token = CancellationToken()
+    waiter_thread, waiter_results = join_waiter(flight, "key", never_called, token)
+    token.cancel("client disconnected")
+    waiter_thread.join(5.0)
+    assert isinstance(waiter_results["error"], GenerationCancelled)
+    leader.release.set()
+    leader_thread.join()
+    assert leader_results["value"] == ("digest", False)
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("flask")
+
+from app import config  # noqa: E402
+from app.ai.variants import MAX_INTERVAL, MAX_RATIO, cache_interval, tome_ratio  # noqa: E402
+
+
+def test_variants_default_to_the_configuration(monkeypatch):
+    monkeypatch.setattr(config, "TOME_RATIO", 0.5)
+    monkeypatch.setattr(config, "DEEPCACHE_INTERVAL", 3)
+    assert tome_ratio({}) == 0.5
+    assert cache_interval({}) == 3
+    assert tome_ratio({"tome_ratio": None}) == 0.0
+    assert cache_interval({"cache_interval": ""}) == 0
+
+
+def test_variants_are_clamped():
+    assert tome_ratio({"tome_ratio": "0.3"}) == 0.3
+    assert tome_ratio({"tome_ratio": 2}) == MAX_RATIO
+    assert tome_ratio({"tome_ratio": -1}) == 0.0
+    assert cache_interval({"cache_interval": "2"}) == 2
+    assert cache_interval({"cache_interval": 4.0}) == 4
+    assert cache_interval({"cache_interval": 100}) == MAX_INTERVAL
+
+
+@pytest.mark.parametrize("value", ["abc", "nan", float("inf"), True, [0.5]])
+def test_malformed_tome_ratio_is_rejected(value):
+    with pytest.raises(ValueError, match="tome_ratio"):
+        tome_ratio({"tome_ratio": value})
+
+
+@pytest.mark.parametrize("value", ["abc", "2.5", 2.5, "nan", False])
+def test_malformed_cache_interval_is_rejected(value):
+    with pytest.raises(ValueError, match="cache_interval"):
+        cache_interval({"cache_interval": value})
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""CPU training-throughput benchmark for `train_text_to_image_lora.py`.
+
+Builds a tiny randomly initialised Stable Diffusion (UNet, VAE, CLIP text encoder and tokenizer) and a synthetic
+image-caption dataset in the `imagefolder` layout of `metadata.csv`, then runs the trainer's real `main()` for a
+fixed number of steps on CPU, in one subprocess per configuration, across a matrix of batch sizes, dataloader
+workers and latent / text-embedding caching. Each run reports steps/sec, the share of the loop spent waiting for
+batches and the peak RSS (the trainer's `--throughput_report`); the results are printed and written as JSON.
+
+Nothing is downloaded, so it runs without a GPU or the SD 1.5 weights. The models are far too small for the
+numbers to predict a real run: the benchmark catches regressions of the training loop and data pipeline and
+compares options with each other.
+
+Example:
+    python benchmark_train_lora.py --batch_sizes 1 4 --num_workers 0 2 --caching none latents both \\
+        --max_train_steps 30 --output train_benchmark.json
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_text_to_image_lora.py")
+
+CACHING = {
+    "none": [],
+    "latents": ["--cache_latents"],
+    "text": ["--cache_text_embeddings"],
+    "both": ["--cache_latents", "--cache_text_embeddings"],
+}
+
+WORDS = (
+    "game cover title bold red blue yellow font character sword castle space ship forest night city neon pixel"
+    " dragon knight robot zombie racing car logo dark bright retro cartoon hero monster sky ocean fire"
+).split()
+
+logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the LoRA trainer's throughput on CPU with tiny models.")
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        default=None,
+        help="Where the tiny model, the dataset and the runs are written (default: a temporary directory).",
+    )
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[0, 2], help="Dataloader worker counts.")
+    parser.add_argument("--caching", type=str, nargs="+", default=list(CACHING), choices=list(CACHING))
+    parser.add_argument("--max_train_steps", type=int, default=20, help="Optimizer steps per run.")
+    parser.add_argument("--num_images", type=int, default=64, help="Images in the synthetic dataset.")
+    parser.add_argument("--image_size", type=int, default=96, help="Side of the synthetic images, before resizing.")
+    parser.add_argument("--resolution", type=int, default=64, help="Training resolution.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--train_args",
+        type=str,
+        nargs=argparse.REMAINDER,
+        default=[],
+        help="Extra arguments passed to every training run (must come last).",
+    )
+    parser.add_argument("--output", type=str, default=None, help="JSON file for the results.")
+    return parser.parse_args()
+
+
+# ---- Tiny model ----
+def build_tokenizer(path):
+    """A byte-level CLIP tokenizer without merges: every character is a token."""
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    characters = list(bytes_to_unicode().values())
+    tokens = characters + [c + "</w>" for c in characters] + ["<|startoftext|>", "<|endoftext|>"]
+    staging = os.path.join(path, "staging")
+    os.makedirs(staging, exist_ok=True)
+    vocab_file, merges_file = os.path.join(staging, "vocab.json"), os.path.join(staging, "merges.txt")
+    with open(vocab_file, "w") as f:
+        json.dump({token: i for i, token in enumerate(tokens)}, f)
+    with open(merges_file, "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+    tokenizer.save_pretrained(os.path.join(path, "tokenizer"))
+    return tokenizer
+
+
+def build_tiny_model(path, seed):
+    """Save a randomly initialised, few-MB Stable Diffusion in the diffusers layout the trainer loads."""
+    import torch
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    from diffusers import AutoencoderKL, DDPMScheduler, UNet2DConditionModel
+
+    torch.manual_seed(seed)
+    tokenizer = build_tokenizer(path)
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            max_position_embeddings=tokenizer.model_max_length,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    )
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+    )
+    text_encoder.save_pretrained(os.path.join(path, "text_encoder"))
+    unet.save_pretrained(os.path.join(path, "unet"))
+    vae.save_pretrained(os.path.join(path, "vae"))
+    DDPMScheduler(num_train_timesteps=1000).save_pretrained(os.path.join(path, "scheduler"))
+
+
+# ---- Synthetic dataset ----
+def build_dataset(path, num_images, image_size, seed):
+    """Random images and captions, listed in a `metadata.csv` like the real dataset's."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+    rows = []
+    for i in range(num_images):
+        file_name = f"image-{i:05d}.png"
+        # Smooth colour fields compress like real covers, unlike uniform noise.
+        low = np_rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        Image.fromarray(low).resize((image_size, image_size), Image.BICUBIC).save(os.path.join(path, file_name))
+        caption = "The image is a cover for a game titled " + " ".join(rng.choices(WORDS, k=rng.randint(8, 40)))
+        rows.append({"file_name": file_name, "label": caption})
+    with open(os.path.join(path, "metadata.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["file_name", "label"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# ---- Runs ----
+def run_training(args, model_dir, data_dir, run_dir, batch_size, num_workers, caching):
+    """Train one configuration in a subprocess; returns its throughput report and the peak RSS of its tree."""
+    os.makedirs(run_dir, exist_ok=True)
+    report_file = os.path.join(run_dir, "throughput.json")
+    # fmt: off
+    command = [
+        sys.executable,
+        TRAIN_SCRIPT,
+        "--pretrained_model_name_or_path", model_dir,
+        "--train_data_dir", data_dir,
+        "--caption_column", "label",
+        "--cache_dir", os.path.join(args.work_dir, "hf_cache"),
+        "--output_dir", run_dir,
+        "--resolution", str(args.resolution),
+        "--train_batch_size", str(batch_size),
+        "--dataloader_num_workers", str(num_workers),
+        "--max_train_steps", str(args.max_train_steps),
+        "--checkpointing_steps", str(args.max_train_steps + 1),
+        "--lr_warmup_steps", "0",
+        "--seed", str(args.seed),
+        "--report_to", "wandb",
+        "--throughput_report", report_file,
+    ] + CACHING[caching] + args.train_args
+    # fmt: on
+    env = {
+        **os.environ,
+        "WANDB_MODE": "disabled",
+        "CUDA_VISIBLE_DEVICES": "",
+        "HF_HUB_OFFLINE": "1",
+        "TOKENIZERS_PARALLELISM": "false",
+    }
+    start = time.perf_counter()
+    with open(os.path.join(run_dir, "train.log"), "w") as log:
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the peak RSS of the trainer and of the dataloader workers it reaped.
+        _, status, usage = os.wait4(process.pid, 0)
+    result = {"wall_s": round(time.perf_counter() - start, 1)}
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0 or not os.path.exists(report_file):
+        result["error"] = f"exit code {exit_code}, see {os.path.join(run_dir, 'train.log')}"
+        return result
+    with open(report_file) as f:
+        result.update(json.load(f))
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+    unit = 1 if sys.platform == "darwin" else 1024
+    result["peak_rss_tree_mb"] = round(usage.ru_maxrss * unit / 2**20, 1)
+    return result
+
+
+def write_table(results):
+    columns = [
+        "batch_size",
+        "num_workers",
+        "caching",
+        "steps_per_s",
+        "samples_per_s",
+        "dataloader_wait_share",
+        "cache_s",
+        "peak_rss_mb",
+        "peak_rss_tree_mb",
+    ]
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    lines += ["| " + " | ".join(str(result.get(c, result.get("error"))) for c in columns) + " |" for result in results]
+    print("\n".join(lines))
+
+
+def main():
+    args = parse_args()
+    if args.work_dir is None:
+        args.work_dir = tempfile.mkdtemp(prefix="lora-train-benchmark-")
+    model_dir = os.path.join(args.work_dir, "tiny-sd")
+    data_dir = os.path.join(args.work_dir, "data")
+
+    logger.info(f"Building the tiny model and {args.num_images} synthetic images in {args.work_dir}")
+    build_tiny_model(model_dir, args.seed)
+    build_dataset(data_dir, args.num_images, args.image_size, args.seed)
+
+    results = []
+    matrix = list(itertools.product(args.batch_sizes, args.num_workers, args.caching))
+    for i, (batch_size, num_workers, caching) in enumerate(matrix):
+        config = {"batch_size": batch_size, "num_workers": num_workers, "caching": caching}
+        logger.info(f"Run {i + 1}/{len(matrix)}: {config}")
+        run_dir = os.path.join(args.work_dir, "runs", f"bs{batch_size}-w{num_workers}-{caching}")
+        result = {**config, **run_training(args, model_dir, data_dir, run_dir, batch_size, num_workers, caching)}
+        logger.info(f"{result}")
+        results.append(result)
+
+    write_table(results)
+    output = {
+        "settings": {
+            "max_train_steps": args.max_train_steps,
+            "num_images": args.num_images,
+            "image_size": args.image_size,
+            "resolution": args.resolution,
+            "seed": args.seed,
+            "train_args": args.train_args,
+        },
+        "runs": results,
+    }
+    with open(args.output or os.path.join(args.work_dir, "benchmark.json"), "w") as f:
+        json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Batched evaluation of the LoRA checkpoints written by `train_text_to_image_lora.py`.
+
+A fixed set of prompts is sampled from the captions of `metadata.csv` and rendered for every `checkpoint-*`
+directory (and the final weights) of a training run, with the same seeds for every checkpoint. Each checkpoint
+gets a CLIP score (prompt/image agreement) and FID / KID against reference statistics of the dataset images.
+
+Everything that does not depend on the checkpoint is computed once: the base pipeline is loaded once and each
+checkpoint is swapped in as a LoRA adapter, the prompt embeddings are encoded once, and the reference Inception
+statistics are cached on disk (`--cache_dir`) and reused by later runs.
+
+FID / KID use torchvision's Inception v3 pool features: they compare checkpoints with each other, and are not
+comparable to published FIDs.
+
+Example:
+    python evaluate_lora.py --checkpoints_dir sd-fighting-platform-cover-lora --train_data_dir training_512 \\
+        --num_prompts 200 --batch_size 16 --include_base
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from scipy import linalg
+from torchvision.models import Inception_V3_Weights, inception_v3
+from tqdm.auto import tqdm
+from transformers import CLIPModel, CLIPProcessor
+
+from diffusers import StableDiffusionPipeline
+
+LORA_WEIGHT_NAME = "pytorch_lora_weights.safetensors"
+
+logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate the LoRA checkpoints of a training run.")
+    parser.add_argument(
+        "--pretrained_model_name_or_path",
+        type=str,
+        default="runwayml/stable-diffusion-v1-5",
+        help="Base model the LoRA was trained on.",
+    )
+    parser.add_argument(
+        "--checkpoints_dir",
+        type=str,
+        required=True,
+        help="Training output directory: every `checkpoint-*` subdirectory and the final weights are evaluated.",
+    )
+    parser.add_argument(
+        "--train_data_dir",
+        type=str,
+        default=os.path.dirname(os.path.abspath(__file__)),
+        help="Folder holding `metadata.csv` and the reference images it lists.",
+    )
+    parser.add_argument("--caption_column", type=str, default="label")
+    parser.add_argument("--image_column", type=str, default="file_name")
+    parser.add_argument("--num_prompts", type=int, default=100, help="Prompts sampled from the captions.")
+    parser.add_argument(
+        "--num_reference_images", type=int, default=None, help="Reference images used for FID / KID (default: all)."
+    )
+    parser.add_argument("--include_base", action="store_true", help="Also evaluate the base model without LoRA.")
+    parser.add_argument("--batch_size", type=int, default=16, help="Images generated per pipeline call.")
+    parser.add_argument("--num_inference_steps", type=int, default=30)
+    parser.add_argument("--guidance_scale", type=float, default=7.5)
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=42, help="Seed for prompt sampling and generation.")
+    parser.add_argument(
+        "--mixed_precision", type=str, default="fp16", choices=["no", "fp16", "bf16"], help="Generation precision."
+    )
+    parser.add_argument("--clip_model", type=str, default="openai/clip-vit-large-patch14")
+    parser.add_argument("--kid_subsets", type=int, default=100)
+    parser.add_argument("--kid_subset_size", type=int, default=1000)
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".eval_cache"),
+        help="Where reference statistics and prompt embeddings are cached.",
+    )
+    parser.add_argument("--save_images", action="store_true", help="Keep generated images in `<checkpoint>/eval`.")
+    parser.add_argument(
+        "--output", type=str, default=None, help="Comparison table (default: `<checkpoints_dir>/evaluation.md`)."
+    )
+    return parser.parse_args()
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# ---- Data ----
+def read_metadata(args):
+    with open(os.path.join(args.train_data_dir, "metadata.csv"), newline="", encoding="utf-8") as f:
+        return [row for row in csv.DictReader(f) if row.get(args.caption_column)]
+
+
+def list_checkpoints(args):
+    checkpoints = []
+    if args.include_base:
+        checkpoints.append(("base", None))
+    dirs = [d for d in os.listdir(args.checkpoints_dir) if d.startswith("checkpoint")]
+    for name in sorted(dirs, key=lambda x: int(x.split("-")[1])):
+        path = os.path.join(args.checkpoints_dir, name)
+        if os.path.exists(os.path.join(path, LORA_WEIGHT_NAME)):
+            checkpoints.append((name, path))
+    if os.path.exists(os.path.join(args.checkpoints_dir, LORA_WEIGHT_NAME)):
+        checkpoints.append(("final", args.checkpoints_dir))
+    return checkpoints
+
+
+# ---- Metrics ----
+class InceptionFeatures:
+    """2048-d pool features of torchvision's Inception v3."""
+
+    name = "torchvision-inception_v3-IMAGENET1K_V1"
+
+    def __init__(self, device):
+        self.device = device
+        self.model = inception_v3(weights=Inception_V3_Weights.IMAGENET1K_V1, aux_logits=True)
+        self.model.fc = torch.nn.Identity()
+        self.model.eval().to(device)
+        self.mean = torch.tensor([0.485, 0.456, 0.406], device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225], device=device).view(1, 3, 1, 1)
+
+    @torch.no_grad()
+    def __call__(self, images):
+        pixels = torch.stack(
+            [torch.from_numpy(np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0) for image in images]
+        )
+        pixels = pixels.permute(0, 3, 1, 2).to(self.device)
+        pixels = F.interpolate(pixels, size=(299, 299), mode="bilinear", align_corners=False)
+        return self.model((pixels - self.mean) / self.std).double().cpu().numpy()
+
+
+class ClipScorer:
+    def __init__(self, model_name, device):
+        self.device = device
+        self.model = CLIPModel.from_pretrained(model_name).eval().to(device)
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+
+    @torch.no_grad()
+    def __call__(self, images, prompts):
+        """CLIP score (100 x cosine similarity, floored at 0) of each image with its prompt."""
+        inputs = self.processor(
+            text=prompts, images=images, return_tensors="pt", padding=True, truncation=True
+        ).to(self.device)
+        outputs = self.model(**inputs)
+        image_embeds = F.normalize(outputs.image_embeds, dim=-1)
+        text_embeds = F.normalize(outputs.text_embeds, dim=-1)
+        return (100 * (image_embeds * text_embeds).sum(dim=-1)).clamp(min=0).cpu().tolist()
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2):
+    diff = mu1 - mu2
+    covmean, _ = linalg.sqrtm(sigma1.dot(sigma2), disp=False)
+    if not np.isfinite(covmean).all():
+        offset = np.eye(sigma1.shape[0]) * 1e-6
+        covmean = linalg.sqrtm((sigma1 + offset).dot(sigma2 + offset))
+    covmean = covmean.real
+    return float(diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * np.trace(covmean))
+
+
+def kernel_inception_distance(features1, features2, num_subsets, subset_size, seed):
+    """Unbiased MMD^2 with a cubic polynomial kernel, averaged over random subsets (Binkowski et al., 2018)."""
+    rng = np.random.default_rng(seed)
+    size = min(subset_size, len(features1), len(features2))
+    dim = features1.shape[1]
+    scores = []
+    for _ in range(num_subsets):
+        x = features1[rng.choice(len(features1), size, replace=False)]
+        y = features2[rng.choice(len(features2), size, replace=False)]
+        k_xx = (x @ x.T / dim + 1) ** 3
+        k_yy = (y @ y.T / dim + 1) ** 3
+        k_xy = (x @ y.T / dim + 1) ** 3
+        scores.append(
+            (k_xx.sum() - np.trace(k_xx)) / (size * (size - 1))
+            + (k_yy.sum() - np.trace(k_yy)) / (size * (size - 1))
+            - 2 * k_xy.mean()
+        )
+    return float(np.mean(scores)), float(np.std(scores))
+
+
+def reference_statistics(args, rows, inception):
+    """Inception features, mean and covariance of the reference images, cached as `.npz`."""
+    files = sorted(row[args.image_column] for row in rows)
+    if args.num_reference_images is not None:
+        files = random.Random(args.seed).sample(files, min(args.num_reference_images, len(files)))
+    stamps = [(name, os.path.getmtime(os.path.join(args.train_data_dir, name))) for name in files]
+    cache_path = os.path.join(
+        args.cache_dir, f"reference-{_digest(os.path.abspath(args.train_data_dir), stamps, inception.name)}.npz"
+    )
+    if os.path.exists(cache_path):
+        logger.info(f"Using cached reference statistics {cache_path}")
+        cached = np.load(cache_path)
+        return cached["features"], cached["mu"], cached["sigma"]
+
+    features = []
+    for start in tqdm(range(0, len(files), args.batch_size), desc="Reference features"):
+        images = [Image.open(os.path.join(args.train_data_dir, name)) for name in files[start : start + args.batch_size]]
+        features.append(inception(images))
+    features = np.concatenate(features)
+    mu, sigma = features.mean(axis=0), np.cov(features, rowvar=False)
+    os.makedirs(args.cache_dir, exist_ok=True)
+    np.savez(cache_path, features=features, mu=mu, sigma=sigma)
+    logger.info(f"Cached reference statistics of {len(files)} images in {cache_path}")
+    return features, mu, sigma
+
+
+def prompt_embeddings(args, pipeline, prompts, device):
+    """Positive and negative prompt embeddings, encoded once and cached: the trainer only adapts the UNet."""
+    cache_path = os.path.join(
+        args.cache_dir, f"prompts-{_digest(args.pretrained_model_name_or_path, prompts, args.guidance_scale > 1)}.pt"
+    )
+    if os.path.exists(cache_path):
+        embeds, negative_embeds = torch.load(cache_path)
+    else:
+        embeds, negative_embeds = [], []
+        for start in range(0, len(prompts), args.batch_size):
+            batch_embeds, batch_negative = pipeline.encode_prompt(
+                prompts[start : start + args.batch_size],
+                device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=args.guidance_scale > 1,
+            )
+            embeds.append(batch_embeds.cpu())
+            negative_embeds.append(batch_negative.cpu() if batch_negative is not None else None)
+        embeds = torch.cat(embeds)
+        negative_embeds = torch.cat(negative_embeds) if negative_embeds[0] is not None else None
+        os.makedirs(args.cache_dir, exist_ok=True)
+        torch.save((embeds, negative_embeds), cache_path)
+    return embeds, negative_embeds
+
+
+# ---- Evaluation ----
+def evaluate_checkpoint(args, name, pipeline, prompts, embeds, negative_embeds, clip_scorer, inception, reference):
+    device = pipeline.device
+    image_dir = {
+        "base": os.path.join(args.checkpoints_dir, "eval-base"),
+        "final": os.path.join(args.checkpoints_dir, "eval"),
+    }.get(name, os.path.join(args.checkpoints_dir, name, "eval"))
+    if args.save_images:
+        os.makedirs(image_dir, exist_ok=True)
+
+    features, clip_scores = [], []
+    start_time = time.perf_counter()
+    for start in tqdm(range(0, len(prompts), args.batch_size), desc=name):
+        end = min(start + args.batch_size, len(prompts))
+        # One seed per prompt index: every checkpoint denoises the same noise.
+        generators = [torch.Generator(device="cpu").manual_seed(args.seed + i) for i in range(start, end)]
+        images = pipeline(
+            prompt_embeds=embeds[start:end].to(device, pipeline.unet.dtype),
+            negative_prompt_embeds=(
+                negative_embeds[start:end].to(device, pipeline.unet.dtype) if negative_embeds is not None else None
+            ),
+            num_inference_steps=args.num_inference_steps,
+            guidance_scale=args.guidance_scale,
+            height=args.resolution,
+            width=args.resolution,
+            generator=generators,
+        ).images
+        features.append(inception(images))
+        clip_scores.extend(clip_scorer(images, prompts[start:end]))
+        if args.save_images:
+            for i, image in zip(range(start, end), images):
+                image.save(os.path.join(image_dir, f"{i:04d}.png"))
+    elapsed = time.perf_counter() - start_time
+
+    features = np.concatenate(features)
+    reference_features, reference_mu, reference_sigma = reference
+    fid = frechet_distance(features.mean(axis=0), np.cov(features, rowvar=False), reference_mu, reference_sigma)
+    kid_mean, kid_std = kernel_inception_distance(
+        features, reference_features, args.kid_subsets, args.kid_subset_size, args.seed
+    )
+    return {
+        "checkpoint": name,
+        "clip_score": round(float(np.mean(clip_scores)), 3),
+        "fid": round(fid, 3),
+        "kid": round(kid_mean, 5),
+        "kid_std": round(kid_std, 5),
+        "seconds": round(elapsed, 1),
+    }
+
+
+def write_table(results, output):
+    columns = ["checkpoint", "clip_score", "fid", "kid", "kid_std", "seconds"]
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    lines += ["| " + " | ".join(str(result[c]) for c in columns) + " |" for result in results]
+    with open(output, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(os.path.splitext(output)[0] + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+    print("\n".join(lines))
+
+
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(args.mixed_precision, torch.float32)
+    if device.type == "cpu":
+        dtype = torch.float32
+
+    rows = read_metadata(args)
+    rng = random.Random(args.seed)
+    prompts = [row[args.caption_column] for row in rng.sample(rows, min(args.num_prompts, len(rows)))]
+    checkpoints = list_checkpoints(args)
+    if not checkpoints:
+        raise ValueError(f"No checkpoints with {LORA_WEIGHT_NAME} found in {args.checkpoints_dir}.")
+    logger.info(f"Evaluating {len(checkpoints)} checkpoints on {len(prompts)} prompts")
+
+    inception = InceptionFeatures(device)
+    reference = reference_statistics(args, rows, inception)
+    clip_scorer = ClipScorer(args.clip_model, device)
+
+    pipeline = StableDiffusionPipeline.from_pretrained(
+        args.pretrained_model_name_or_path, torch_dtype=dtype, safety_checker=None
+    ).to(device)
+    pipeline.set_progress_bar_config(disable=True)
+    embeds, negative_embeds = prompt_embeddings(args, pipeline, prompts, device)
+
+    results = []
+    for name, path in checkpoints:
+        if path is not None:
+            pipeline.load_lora_weights(path, weight_name=LORA_WEIGHT_NAME, adapter_name="eval")
+        try:
+            result = evaluate_checkpoint(
+                args, name, pipeline, prompts, embeds, negative_embeds, clip_scorer, inception, reference
+            )
+        finally:
+            if path is not None:
+                pipeline.unload_lora_weights()
+        logger.info(f"{name}: {result}")
+        results.append(result)
+
+    write_table(results, args.output or os.path.join(args.checkpoints_dir, "evaluation.md"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the training script from `model/`, like `accelerate launch` runs it.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
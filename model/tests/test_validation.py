@@ -0,0 +1,64 @@
+"""In-loop validation: one batched pipeline call, and the next epoch's batches fetched during it."""
+
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("torch", "diffusers", "accelerate", "datasets", "peft", "torchvision", "transformers"):
+    pytest.importorskip(module)
+
+import torch  # noqa: E402
+from accelerate import PartialState  # noqa: E402
+
+from train_text_to_image_lora import BackgroundBatchFetcher, log_validation  # noqa: E402
+
+
+class RecordingPipeline:
+    def __init__(self):
+        self.calls = []
+
+    def to(self, device):
+        return self
+
+    def set_progress_bar_config(self, **kwargs):
+        pass
+
+    def __call__(self, prompts, num_images_per_prompt, num_inference_steps, generator):
+        self.calls.append((list(prompts), num_images_per_prompt, num_inference_steps))
+        return SimpleNamespace(images=[object() for _ in range(len(prompts) * num_images_per_prompt)])
+
+
+def test_validation_generates_every_prompt_in_one_call():
+    # accelerate's logger needs the process state.
+    PartialState(cpu=True)
+    pipeline = RecordingPipeline()
+    args = SimpleNamespace(
+        validation_prompt=["a loft", "a kitchen"], num_validation_images=3, validation_steps=12, seed=0
+    )
+    accelerator = SimpleNamespace(device=torch.device("cpu"), trackers=[])
+    images = log_validation(pipeline, args, accelerator, epoch=0)
+    assert pipeline.calls == [(["a loft", "a kitchen"], 3, 12)]
+    assert len(images) == 6
+
+
+class ShortLoader:
+    """Mimics an accelerate-prepared loader: `end_of_dataloader` is raised when the last batch is pulled."""
+
+    def __init__(self, num_batches):
+        self.num_batches = num_batches
+        self.end_of_dataloader = False
+
+    def __iter__(self):
+        self.end_of_dataloader = False
+        for i in range(self.num_batches):
+            if i == self.num_batches - 1:
+                self.end_of_dataloader = True
+            yield {"index": i}
+
+
+@pytest.mark.parametrize("fetched", [1, 2, 5])
+def test_fetcher_raises_end_of_dataloader_with_the_last_batch_only(fetched):
+    loader = ShortLoader(num_batches=2)
+    fetcher = BackgroundBatchFetcher(loader, fetched)
+    seen = [(batch["index"], loader.end_of_dataloader) for batch in fetcher]
+    assert seen == [(0, False), (1, True)]
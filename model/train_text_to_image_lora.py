@@ -16,13 +16,20 @@
 """Fine-tuning script for Stable Diffusion for text2image with support for LoRA."""
 
 import argparse
+import json
 import logging
 import math
 import os
 import random
 import shutil
+import sys
+import threading
+import time
+from collections import deque
 from contextlib import nullcontext
+from dataclasses import dataclass
 from pathlib import Path
+from typing import List, Optional
 
 import datasets
 import numpy as np
@@ -43,7 +50,20 @@ from tqdm.auto import tqdm
 from transformers import CLIPTextModel, CLIPTokenizer
 
 import diffusers
-from diffusers import AutoencoderKL, DDPMScheduler, DiffusionPipeline, StableDiffusionPipeline, UNet2DConditionModel
+from diffusers import (
+    AutoencoderKL,
+    DDIMScheduler,
+    DDPMScheduler,
+    DiffusionPipeline,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    PNDMScheduler,
+    StableDiffusionPipeline,
+    UNet2DConditionModel,
+    UniPCMultistepScheduler,
+)
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
 from diffusers.optimization import get_scheduler
 from diffusers.training_utils import cast_training_params, compute_snr
 from diffusers.utils import check_min_version, convert_state_dict_to_diffusers, is_wandb_available
@@ -104,6 +124,36 @@ These are LoRA adaption weights for {base_model}. The weights were fine-tuned on
     model_card.save(os.path.join(repo_folder, "README.md"))
 
 
+def build_validation_scheduler(args):
+    """Instantiate the scheduler used for validation, once, from the pretrained scheduler config."""
+    scheduler_config = DDPMScheduler.load_config(
+        args.pretrained_model_name_or_path, subfolder="scheduler", revision=args.revision
+    )
+    if args.validation_scheduler is None:
+        scheduler_cls = getattr(diffusers, scheduler_config["_class_name"])
+    else:
+        scheduler_cls = VALIDATION_SCHEDULERS[args.validation_scheduler]
+    return scheduler_cls.from_config(scheduler_config)
+
+
+def build_validation_pipeline(unet, vae, text_encoder, tokenizer, scheduler):
+    """Assemble a pipeline around the components already resident on the training device.
+
+    Nothing is read from disk: the live (LoRA-adapted) `unet` and the frozen `vae` / `text_encoder` are shared
+    with the training loop, so building the pipeline is free and needs no cleanup besides dropping the reference.
+    """
+    return StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
 def log_validation(
     pipeline,
     args,
@@ -111,24 +161,30 @@ def log_validation(
     epoch,
     is_final_validation=False,
 ):
+    prompts = args.validation_prompt
     logger.info(
-        f"Running validation... \n Generating {args.num_validation_images} images with prompt:"
-        f" {args.validation_prompt}."
+        f"Running validation... \n Generating {args.num_validation_images} images for each of the"
+        f" {len(prompts)} prompt(s) {prompts} with {args.validation_steps} steps."
     )
     pipeline = pipeline.to(accelerator.device)
     pipeline.set_progress_bar_config(disable=True)
     generator = torch.Generator(device=accelerator.device)
     if args.seed is not None:
         generator = generator.manual_seed(args.seed)
-    images = []
     if torch.backends.mps.is_available():
         autocast_ctx = nullcontext()
     else:
         autocast_ctx = torch.autocast(accelerator.device.type)
 
-    with autocast_ctx:
-        for _ in range(args.num_validation_images):
-            images.append(pipeline(args.validation_prompt, num_inference_steps=30, generator=generator).images[0])
+    # All prompts and all images per prompt go through the denoising loop as a single batch.
+    with autocast_ctx, torch.no_grad():
+        images = pipeline(
+            prompts,
+            num_images_per_prompt=args.num_validation_images,
+            num_inference_steps=args.validation_steps,
+            generator=generator,
+        ).images
+    captions = [prompt for prompt in prompts for _ in range(args.num_validation_images)]
 
     for tracker in accelerator.trackers:
         phase_name = "test" if is_final_validation else "validation"
@@ -139,13 +195,322 @@ def log_validation(
             tracker.log(
                 {
                     phase_name: [
-                        wandb.Image(image, caption=f"{i}: {args.validation_prompt}") for i, image in enumerate(images)
+                        wandb.Image(image, caption=f"{i}: {caption}")
+                        for i, (image, caption) in enumerate(zip(images, captions))
                     ]
                 }
             )
     return images
 
 
+class BackgroundBatchFetcher:
+    """Pull the first `num_batches` batches of an iterable on a helper thread.
+
+    Used to overlap the next epoch's data loading (worker start-up, decoding, transforms) with validation running
+    on the main thread. The underlying iterator is only ever advanced by one thread at a time: the helper thread
+    finishes before `__iter__` hands the remaining batches to the caller.
+
+    An accelerate-prepared loader raises `end_of_dataloader` when its last batch is pulled, which for a short epoch
+    may happen on the helper thread, before the training loop has seen the first batch. The flag is recorded with
+    each fetched batch and restored on the loader as that batch is handed out.
+    """
+
+    def __init__(self, iterable, num_batches):
+        self._loader = iterable
+        self._iterator = iter(iterable)
+        self._batches = []
+        self._error = None
+        self._thread = threading.Thread(target=self._fetch, args=(num_batches,), daemon=True)
+        self._thread.start()
+
+    def _end_of_dataloader(self):
+        return getattr(self._loader, "end_of_dataloader", None)
+
+    def _fetch(self, num_batches):
+        try:
+            for _ in range(num_batches):
+                batch = next(self._iterator)
+                is_last = self._end_of_dataloader()
+                if is_last:
+                    self._loader.end_of_dataloader = False
+                self._batches.append((batch, is_last))
+        except StopIteration:
+            pass
+        except Exception as e:  # re-raised on the consuming thread
+            self._error = e
+
+    def __iter__(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        for batch, is_last in self._batches:
+            if is_last is not None:
+                self._loader.end_of_dataloader = is_last
+            yield batch
+        yield from self._iterator
+
+
+class DevicePrefetcher:
+    """Move batches to the training device ahead of the step that consumes them.
+
+    On CUDA, up to `depth` batches (pinned by the dataloader) are copied with non-blocking transfers on a side
+    stream, `pixel_values` being cast to `dtype` as part of the copy, so the transfer of the next batches overlaps
+    the current step. Elsewhere (CPU, MPS) each batch is moved synchronously when it is consumed.
+
+    Accelerate marks the end of an epoch on `loader` (`end_of_dataloader`, used to sync gradient accumulation)
+    when its last batch is pulled. The look-ahead would raise that flag early, so it is held back until the last
+    batch is handed to the training loop, and the loader is only run to exhaustion after that batch was consumed.
+    """
+
+    def __init__(self, batches, device, dtype, depth, loader=None):
+        self.batches = batches
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.depth = depth
+        self.loader = loader
+
+    def _to_device(self, batch):
+        return {
+            key: value.to(self.device, dtype=self.dtype if key == "pixel_values" else None, non_blocking=True)
+            for key, value in batch.items()
+        }
+
+    def __iter__(self):
+        iterator = iter(self.batches)
+        if self.device.type != "cuda" or self.depth <= 0:
+            for batch in iterator:
+                yield self._to_device(batch)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        pending = deque()
+        last_pulled = False
+
+        def pull():
+            nonlocal last_pulled
+            batch = next(iterator, None)
+            if batch is None:
+                return
+            is_last = bool(getattr(self.loader, "end_of_dataloader", False))
+            if is_last:
+                self.loader.end_of_dataloader = False
+                last_pulled = True
+            with torch.cuda.stream(stream):
+                batch = self._to_device(batch)
+                ready = torch.cuda.Event()
+                ready.record(stream)
+            pending.append((batch, ready, is_last))
+
+        while len(pending) < self.depth and not last_pulled:
+            pull()
+        while pending:
+            batch, ready, is_last = pending.popleft()
+            current = torch.cuda.current_stream(self.device)
+            current.wait_event(ready)
+            for value in batch.values():
+                # The tensors were allocated on the side stream; keep them alive until the step is done with them.
+                value.record_stream(current)
+            if not last_pulled:
+                pull()
+            if is_last:
+                self.loader.end_of_dataloader = True
+            yield batch
+        # Let the loader finish its epoch (and its accelerate bookkeeping) once everything was consumed.
+        for _ in iterator:
+            pass
+
+
+def close_epoch(batches, loader):
+    """Stop an epoch before the end of `loader`: close the batch iterator and end the loader's iteration.
+
+    A prepared loader registers itself with accelerate's `GradientState` when an iteration starts and only removes
+    itself after its last batch. Left registered, it would keep driving `end_of_dataloader` and `sync_gradients`
+    under the next phase's loader. Closing instead of draining skips loading the rest of the epoch.
+    """
+    batches.close()
+    gradient_state = getattr(loader, "gradient_state", None)
+    if gradient_state is not None and any(ref is loader for ref in gradient_state.dataloader_references):
+        loader.end()
+
+
+class EncodedDataset(torch.utils.data.Dataset):
+    """A training split whose VAE latents and/or text embeddings were computed once, before training.
+
+    `encodings` maps a batch key (`latent_parameters`: the VAE's latent distribution, `encoder_hidden_states`) to
+    one tensor per example. `dataset` produces only the inputs that are not cached (see `with_inputs`): the images
+    are not decoded and transformed when their latents are cached, nor the captions tokenized when their embeddings
+    are.
+    """
+
+    REPLACES = {"latent_parameters": "pixel_values", "encoder_hidden_states": "input_ids"}
+
+    def __init__(self, dataset, encodings):
+        self.dataset = dataset
+        self.encodings = encodings
+        self.missing = {"pixel_values", "input_ids"} - {self.REPLACES[key] for key in encodings}
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        example = {key: values[index] for key, values in self.encodings.items()}
+        if self.missing:
+            source = self.dataset[index]
+            example.update({key: source[key] for key in self.missing})
+        return example
+
+
+class ThroughputMeter:
+    """Timings of the training loop for `--throughput_report`.
+
+    `train_s` covers the epochs' batch loops (validation excluded) and `dataloader_wait_s` the part of it spent
+    waiting for the next batch. The first optimizer step, which includes worker start-up and lazy initialisation,
+    is also reported on its own.
+    """
+
+    def __init__(self):
+        self.cache_s = 0.0
+        self.train_s = 0.0
+        self.wait_s = 0.0
+        self.first_step_s = None
+        self.steps = 0
+        self.samples = 0
+        self._epoch_start = None
+
+    def timed(self, batches):
+        """Iterate `batches`, timing every wait for the next batch."""
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            batch = next(iterator, None)
+            self.wait_s += time.perf_counter() - start
+            if batch is None:
+                return
+            yield batch
+
+    def start_epoch(self):
+        self._epoch_start = time.perf_counter()
+
+    def end_epoch(self):
+        self.train_s += time.perf_counter() - self._epoch_start
+        self._epoch_start = None
+
+    def step(self):
+        self.steps += 1
+        if self.steps == 1:
+            self.first_step_s = self.train_s + time.perf_counter() - self._epoch_start
+
+    def report(self):
+        def rate(count, seconds):
+            return round(count / seconds, 4) if count and seconds else None
+
+        steady_s = self.train_s - (self.first_step_s or 0.0)
+        return {
+            "steps": self.steps,
+            "samples": self.samples,
+            "train_s": round(self.train_s, 3),
+            "cache_s": round(self.cache_s, 3),
+            "first_step_s": round(self.first_step_s, 3) if self.first_step_s is not None else None,
+            "steps_per_s": rate(self.steps, self.train_s),
+            "samples_per_s": rate(self.samples, self.train_s),
+            "steady_steps_per_s": rate(self.steps - 1, steady_s),
+            "dataloader_wait_s": round(self.wait_s, 3),
+            "dataloader_wait_share": round(self.wait_s / self.train_s, 4) if self.train_s else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (None where `resource` is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+    unit = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20, 1)
+
+
+@dataclass
+class TrainingPhase:
+    """A stretch of training at one resolution, covering optimizer steps `[start_step, end_step)`."""
+
+    resolution: int
+    batch_size: int
+    # Share of `max_train_steps`; None for the last phase, which takes the remaining steps.
+    fraction: Optional[float] = None
+    start_step: int = 0
+    end_step: int = 0
+    first_epoch: int = 0
+    num_epochs: int = 0
+    steps_per_epoch: int = 0
+    dataloader: Optional[torch.utils.data.DataLoader] = None
+
+
+def parse_resolution_schedule(entries):
+    """Parse `RESOLUTION:FRACTION ... RESOLUTION` into `(resolution, fraction)` pairs, the last fraction None."""
+    schedule = []
+    for i, entry in enumerate(entries):
+        resolution, _, fraction = entry.partition(":")
+        is_last = i == len(entries) - 1
+        if bool(fraction) == is_last:
+            raise ValueError(
+                "`--resolution_schedule` entries must be `RESOLUTION:FRACTION`, except the last one which is a plain"
+                f" `RESOLUTION`; got '{entry}'."
+            )
+        schedule.append((int(resolution), None if is_last else float(fraction)))
+    fractions = [fraction for _, fraction in schedule[:-1]]
+    if any(fraction <= 0 for fraction in fractions) or sum(fractions) >= 1:
+        raise ValueError("`--resolution_schedule` fractions must be positive and sum to less than 1.")
+    if any(resolution % 8 for resolution, _ in schedule):
+        raise ValueError("`--resolution_schedule` resolutions must be multiples of 8.")
+    return schedule
+
+
+def training_phases(args) -> List[TrainingPhase]:
+    """Phases of the run. Batch sizes scale with (`--resolution` / phase resolution)^2 to keep memory constant."""
+    if not args.resolution_schedule:
+        return [TrainingPhase(args.resolution, args.train_batch_size)]
+    return [
+        TrainingPhase(
+            resolution=resolution,
+            batch_size=max(1, round(args.train_batch_size * (args.resolution / resolution) ** 2)),
+            fraction=fraction,
+        )
+        for resolution, fraction in parse_resolution_schedule(args.resolution_schedule)
+    ]
+
+
+def assign_phase_steps(phases, max_train_steps):
+    """Split `max_train_steps` between the phases and lay their epochs out one after the other."""
+    start_step, first_epoch = 0, 0
+    for phase in phases:
+        phase.start_step = start_step
+        if phase.fraction is None:
+            phase.end_step = max_train_steps
+        else:
+            phase.end_step = min(max_train_steps, start_step + round(phase.fraction * max_train_steps))
+        phase.first_epoch = first_epoch
+        phase.num_epochs = math.ceil((phase.end_step - phase.start_step) / phase.steps_per_epoch)
+        start_step, first_epoch = phase.end_step, first_epoch + phase.num_epochs
+    return first_epoch
+
+
+def phase_for_step(phases, step) -> int:
+    return next((i for i, phase in enumerate(phases) if step < phase.end_step), len(phases) - 1)
+
+
+def release_workers(loader):
+    """Shut down the persistent worker processes of `loader` once its phase is over.
+
+    Persistent workers otherwise stay alive, each with its copy of the dataset, until the end of the run.
+    """
+    iterator = getattr(loader, "_iterator", None)
+    if iterator is not None and hasattr(iterator, "_shutdown_workers"):
+        iterator._shutdown_workers()
+    loader._iterator = None
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Simple example of a training script.")
     parser.add_argument(
@@ -204,21 +569,50 @@ def parse_args():
         help="The column of the dataset containing a caption or a list of captions.",
     )
     parser.add_argument(
-        "--validation_prompt", type=str, default=None, help="A prompt that is sampled during training for inference."
+        "--validation_prompt",
+        type=str,
+        nargs="+",
+        default=None,
+        help="One or more prompts that are sampled during training for inference.",
     )
     parser.add_argument(
         "--num_validation_images",
         type=int,
         default=4,
-        help="Number of images that should be generated during validation with `validation_prompt`.",
+        help="Number of images that should be generated during validation for each `validation_prompt`.",
+    )
+    parser.add_argument(
+        "--validation_steps",
+        type=int,
+        default=30,
+        help="Number of denoising steps used to generate the validation images.",
+    )
+    parser.add_argument(
+        "--validation_scheduler",
+        type=str,
+        default=None,
+        choices=sorted(VALIDATION_SCHEDULERS),
+        help=(
+            "Scheduler used to generate the validation images. Defaults to the scheduler shipped with"
+            " `pretrained_model_name_or_path`."
+        ),
+    )
+    parser.add_argument(
+        "--validation_prefetch_batches",
+        type=int,
+        default=2,
+        help=(
+            "Number of batches of the next epoch to load in the background while validation runs. Set to 0 to"
+            " disable the overlap."
+        ),
     )
     parser.add_argument(
         "--validation_epochs",
         type=int,
         default=1,
         help=(
-            "Run fine-tuning validation every X epochs. The validation process consists of running the prompt"
-            " `args.validation_prompt` multiple times: `args.num_validation_images`."
+            "Run fine-tuning validation every X epochs. The validation process consists of running the prompts"
+            " `args.validation_prompt` `args.num_validation_images` times each, in a single batch."
         ),
     )
     parser.add_argument(
@@ -252,6 +646,52 @@ def parse_args():
             " resolution"
         ),
     )
+    parser.add_argument(
+        "--resolution_schedule",
+        type=str,
+        default=None,
+        nargs="+",
+        help=(
+            "Progressive-resolution schedule: `RESOLUTION:FRACTION` entries followed by the final `RESOLUTION`, e.g."
+            " `256:0.4 512` trains the first 40% of `--max_train_steps` at 256 and the rest at 512. The batch size"
+            " of each phase is `--train_batch_size` scaled by (`--resolution` / phase resolution)^2, and images are"
+            " resized once per phase. Requires `--max_train_steps`."
+        ),
+    )
+    parser.add_argument(
+        "--device_prefetch_batches",
+        type=int,
+        default=2,
+        help=(
+            "Number of upcoming batches copied to the GPU ahead of the step on a side CUDA stream. 0 (and non-CUDA"
+            " devices) moves each batch synchronously."
+        ),
+    )
+    parser.add_argument(
+        "--cache_latents",
+        action="store_true",
+        help=(
+            "Encode every training image with the VAE once, before training, and sample the latents from the cached"
+            " distributions at each step. Random crops and flips are drawn once, when caching."
+        ),
+    )
+    parser.add_argument(
+        "--cache_text_embeddings",
+        action="store_true",
+        help=(
+            "Encode every caption with the text encoder once, before training. With several captions per image,"
+            " one is picked once, when caching."
+        ),
+    )
+    parser.add_argument(
+        "--throughput_report",
+        type=str,
+        default=None,
+        help=(
+            "Write training-loop throughput (steps/sec, samples/sec, dataloader wait share, caching time and peak"
+            " RSS) to this JSON file at the end of training."
+        ),
+    )
     parser.add_argument(
         "--center_crop",
         default=False,
@@ -438,10 +878,26 @@ def parse_args():
     # Sanity checks
     if args.dataset_name is None and args.train_data_dir is None:
         raise ValueError("Need either a dataset name or a training folder.")
+    if args.resolution_schedule is not None:
+        parse_resolution_schedule(args.resolution_schedule)
+        if args.max_train_steps is None:
+            raise ValueError("`--resolution_schedule` requires `--max_train_steps`.")
 
     return args
 
 
+VALIDATION_SCHEDULERS = {
+    "ddim": DDIMScheduler,
+    "dpm++": DPMSolverMultistepScheduler,
+    "euler": EulerDiscreteScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler,
+    "pndm": PNDMScheduler,
+    "unipc": UniPCMultistepScheduler,
+}
+
+# Batch entries built by `collate_fn`: the model inputs, or their cached encodings.
+BATCH_KEYS = ("pixel_values", "input_ids", "latent_parameters", "encoder_hidden_states")
+
 DATASET_NAME_MAPPING = {
     "lambdalabs/naruto-blip-captions": ("image", "text"),
 }
@@ -513,6 +969,7 @@ def main():
     unet = UNet2DConditionModel.from_pretrained(
         args.pretrained_model_name_or_path, subfolder="unet", revision=args.revision, variant=args.variant
     )
+    validation_scheduler = build_validation_scheduler(args) if args.validation_prompt is not None else None
     # freeze parameters of models to save more memory
     unet.requires_grad_(False)
     vae.requires_grad_(False)
@@ -667,48 +1124,146 @@ def main():
     if interpolation is None:
         raise ValueError(f"Unsupported interpolation mode {args.image_interpolation_mode}.")
 
-    # Data preprocessing transformations
-    train_transforms = transforms.Compose(
-        [
-            transforms.Resize(args.resolution, interpolation=interpolation),  # Use dynamic interpolation method
-            transforms.CenterCrop(args.resolution) if args.center_crop else transforms.RandomCrop(args.resolution),
-            transforms.RandomHorizontalFlip() if args.random_flip else transforms.Lambda(lambda x: x),
-            transforms.ToTensor(),
-            transforms.Normalize([0.5], [0.5]),
-        ]
-    )
+    # Data preprocessing transformations. With a resolution schedule the images of each phase are resized once,
+    # up front, so the epochs of a low-resolution phase decode small images.
+    progressive = bool(args.resolution_schedule)
+
+    def build_train_transforms(resolution):
+        return transforms.Compose(
+            ([] if progressive else [transforms.Resize(resolution, interpolation=interpolation)])
+            + [
+                transforms.CenterCrop(resolution) if args.center_crop else transforms.RandomCrop(resolution),
+                transforms.RandomHorizontalFlip() if args.random_flip else transforms.Lambda(lambda x: x),
+                transforms.ToTensor(),
+                transforms.Normalize([0.5], [0.5]),
+            ]
+        )
 
     def unwrap_model(model):
         model = accelerator.unwrap_model(model)
         model = model._orig_mod if is_compiled_module(model) else model
         return model
 
-    def preprocess_train(examples):
-        images = [image.convert("RGB") for image in examples[image_column]]
-        examples["pixel_values"] = [train_transforms(image) for image in images]
+    def make_preprocess_images(train_transforms):
+        def preprocess_images(examples):
+            images = [image.convert("RGB") for image in examples[image_column]]
+            examples["pixel_values"] = [train_transforms(image) for image in images]
+            return examples
+
+        return preprocess_images
+
+    def preprocess_captions(examples):
         examples["input_ids"] = tokenize_captions(examples)
         return examples
 
+    def with_inputs(train_split, resolution, images=True, captions=True):
+        """`train_split` producing only the requested model inputs, from only the columns they are built from.
+
+        Without `images` the images are neither decoded nor transformed, without `captions` nothing is tokenized.
+        """
+        steps, columns = [], []
+        if images:
+            steps.append(make_preprocess_images(build_train_transforms(resolution)))
+            columns.append(image_column)
+        if captions:
+            steps.append(preprocess_captions)
+            columns.append(caption_column)
+        if not steps:
+            return train_split
+
+        def preprocess_train(examples):
+            for step in steps:
+                examples = step(examples)
+            return examples
+
+        return train_split.with_transform(preprocess_train, columns=columns)
+
+    def resize_dataset(train_split, resolution):
+        resize = transforms.Resize(resolution, interpolation=interpolation)
+
+        def resize_images(examples):
+            examples[image_column] = [resize(image.convert("RGB")) for image in examples[image_column]]
+            return examples
+
+        return train_split.map(resize_images, batched=True, desc=f"Resizing images to {resolution}")
+
+    phases = training_phases(args)
     with accelerator.main_process_first():
         if args.max_train_samples is not None:
             dataset["train"] = dataset["train"].shuffle(seed=args.seed).select(range(args.max_train_samples))
         # Set the training transforms
-        train_dataset = dataset["train"].with_transform(preprocess_train)
+        phase_splits = [
+            resize_dataset(dataset["train"], phase.resolution) if progressive else dataset["train"] for phase in phases
+        ]
+        phase_datasets = [with_inputs(split, phase.resolution) for split, phase in zip(phase_splits, phases)]
+        train_dataset = phase_datasets[-1]
 
     def collate_fn(examples):
-        pixel_values = torch.stack([example["pixel_values"] for example in examples])
-        pixel_values = pixel_values.to(memory_format=torch.contiguous_format).float()
-        input_ids = torch.stack([example["input_ids"] for example in examples])
-        return {"pixel_values": pixel_values, "input_ids": input_ids}
+        batch = {key: torch.stack([example[key] for example in examples]) for key in BATCH_KEYS if key in examples[0]}
+        if "pixel_values" in batch:
+            # Stays float32 on the host; the device prefetcher casts to `weight_dtype` as part of the transfer.
+            batch["pixel_values"] = batch["pixel_values"].to(memory_format=torch.contiguous_format)
+        return batch
+
+    def encode_dataset(phase_dataset, batch_size, latents, text):
+        """Per-example VAE latent distributions and/or text embeddings of `phase_dataset`, kept on the host."""
+        keys = [key for key, wanted in (("latent_parameters", latents), ("encoder_hidden_states", text)) if wanted]
+        encodings = {key: [] for key in keys}
+        loader = torch.utils.data.DataLoader(
+            phase_dataset, batch_size=batch_size, collate_fn=collate_fn, num_workers=args.dataloader_num_workers
+        )
+        with torch.no_grad():
+            for batch in tqdm(loader, desc="Caching encodings", disable=not accelerator.is_local_main_process):
+                if latents:
+                    pixel_values = batch["pixel_values"].to(accelerator.device, dtype=weight_dtype)
+                    encodings["latent_parameters"].extend(vae.encode(pixel_values).latent_dist.parameters.cpu())
+                if text:
+                    input_ids = batch["input_ids"].to(accelerator.device)
+                    encodings["encoder_hidden_states"].extend(text_encoder(input_ids, return_dict=False)[0].cpu())
+        return encodings
+
+    throughput = ThroughputMeter()
+    if args.cache_latents or args.cache_text_embeddings:
+        cache_start = time.perf_counter()
+        text_embeddings = None
+        for i, (split, phase) in enumerate(zip(phase_splits, phases)):
+            encode_text = args.cache_text_embeddings and text_embeddings is None
+            encodings = {}
+            if args.cache_latents or encode_text:
+                inputs = with_inputs(split, phase.resolution, images=args.cache_latents, captions=encode_text)
+                encodings = encode_dataset(inputs, phase.batch_size, args.cache_latents, encode_text)
+            # Captions do not depend on the resolution: the first phase's embeddings serve every phase.
+            if args.cache_text_embeddings:
+                text_embeddings = encodings.setdefault("encoder_hidden_states", text_embeddings)
+            # Training only decodes, transforms or tokenizes what is still missing.
+            phase_datasets[i] = EncodedDataset(
+                with_inputs(
+                    split,
+                    phase.resolution,
+                    images=not args.cache_latents,
+                    captions=not args.cache_text_embeddings,
+                ),
+                encodings,
+            )
+        throughput.cache_s = time.perf_counter() - cache_start
+        cached = sorted(set().union(*(phase_dataset.encodings for phase_dataset in phase_datasets)))
+        logger.info(
+            f"Cached {', '.join(cached)} of {len(train_dataset)} examples for {len(phases)} phase(s)"
+            f" in {throughput.cache_s:.1f}s"
+        )
 
-    # DataLoaders creation:
-    train_dataloader = torch.utils.data.DataLoader(
-        train_dataset,
-        shuffle=True,
-        collate_fn=collate_fn,
-        batch_size=args.train_batch_size,
-        num_workers=args.dataloader_num_workers,
-    )
+    # DataLoaders creation, one per phase:
+    for phase, phase_dataset in zip(phases, phase_datasets):
+        phase.dataloader = torch.utils.data.DataLoader(
+            phase_dataset,
+            shuffle=True,
+            collate_fn=collate_fn,
+            batch_size=phase.batch_size,
+            num_workers=args.dataloader_num_workers,
+            pin_memory=accelerator.device.type == "cuda",
+            persistent_workers=args.dataloader_num_workers > 0,
+        )
+    train_dataloader = phases[-1].dataloader
 
     # Scheduler and math around the number of training steps.
     # Check the PR https://github.com/huggingface/diffusers/pull/8312 for detailed explanation.
@@ -729,13 +1284,23 @@ def main():
         num_training_steps=num_training_steps_for_scheduler,
     )
 
-    # Prepare everything with our `accelerator`.
-    unet, optimizer, train_dataloader, lr_scheduler = accelerator.prepare(
-        unet, optimizer, train_dataloader, lr_scheduler
+    # Prepare everything with our `accelerator`. Every phase's dataloader is prepared up front so the prepared
+    # objects are the same on a fresh start and on resume.
+    # Batches are moved to the device by `DevicePrefetcher`, not by the prepared dataloaders.
+    unet, optimizer, *phase_dataloaders, lr_scheduler = accelerator.prepare(
+        unet,
+        optimizer,
+        *[phase.dataloader for phase in phases],
+        lr_scheduler,
+        device_placement=[True, True] + [False] * len(phases) + [True],
     )
+    for phase, phase_dataloader in zip(phases, phase_dataloaders):
+        phase.dataloader = phase_dataloader
+        phase.steps_per_epoch = math.ceil(len(phase_dataloader) / args.gradient_accumulation_steps)
+    train_dataloader = phases[-1].dataloader
 
     # We need to recalculate our total training steps as the size of the training dataloader may have changed.
-    num_update_steps_per_epoch = math.ceil(len(train_dataloader) / args.gradient_accumulation_steps)
+    num_update_steps_per_epoch = phases[-1].steps_per_epoch
     if args.max_train_steps is None:
         args.max_train_steps = args.num_train_epochs * num_update_steps_per_epoch
         if num_training_steps_for_scheduler != args.max_train_steps * accelerator.num_processes:
@@ -745,7 +1310,7 @@ def main():
                 f"This inconsistency may result in the learning rate scheduler not functioning properly."
             )
     # Afterwards we recalculate our number of training epochs
-    args.num_train_epochs = math.ceil(args.max_train_steps / num_update_steps_per_epoch)
+    args.num_train_epochs = assign_phase_steps(phases, args.max_train_steps)
 
     # We need to initialize the trackers we use, and also store our configuration.
     # The trackers initializes automatically on the main process.
@@ -759,6 +1324,12 @@ def main():
     logger.info(f"  Num examples = {len(train_dataset)}")
     logger.info(f"  Num Epochs = {args.num_train_epochs}")
     logger.info(f"  Instantaneous batch size per device = {args.train_batch_size}")
+    if progressive:
+        for i, phase in enumerate(phases):
+            logger.info(
+                f"  Phase {i}: resolution {phase.resolution}, batch size {phase.batch_size},"
+                f" steps {phase.start_step}-{phase.end_step}, {phase.num_epochs} epochs"
+            )
     logger.info(f"  Total train batch size (w. parallel, distributed & accumulation) = {total_batch_size}")
     logger.info(f"  Gradient Accumulation steps = {args.gradient_accumulation_steps}")
     logger.info(f"  Total optimization steps = {args.max_train_steps}")
@@ -788,7 +1359,18 @@ def main():
             global_step = int(path.split("-")[1])
 
             initial_global_step = global_step
-            first_epoch = global_step // num_update_steps_per_epoch
+            # Resume in the phase (and the epoch within it) that contains the checkpoint's step.
+            phase = phases[phase_for_step(phases, global_step)]
+            first_epoch = phase.first_epoch + (global_step - phase.start_step) // phase.steps_per_epoch
+            phase_file = os.path.join(args.output_dir, path, "phase.json")
+            if os.path.exists(phase_file):
+                with open(phase_file) as f:
+                    saved_phase = json.load(f)
+                if saved_phase["resolution_schedule"] != args.resolution_schedule:
+                    logger.warning(
+                        f"Checkpoint was saved with resolution schedule {saved_phase['resolution_schedule']}, resuming"
+                        f" with {args.resolution_schedule}: the phase is recomputed from step {global_step}."
+                    )
     else:
         initial_global_step = 0
 
@@ -800,13 +1382,44 @@ def main():
         disable=not accelerator.is_local_main_process,
     )
 
+    prefetched_batches = None
+    current_phase_index = None
     for epoch in range(first_epoch, args.num_train_epochs):
+        # Epochs are laid out per phase, but a resumed run does not replay the rest of its checkpoint's epoch, so
+        # it can finish a phase early: the phase is the one of the next step, not the one of the epoch.
+        if global_step >= args.max_train_steps:
+            break
+        phase_index = phase_for_step(phases, global_step)
+        phase = phases[phase_index]
+        if phase_index != current_phase_index:
+            if current_phase_index is not None:
+                release_workers(phases[current_phase_index].dataloader)
+            current_phase_index = phase_index
+            if progressive:
+                logger.info(
+                    f"Phase {phase_index}: training at resolution {phase.resolution} with batch size {phase.batch_size}"
+                )
+                accelerator.log({"resolution": phase.resolution, "batch_size": phase.batch_size}, step=global_step)
+        epoch_batches = DevicePrefetcher(
+            prefetched_batches or phase.dataloader,
+            accelerator.device,
+            weight_dtype,
+            args.device_prefetch_batches,
+            loader=phase.dataloader,
+        )
+        prefetched_batches = None
+
         unet.train()
         train_loss = 0.0
-        for step, batch in enumerate(train_dataloader):
+        throughput.start_epoch()
+        timed_batches = throughput.timed(epoch_batches)
+        for step, batch in enumerate(timed_batches):
             with accelerator.accumulate(unet):
                 # Convert images to latent space
-                latents = vae.encode(batch["pixel_values"].to(dtype=weight_dtype)).latent_dist.sample()
+                if "latent_parameters" in batch:
+                    latents = DiagonalGaussianDistribution(batch["latent_parameters"]).sample()
+                else:
+                    latents = vae.encode(batch["pixel_values"]).latent_dist.sample()
                 latents = latents * vae.config.scaling_factor
 
                 # Sample noise that we'll add to the latents
@@ -818,6 +1431,7 @@ def main():
                     )
 
                 bsz = latents.shape[0]
+                throughput.samples += bsz
                 # Sample a random timestep for each image
                 timesteps = torch.randint(0, noise_scheduler.config.num_train_timesteps, (bsz,), device=latents.device)
                 timesteps = timesteps.long()
@@ -827,7 +1441,10 @@ def main():
                 noisy_latents = noise_scheduler.add_noise(latents, noise, timesteps)
 
                 # Get the text embedding for conditioning
-                encoder_hidden_states = text_encoder(batch["input_ids"], return_dict=False)[0]
+                if "encoder_hidden_states" in batch:
+                    encoder_hidden_states = batch["encoder_hidden_states"]
+                else:
+                    encoder_hidden_states = text_encoder(batch["input_ids"], return_dict=False)[0]
 
                 # Get the target for loss depending on the prediction type
                 if args.prediction_type is not None:
@@ -864,7 +1481,7 @@ def main():
                     loss = loss.mean()
 
                 # Gather the losses across all processes for logging (if we use distributed training).
-                avg_loss = accelerator.gather(loss.repeat(args.train_batch_size)).mean()
+                avg_loss = accelerator.gather(loss.repeat(phase.batch_size)).mean()
                 train_loss += avg_loss.item() / args.gradient_accumulation_steps
 
                 # Backpropagate
@@ -880,6 +1497,7 @@ def main():
             if accelerator.sync_gradients:
                 progress_bar.update(1)
                 global_step += 1
+                throughput.step()
                 accelerator.log({"train_loss": train_loss}, step=global_step)
                 train_loss = 0.0
 
@@ -907,6 +1525,16 @@ def main():
 
                         save_path = os.path.join(args.output_dir, f"checkpoint-{global_step}")
                         accelerator.save_state(save_path)
+                        with open(os.path.join(save_path, "phase.json"), "w") as f:
+                            json.dump(
+                                {
+                                    "phase": phase_index,
+                                    "resolution": phase.resolution,
+                                    "batch_size": phase.batch_size,
+                                    "resolution_schedule": args.resolution_schedule,
+                                },
+                                f,
+                            )
 
                         unwrapped_unet = unwrap_model(unet)
                         unet_lora_state_dict = convert_state_dict_to_diffusers(
@@ -924,18 +1552,30 @@ def main():
             logs = {"step_loss": loss.detach().item(), "lr": lr_scheduler.get_last_lr()[0]}
             progress_bar.set_postfix(**logs)
 
-            if global_step >= args.max_train_steps:
+            # The last phase ends at `max_train_steps`.
+            if global_step >= phase.end_step:
+                close_epoch(timed_batches, phase.dataloader)
                 break
+        throughput.end_epoch()
 
         if accelerator.is_main_process:
             if args.validation_prompt is not None and epoch % args.validation_epochs == 0:
-                # create pipeline
-                pipeline = DiffusionPipeline.from_pretrained(
-                    args.pretrained_model_name_or_path,
-                    unet=unwrap_model(unet),
-                    revision=args.revision,
-                    variant=args.variant,
-                    torch_dtype=weight_dtype,
+                # Start loading the next epoch while the device is busy with validation. Restricted to a single
+                # process so the dataloader's RNG synchronisation never runs on a helper thread.
+                if (
+                    args.validation_prefetch_batches > 0
+                    and accelerator.num_processes == 1
+                    and epoch + 1 < args.num_train_epochs
+                    and global_step < args.max_train_steps
+                ):
+                    next_phase = phases[phase_for_step(phases, global_step)]
+                    prefetched_batches = BackgroundBatchFetcher(
+                        next_phase.dataloader, args.validation_prefetch_batches
+                    )
+
+                # create pipeline from the components already on device
+                pipeline = build_validation_pipeline(
+                    unwrap_model(unet), vae, text_encoder, tokenizer, validation_scheduler
                 )
                 images = log_validation(pipeline, args, accelerator, epoch)
 
@@ -945,6 +1585,12 @@ def main():
     # Save the lora layers
     accelerator.wait_for_everyone()
     if accelerator.is_main_process:
+        if args.throughput_report is not None:
+            report = throughput.report()
+            logger.info(f"Training throughput: {report}")
+            with open(args.throughput_report, "w") as f:
+                json.dump(report, f, indent=2)
+
         unet = unet.to(torch.float32)
 
         unwrapped_unet = unwrap_model(unet)
@@ -960,6 +1606,7 @@ def main():
         if args.validation_prompt is not None:
             pipeline = DiffusionPipeline.from_pretrained(
                 args.pretrained_model_name_or_path,
+                scheduler=validation_scheduler,
                 revision=args.revision,
                 variant=args.variant,
                 torch_dtype=weight_dtype,